@@ -0,0 +1,123 @@
+"""
+Detection of slide build-up frames for the PDF Processor Suite.
+
+Decks exported from presentation software repeat a slide once per animation step, each page adding
+a bullet or a picture to the one before, and printing every step wastes paper and processing time.
+A page is a build frame when the next selected page of the same file draws everything it draws:
+checked first on the content streams (the next page's drawing operations include all of the page's)
+and, where that is inconclusive, on small grayscale renders (the next page only adds ink where the
+page was blank). Only the final frame of each build sequence is kept.
+"""
+import itertools
+import os
+import subprocess
+from collections import Counter
+import numpy as np
+from pypdf import PdfReader
+from pypdf.generic import IndirectObject
+from pdf_engine import iter_page_rasters, group_page_runs, format_page_spec
+from pdf_trace import span
+
+# Resolution of the renders compared when the content streams do not decide; a slide is about 360x270 pixels.
+BUILD_CHECK_DPI = 36
+# Gray levels by which a pixel must differ from the background to count as ink, or between frames to count as changed.
+INK_TOLERANCE = 32
+# Share of a frame's ink the next frame may alter (antialiasing next to an added bullet) and still build on it.
+MAX_ALTERED_INK = 0.005
+# Frames with less ink than this share of the page are blank or nearly so; they are never dropped.
+MIN_INK = 0.002
+# Operators that put text or images on the page; frames drawing neither (a bare background) are never dropped.
+CONTENT_OPERATORS = {b'Tj', b'TJ', b"'", b'"', b'Do', b'INLINE IMAGE'}
+IMAGE_OPERATORS = {b'Do', b'INLINE IMAGE'}
+
+def page_operations(page):
+    """
+    Returns the drawing operations of a pypdf page as a Counter of (operator, operands). Fonts and
+    XObjects are identified by the object they name rather than by their resource name, which
+    another page may give to a different font or image.
+    """
+    contents = page.get_contents()
+    if contents is None: return Counter()
+    resources = page.get('/Resources'); resources = resources.get_object() if resources is not None else {}
+    named = {operator: resources[key].get_object() for operator, key in ((b'Do', '/XObject'), (b'Tf', '/Font')) if key in resources}
+    operations = Counter()
+    for operands, operator in contents.operations:
+        if operator in named and operands:
+            target = named[operator].raw_get(operands[0]) if operands[0] in named[operator] else None
+            operands = [target.idnum if isinstance(target, IndirectObject) else repr(target)] + list(operands[1:])
+        operations[(operator, repr(operands))] += 1
+    return operations
+
+def builds_on(operations, next_operations):
+    """Returns whether the page with next_operations draws every operation of the page with operations, which draws some text or image."""
+    return any(operator in CONTENT_OPERATORS for operator, _ in operations) and operations <= next_operations
+
+def may_build_on(operations, next_operations):
+    """
+    Returns whether the content streams leave open that the next page builds on the page: it draws
+    text or images, and every image it draws is drawn by the next page too. Slides whose picture
+    is replaced (scanned decks) are not builds, however alike their small renders look.
+    """
+    return (any(operator in CONTENT_OPERATORS for operator, _ in operations)
+            and all(next_operations[operation] >= count for operation, count in operations.items() if operation[0] in IMAGE_OPERATORS))
+
+def raster_builds_on(frame, next_frame):
+    """
+    Returns whether next_frame (a small gray render) only adds ink to frame: the pixels where frame
+    has ink stay as they are, up to MAX_ALTERED_INK of them, and frame is not blank.
+    """
+    if frame.shape != next_frame.shape: return False
+    background = np.bincount(frame.ravel(), minlength=256).argmax()
+    ink = np.abs(frame.astype(np.int16) - background) > INK_TOLERANCE
+    if ink.mean() < MIN_INK: return False
+    altered = (np.abs(frame.astype(np.int16) - next_frame) > INK_TOLERANCE) & ink
+    return altered.sum() <= MAX_ALTERED_INK * ink.sum()
+
+def render_frames(gs_executable, pages, dpi=BUILD_CHECK_DPI):
+    """Returns {(path, page_num): gray raster} of pages rendered at dpi, one Ghostscript call per run; pages Ghostscript fails on are left out."""
+    frames = {}
+    for pdf_path, page_nums, run_dpi in group_page_runs(pages, [dpi] * len(pages)):
+        try:
+            for page_num, raster in zip(page_nums, iter_page_rasters(gs_executable, pdf_path, page_nums, run_dpi, gray=True)): frames[(pdf_path, page_num)] = raster.copy()
+        except (OSError, ValueError, subprocess.CalledProcessError): pass # Undecided pages are kept.
+    return frames
+
+def find_build_frames(pages_to_process, gs_executable=None):
+    """
+    Returns {(path, page_num): final_page_num} for the pages of pages_to_process that are build
+    frames, each mapped to the last frame of its sequence. Only consecutive selected pages of one
+    file are compared. Without gs_executable, only the content streams are checked.
+    """
+    readers = {}; operations = {}
+    try:
+        with span('content_check', pages=len(pages_to_process)):
+            for pdf_path, page_num in pages_to_process:
+                try:
+                    if pdf_path not in readers: readers[pdf_path] = PdfReader(pdf_path)
+                    operations[(pdf_path, page_num)] = page_operations(readers[pdf_path].pages[page_num - 1])
+                except Exception: operations[(pdf_path, page_num)] = Counter() # Unreadable here; never dropped.
+    finally:
+        for reader in readers.values(): reader.stream.close()
+    pairs = [(page, next_page) for page, next_page in zip(pages_to_process, pages_to_process[1:]) if page[0] == next_page[0]]
+    builds = {page for page, next_page in pairs if builds_on(operations[page], operations[next_page])}
+    undecided = [(page, next_page) for page, next_page in pairs if page not in builds and may_build_on(operations[page], operations[next_page])]
+    if gs_executable and undecided:
+        needed = set(itertools.chain.from_iterable(undecided))
+        with span('raster_check', pages=len(needed)): frames = render_frames(gs_executable, [page for page in pages_to_process if page in needed])
+        builds.update(page for page, next_page in undecided if page in frames and next_page in frames and raster_builds_on(frames[page], frames[next_page]))
+    # Walk backwards so every frame of a sequence points at its final page.
+    final_pages = {}
+    for page, next_page in reversed(pairs):
+        if page in builds: final_pages[page] = final_pages.get(next_page, next_page[1])
+    return dict(reversed(final_pages.items()))
+
+def dropped_page_specs(final_pages):
+    """Returns {path: Page Editor spec} of the build frames in final_pages, e.g. {"deck.pdf": "2-3, 6"}."""
+    by_file = {}
+    for pdf_path, page_num in final_pages: by_file.setdefault(pdf_path, set()).add(page_num)
+    return {pdf_path: format_page_spec(page_nums) for pdf_path, page_nums in by_file.items()}
+
+def build_report(final_pages):
+    """Returns one line per file naming the dropped build frames and the final frames that were kept."""
+    return [f"{os.path.basename(pdf_path)}: dropped {spec} (final frames {format_page_spec({final_pages[page] for page in final_pages if page[0] == pdf_path})} kept)"
+            for pdf_path, spec in dropped_page_specs(final_pages).items()]
@@ -0,0 +1,197 @@
+"""
+In-process Ghostscript for the PDF Processor Suite.
+
+Every render otherwise starts the Ghostscript executable, which initializes its interpreter and
+loads its fonts again each time; for jobs of thousands of small pages that startup is most of the
+work. With the Ghostscript library in use (see use_gs_library), each process keeps one initialized
+interpreter alive for the whole job (so a pool of N workers keeps N) and renders with
+gsapi_run_string. The PNM pages it writes to its stdout are passed through a pipe, so they are read
+exactly like the executable's output. Where the library cannot be found or loaded, or is older than
+9.50 (no gsapi_add_control_path, which -dSAFER needs to open the input files), rendering falls back
+to the executable.
+"""
+import atexit
+import ctypes
+import ctypes.util
+import glob
+import os
+import sys
+import threading
+
+# "auto" (look next to the Ghostscript executable, then on the library path) or the path of the library to use.
+GS_LIBRARY_ENV = 'PDF_PROCESSOR_GS_LIBRARY'
+GS_ARG_ENCODING_UTF8 = 1
+GS_PERMIT_FILE_READING = 0
+# Library names tried by find_gs_library, newest first.
+WINDOWS_LIBRARY_NAMES = ("gsdll64.dll", "gsdll32.dll")
+UNIX_LIBRARY_PATTERNS = ("libgs.so*", "libgs.*.dylib", "libgs.dylib")
+
+if sys.platform == "win32": LibraryLoader, CallbackType = ctypes.WinDLL, ctypes.WINFUNCTYPE # gsapi is __stdcall on Windows
+else: LibraryLoader, CallbackType = ctypes.CDLL, ctypes.CFUNCTYPE
+OutputCallback = CallbackType(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int)
+InputCallback = CallbackType(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int)
+PollCallback = CallbackType(ctypes.c_int, ctypes.c_void_p)
+
+# The loaded library of this process (None: render with the executable), its interpreter, and the
+# lock held while the interpreter renders; a render that finds it busy uses the executable instead.
+gs_api = None
+interpreter = None
+interpreter_lock = threading.Lock()
+
+def find_gs_library(gs_executable=None):
+    """Returns the path of the Ghostscript library that belongs to gs_executable, or of any on the library path, or None."""
+    if gs_executable:
+        gs_bin = os.path.dirname(os.path.abspath(gs_executable))
+        if sys.platform == "win32": candidates = [os.path.join(gs_bin, name) for name in WINDOWS_LIBRARY_NAMES]
+        else: candidates = sorted((path for pattern in UNIX_LIBRARY_PATTERNS for path in glob.glob(os.path.join(gs_bin, os.pardir, 'lib', pattern))), reverse=True)
+        for path in candidates:
+            if os.path.isfile(path): return os.path.normpath(path)
+    for name in (("gsdll64", "gsdll32") if sys.platform == "win32" else ("gs",)):
+        if (path := ctypes.util.find_library(name)): return path
+    return None
+
+def load_gs_api(library_path):
+    """Loads the library at library_path and declares the gsapi functions used here. Raises OSError or AttributeError when it is unusable."""
+    lib = LibraryLoader(library_path)
+    declarations = {
+        'gsapi_new_instance': [ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p],
+        'gsapi_set_arg_encoding': [ctypes.c_void_p, ctypes.c_int],
+        'gsapi_set_stdio': [ctypes.c_void_p, InputCallback, OutputCallback, OutputCallback],
+        'gsapi_set_poll': [ctypes.c_void_p, PollCallback],
+        'gsapi_init_with_args': [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_char_p)],
+        'gsapi_add_control_path': [ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p],
+        'gsapi_remove_control_path': [ctypes.c_void_p, ctypes.c_int, ctypes.c_char_p],
+        'gsapi_run_string_with_length': [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint, ctypes.c_int, ctypes.POINTER(ctypes.c_int)],
+        'gsapi_exit': [ctypes.c_void_p],
+    }
+    for name, argtypes in declarations.items(): function = getattr(lib, name); function.argtypes = argtypes; function.restype = ctypes.c_int
+    lib.gsapi_delete_instance.argtypes = [ctypes.c_void_p]; lib.gsapi_delete_instance.restype = None
+    return lib
+
+def use_gs_library(library_path):
+    """
+    Renders in-process with the Ghostscript library at library_path from now on (None: with the
+    executable again). Returns library_path, or None when the library cannot be loaded.
+    """
+    global gs_api
+    with interpreter_lock:
+        close_interpreter()
+        try: gs_api = load_gs_api(library_path) if library_path else None
+        except (OSError, AttributeError): gs_api = None # Missing, or older than 9.50: keep to the executable.
+        if gs_api is not None: gs_api.path = library_path
+    return library_path if gs_api is not None else None
+
+def gs_library_path():
+    """Returns the path of the library this process renders with, or None; pool workers are handed it when they start."""
+    return gs_api.path if gs_api is not None else None
+
+def gs_library_from_environment(gs_executable=None):
+    """Starts using the library named by PDF_PROCESSOR_GS_LIBRARY ("auto" finds it). Returns its path, or None."""
+    setting = os.environ.get(GS_LIBRARY_ENV)
+    if not setting: return None
+    return use_gs_library(find_gs_library(gs_executable) if setting.lower() == 'auto' else setting)
+
+class GsInterpreter:
+    """One initialized Ghostscript instance writing device pages (ppmraw or pgmraw) to its stdout."""
+    def __init__(self, api, device):
+        self.api = api; self.device = device; self.render = None
+        # ctypes callbacks must outlive the instance that calls them.
+        self.callbacks = (InputCallback(lambda handle, buf, length: 0), OutputCallback(self.write_output), OutputCallback(self.write_messages), PollCallback(self.poll))
+        self.instance = ctypes.c_void_p()
+        if api.gsapi_new_instance(ctypes.byref(self.instance), None) < 0: raise OSError("Ghostscript library: no instance could be created.")
+        try:
+            api.gsapi_set_arg_encoding(self.instance, GS_ARG_ENCODING_UTF8)
+            api.gsapi_set_stdio(self.instance, *self.callbacks[:3]); api.gsapi_set_poll(self.instance, self.callbacks[3])
+            # -sstdout=%stderr keeps Ghostscript's own messages out of the raster stream.
+            args = [b'gs', b'-dQUIET', b'-dSAFER', b'-dBATCH', b'-dNOPAUSE', b'-sstdout=%stderr', f'-sDEVICE={device}'.encode(), b'-r72', b'-sOutputFile=-']
+            if (code := api.gsapi_init_with_args(self.instance, len(args), (ctypes.c_char_p * len(args))(*args))) < 0: raise OSError(f"Ghostscript library: initialization failed ({code}).")
+        except BaseException: self.close(exit=False); raise
+
+    def write_output(self, handle, data, length):
+        """stdout callback: passes the raster bytes on to the render's pipe. A negative return stops Ghostscript."""
+        render = self.render
+        if render is None or render.killed: return -1
+        view = memoryview(ctypes.string_at(data, length)); written = 0
+        try:
+            while written < length: written += os.write(render.write_fd, view[written:])
+        except OSError: return -1 # The reader went away.
+        return length
+
+    def write_messages(self, handle, data, length):
+        if self.render is not None: self.render.stderr_file.write(ctypes.string_at(data, length))
+        return length
+
+    def poll(self, handle):
+        return -1 if self.render is not None and self.render.killed else 0
+
+    def run(self, render, pdf_path, page_nums, dpi):
+        """Renders page_nums of pdf_path at dpi for render; returns the gsapi code (negative on failure)."""
+        path = os.path.abspath(pdf_path).encode('utf-8'); exit_code = ctypes.c_int()
+        # The file name goes in as a hex string, so no character of it needs escaping.
+        program = (f"<< /HWResolution [{dpi} {dpi}] >> setpagedevice <{path.hex()}> (r) file runpdfbegin "
+                   + " ".join(f"{page_num} pdfgetpage pdfshowpage" for page_num in page_nums) + " runpdfend\n").encode()
+        self.render = render
+        self.api.gsapi_add_control_path(self.instance, GS_PERMIT_FILE_READING, path)
+        try: return self.api.gsapi_run_string_with_length(self.instance, program, len(program), 0, ctypes.byref(exit_code))
+        finally: self.api.gsapi_remove_control_path(self.instance, GS_PERMIT_FILE_READING, path); self.render = None
+
+    def close(self, exit=True):
+        if exit: self.api.gsapi_exit(self.instance)
+        self.api.gsapi_delete_instance(self.instance)
+
+def close_interpreter():
+    """Shuts this process's interpreter down; the next render starts a new one. Call with interpreter_lock held."""
+    global interpreter
+    if interpreter is not None: interpreter, closing = None, interpreter; closing.close()
+
+def reset_after_fork():
+    """A forked pool worker shuts the copy of the parent's interpreter down (unless it was mid-render) and starts its own."""
+    global interpreter, interpreter_lock
+    if interpreter_lock.acquire(blocking=False): close_interpreter()
+    interpreter = None; interpreter_lock = threading.Lock()
+
+atexit.register(lambda: interpreter_lock.acquire(timeout=1) and close_interpreter())
+if hasattr(os, 'register_at_fork'): os.register_at_fork(after_in_child=reset_after_fork)
+
+class LibraryRender:
+    """
+    One render by the in-process interpreter, with the parts of subprocess.Popen that
+    iter_page_rasters uses: the pages come out of stdout, poll()/wait() give the exit status and
+    kill() stops Ghostscript at its next output or poll.
+    """
+    def __init__(self, pdf_path, page_nums, dpi, stderr_file):
+        self.stderr_file = stderr_file; self.killed = False; self.returncode = None
+        read_fd, self.write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd, 'rb')
+        self.thread = threading.Thread(target=self.run, args=(pdf_path, page_nums, dpi), name='gs-library', daemon=True)
+
+    def run(self, pdf_path, page_nums, dpi):
+        try:
+            code = interpreter.run(self, pdf_path, page_nums, dpi)
+            # After an error or a kill the interpreter's state is unknown; the next render starts a fresh one.
+            if code < 0: close_interpreter()
+            self.returncode = 0 if code >= 0 else 1
+        except BaseException: close_interpreter(); self.returncode = 1
+        finally: os.close(self.write_fd); interpreter_lock.release()
+
+    def poll(self): return self.returncode
+    def wait(self): self.thread.join(); return self.returncode
+    def kill(self): self.killed = True
+
+def start_library_render(pdf_path, page_nums, dpi, device, stderr_file):
+    """
+    Starts rendering page_nums of pdf_path at dpi on this process's interpreter and returns the
+    LibraryRender, or None when the library is not in use or the interpreter is busy (another
+    thread is rendering); the caller then runs the executable.
+    """
+    global gs_api, interpreter
+    if gs_api is None or not interpreter_lock.acquire(blocking=False): return None
+    try:
+        if interpreter is not None and interpreter.device != device: close_interpreter()
+        if interpreter is None:
+            try: interpreter = GsInterpreter(gs_api, device)
+            except OSError: gs_api = None; raise # A library that cannot start an interpreter is not tried again.
+        render = LibraryRender(pdf_path, page_nums, dpi, stderr_file)
+    except OSError: interpreter_lock.release(); return None
+    render.thread.start()
+    return render
@@ -0,0 +1,145 @@
+"""
+Checkpointed, resumable jobs for the PDF Processor Suite.
+
+Processed pages are written in parts of CHECKPOINT_PAGES pages, each a PDF of its own, next to a
+small JSON journal that records the job's parameters and the parts finished so far. A job that
+fails, is cancelled or is killed keeps its finished parts; running the same job again (same input
+files, pages and options) picks the journal up and starts at the first page no part covers. The
+parts are concatenated into the output once every page is done, and the journal is removed.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from pdf_engine import open_page_writer, merge_pdfs, NupImageWriter, EncodingReport, JPEG_QUALITY
+from pdf_trace import span
+
+# Bump when the part format or the journal fields change, so old journals are not resumed.
+JOURNAL_VERSION = 1
+DEFAULT_JOURNAL_DIR = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'), 'PDFProcessorSuite', 'jobs')
+# Pages per checkpoint part, rounded up to whole n-up sheets; a crash loses at most the part being written.
+CHECKPOINT_PAGES = 25
+# Journals of jobs that were never resumed are removed after this long.
+MAX_JOURNAL_AGE_SECONDS = 14 * 24 * 3600
+
+def job_key(params, pages_to_process):
+    """Returns a hex digest of the job parameters, the pages, and every input file's path, size and modification time."""
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+    for path in sorted({path for path, _ in pages_to_process}):
+        stat = os.stat(path); digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    digest.update(json.dumps([[os.path.abspath(path), page_num] for path, page_num in pages_to_process]).encode())
+    return digest.hexdigest()[:32]
+
+class JobJournal:
+    """
+    Writes the processed pages of one job to checkpointed parts in job_dir. Pages before done_pages
+    are in finished parts already; add_page takes the rest in input order. Call close() when the job
+    is interrupted: the pages written so far become a finished part (on n-up sheets, only the full
+    ones), so a cancelled job loses nothing. A job that completes calls finish() instead. report adds up the EncodingReport of every part
+    finished in this run.
+    """
+    def __init__(self, job_dir, key, pages_per_sheet=1, checkpoint_pages=CHECKPOINT_PAGES, jpeg_quality=JPEG_QUALITY):
+        self.job_dir = job_dir; self.key = key; self.pages_per_sheet = int(pages_per_sheet); self.jpeg_quality = jpeg_quality
+        self.report = EncodingReport()
+        self.journal_path = os.path.join(job_dir, 'journal.json')
+        self.part_pages = math.ceil(checkpoint_pages / self.pages_per_sheet) * self.pages_per_sheet
+        self.parts = []; self.writer = None; self.part_file = None; self.writer_pages = 0
+        os.makedirs(job_dir, exist_ok=True)
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f: state = json.load(f)
+            if state.get('version') == JOURNAL_VERSION and state.get('key') == key:
+                # Keep finished parts up to the first one that went missing; later pages are redone.
+                for part in state.get('parts', []):
+                    if not os.path.exists(os.path.join(job_dir, part['file'])): break
+                    self.parts.append(part)
+        except (OSError, ValueError): pass # No journal yet, or a damaged one: start from the first page.
+        self.resumed_pages = self.done_pages
+
+    @property
+    def done_pages(self):
+        """Number of pages in finished parts."""
+        return sum(part['pages'] for part in self.parts)
+
+    def add_page(self, img):
+        """Adds the next processed page (anything the page writers take); finishes the part once it holds part_pages pages."""
+        if self.writer is None:
+            self.part_file = f"part-{len(self.parts) + 1:05d}.pdf"; self.writer_pages = 0
+            self.writer = open_page_writer(os.path.join(self.job_dir, self.part_file), self.pages_per_sheet, self.jpeg_quality)
+        try: self.writer.add_page(img)
+        except BaseException: self.drop_part(); raise # Interrupted halfway through a page, the part cannot be trusted.
+        self.writer_pages += 1
+        if self.writer_pages == self.part_pages: self.close()
+
+    def drop_part(self):
+        """Abandons the part being written; its pages are redone when the job resumes."""
+        writer, self.writer = self.writer, None
+        (writer.writer if isinstance(writer, NupImageWriter) else writer).file.close()
+        try: os.remove(os.path.join(self.job_dir, self.part_file))
+        except OSError: pass
+
+    def close(self, final=False):
+        """
+        Finishes the part being written and records it in the journal. A part that cannot be finished
+        (a full disk) is dropped and redone next time. final: the job has all its pages, so a
+        half-filled last n-up sheet goes into the part as well.
+        """
+        if self.writer is None: return
+        with span('checkpoint', part=len(self.parts) + 1, pages=self.writer_pages):
+            # On a checkpoint, a half-filled n-up sheet would be laid out differently on resume; its pages are redone instead.
+            pages = self.writer_pages - (self.writer.drop_partial_sheet() if not final and isinstance(self.writer, NupImageWriter) else 0)
+            if not pages: self.drop_part(); return
+            try: self.writer.close()
+            except Exception: self.drop_part(); return
+            self.report.add(self.writer.report); self.writer = None
+            self.parts.append({'file': self.part_file, 'pages': pages}); self.save()
+
+    def save(self):
+        """Writes the journal atomically, so a crash never leaves it half-written."""
+        stored = json.dumps({'version': JOURNAL_VERSION, 'key': self.key, 'parts': self.parts})
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.job_dir)
+        with os.fdopen(fd, 'w') as f: f.write(stored)
+        os.replace(temp_path, self.journal_path)
+
+    def finish(self, output_path, total_pages):
+        """
+        Closes the journal, last sheet included, and writes every finished part, in order, to
+        output_path. Raises ValueError when fewer than total_pages pages were written; the journal is
+        kept, so running the job again redoes the missing ones.
+        """
+        self.close(final=True)
+        if self.done_pages < total_pages:
+            if not self.done_pages: raise ValueError("Processing failed to produce any pages.")
+            raise ValueError(f"Only {self.done_pages} of {total_pages} pages were written; process the same files again to finish the rest.")
+        part_paths = [os.path.join(self.job_dir, part['file']) for part in self.parts]
+        if len(part_paths) == 1: shutil.copy(part_paths[0], output_path)
+        else:
+            with span('merge_parts', parts=len(part_paths)): merge_pdfs(part_paths, output_path)
+
+    def discard(self):
+        """Removes the journal and its parts; called once the job's output is saved."""
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+def remove_stale_journals(journal_dir, max_age=MAX_JOURNAL_AGE_SECONDS):
+    """Removes the journals in journal_dir that were last written more than max_age seconds ago."""
+    try: entries = list(os.scandir(journal_dir))
+    except OSError: return
+    for entry in entries:
+        try:
+            if entry.is_dir() and time.time() - entry.stat().st_mtime > max_age: shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError: pass
+
+def open_job_journal(params, pages_to_process, pages_per_sheet=1, journal_dir=DEFAULT_JOURNAL_DIR, resume=True, jpeg_quality=JPEG_QUALITY):
+    """
+    Returns the JobJournal for a job: params is a JSON-able dict of every option that changes the
+    output (layout, filter, resolutions...). An unfinished journal of the same job is resumed unless
+    resume is False. When journal_dir cannot be used the job runs from a temp folder, without resume.
+    """
+    key = job_key(params, pages_to_process)
+    remove_stale_journals(journal_dir)
+    job_dir = os.path.join(journal_dir, key)
+    if not resume: shutil.rmtree(job_dir, ignore_errors=True)
+    try: return JobJournal(job_dir, key, pages_per_sheet, jpeg_quality=jpeg_quality)
+    except OSError: return JobJournal(tempfile.mkdtemp(prefix='pdfjob-'), key, pages_per_sheet, jpeg_quality=jpeg_quality)
@@ -0,0 +1,142 @@
+"""
+Persistent on-disk cache of processed page images for the PDF Processor Suite.
+
+Pages are keyed by a hash of what they draw (content streams, resources and page boxes) plus the
+render and filter options, so re-running a deck with another layout or fewer pages skips both
+Ghostscript and the filter for every page already seen.
+"""
+import hashlib
+import io
+import os
+import tempfile
+from collections import OrderedDict
+from PIL import Image
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+# Bump when rendering or filtering changes, so stale images are never served.
+CACHE_VERSION = 3
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'), 'PDFProcessorSuite', 'page_cache')
+DEFAULT_CACHE_BYTES = 1024 ** 3
+# Page entries that decide how a page renders; everything else (annotations, structure, /Parent) is ignored.
+PAGE_KEYS = ('/Contents', '/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+# --- Page Fingerprints ---
+def object_digest(obj, memo):
+    """Returns a digest of a PDF object and everything it references; memo shares digests of indirect objects."""
+    if isinstance(obj, IndirectObject):
+        ref = (id(obj.pdf), obj.idnum, obj.generation)
+        if ref not in memo:
+            memo[ref] = b'cycle' # Stands in for the object while it is being hashed, so reference loops terminate.
+            memo[ref] = object_digest(obj.get_object(), memo)
+        return memo[ref]
+    digest = hashlib.sha256(type(obj).__name__.encode())
+    if isinstance(obj, DictionaryObject):
+        for key in sorted(obj):
+            if key != '/Parent': digest.update(key.encode() + object_digest(obj.raw_get(key), memo))
+        if isinstance(obj, StreamObject): digest.update(obj._data) # Raw stream bytes; decoding them would not change the key.
+    elif isinstance(obj, ArrayObject):
+        for item in obj: digest.update(object_digest(item, memo))
+    else:
+        digest.update(repr(obj).encode())
+    return digest.digest()
+
+def page_fingerprint(page, memo):
+    """Returns a digest of everything that decides how page renders."""
+    digest = hashlib.sha256()
+    for key in PAGE_KEYS:
+        if key in page: digest.update(key.encode() + object_digest(page.raw_get(key), memo))
+    return digest.digest()
+
+def encode_page(img):
+    """Returns img as the PNG file the cache stores. Pool workers call it, so the pages reach PageCache.put already encoded."""
+    buffer = io.BytesIO(); img.save(buffer, 'PNG', compress_level=1, dpi=img.info.get('dpi', (72, 72)))
+    return buffer.getvalue()
+
+# --- Cache ---
+class PageCache:
+    """
+    Content-addressed store of processed page images, one PNG per page, capped at max_bytes on disk.
+    The least recently used pages are evicted first; hits and misses are counted per instance.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir; self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # Oldest first; file modification times carry the LRU order between sessions.
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.png'): stat = entry.stat(); entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        self.index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.total_bytes = sum(self.index.values())
+
+    def path_for(self, key): return os.path.join(self.cache_dir, key + '.png')
+
+    def page_keys(self, pages_to_process, page_dpis, do_invert, do_monochrome, thresholds, rasterizer='ghostscript'):
+        """
+        Returns the cache key of every (path, page_num) in pages_to_process, rendered at the matching
+        entry of page_dpis by rasterizer (a resolved name, never "auto"), or None for pages that
+        cannot be read.
+        """
+        options = repr((CACHE_VERSION, bool(do_invert), bool(do_monochrome), tuple(thresholds) if do_monochrome else None, rasterizer)).encode()
+        readers = {}; memo = {}; keys = []
+        try:
+            for (pdf_path, page_num), dpi in zip(pages_to_process, page_dpis):
+                try:
+                    if pdf_path not in readers: readers[pdf_path] = PdfReader(pdf_path)
+                    keys.append(hashlib.sha256(options + repr(dpi).encode() + page_fingerprint(readers[pdf_path].pages[page_num - 1], memo)).hexdigest())
+                except Exception: keys.append(None) # Unreadable here; Ghostscript still gets its chance to render it.
+        finally:
+            for reader in readers.values(): reader.stream.close()
+        return keys
+
+    def __contains__(self, key): return key in self.index
+
+    def get(self, key):
+        """Returns the cached image for key, or None on a miss."""
+        if key not in self.index: self.misses += 1; return None
+        try:
+            with Image.open(self.path_for(key)) as img: img.load()
+        except OSError: # Removed or damaged behind our back.
+            self.total_bytes -= self.index.pop(key); self.misses += 1; return None
+        self.index.move_to_end(key); os.utime(self.path_for(key))
+        self.hits += 1
+        return img
+
+    def put(self, key, img, png=None):
+        """
+        Stores img under key, then evicts least recently used pages until the cache fits max_bytes
+        again. png: optional encode_page(img), when it was encoded elsewhere; only the write is left.
+        """
+        if key is None or key in self.index: return
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f: f.write(png if png is not None else encode_page(img))
+        os.replace(temp_path, self.path_for(key)) # Atomic, so a crash never leaves a half-written page behind.
+        self.index[key] = os.path.getsize(self.path_for(key)); self.total_bytes += self.index[key]
+        while self.total_bytes > self.max_bytes and len(self.index) > 1:
+            old_key, size = self.index.popitem(last=False); self.total_bytes -= size; self.evictions += 1
+            try: os.remove(self.path_for(old_key))
+            except OSError: pass
+
+    def clear(self):
+        """Removes every cached page."""
+        for key in list(self.index):
+            try: os.remove(self.path_for(key))
+            except OSError: pass
+        self.index.clear(); self.total_bytes = 0
+
+    def stats(self):
+        """Returns hit/miss counters and disk usage as a dict."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'pages': len(self.index), 'bytes': self.total_bytes}
+
+    def summary(self):
+        """Returns a one-line hit/miss report for status messages."""
+        stats = self.stats()
+        return f"Page cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['bytes'] / 1024 ** 2:.0f} MB on disk"
+
+def open_page_cache(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+    """Returns a PageCache, or None when the cache directory cannot be used (pages are then always rendered)."""
+    try: return PageCache(cache_dir, max_bytes)
+    except OSError: return None
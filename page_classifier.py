@@ -0,0 +1,59 @@
+"""
+Per-page auto mode for the PDF Processor Suite.
+
+Packs often mix dark-background slides with ordinary white handouts, and inverting the handouts
+turns them into black pages. classify_pages renders every page at a few DPI and estimates its
+background luminance and how much of it is dark or colored; only the pages that need it are then
+rendered and filtered, while the rest are copied unchanged and stay vector.
+"""
+import subprocess
+import numpy as np
+from pdf_engine import iter_page_rasters, group_page_runs, LUMA_WEIGHTS
+from pdf_trace import span
+
+# Resolution of the classification renders; a 10-inch slide is 90 pixels wide.
+CLASSIFY_DPI = 9
+# Backgrounds darker than this gray level are dark slides.
+DARK_BACKGROUND = 110
+# A light page that is more than this share dark (a big dark panel or photo) is treated as dark too.
+DARK_COVERAGE = 0.5
+# Pixels at least this saturated (max - min channel) count as colored.
+COLOR_SPREAD = 48
+# A light page with more than this share of colored pixels still needs the monochrome filter.
+COLOR_COVERAGE = 0.01
+
+def page_statistics(rgb):
+    """Returns (background luminance, dark share, colored share) of a small RGB render; the background is the median of the outermost pixels."""
+    luma = (rgb[..., 0] * LUMA_WEIGHTS[0] + rgb[..., 1] * LUMA_WEIGHTS[1] + rgb[..., 2] * LUMA_WEIGHTS[2] + 0x8000) >> 16
+    border = np.concatenate([luma[0], luma[-1], luma[:, 0], luma[:, -1]])
+    spread = rgb.max(axis=-1).astype(np.int16) - rgb.min(axis=-1)
+    return float(np.median(border)), float((luma < DARK_BACKGROUND).mean()), float((spread >= COLOR_SPREAD).mean())
+
+def needs_processing(statistics, do_invert, do_monochrome):
+    """
+    Returns whether a page with these page_statistics needs the raster filter. With inversion on
+    only dark pages do; light pages are left alone even when colorful. With only the monochrome
+    filter on, colored pages need it as well.
+    """
+    background, dark_share, color_share = statistics
+    dark = background < DARK_BACKGROUND or dark_share > DARK_COVERAGE
+    if do_invert: return dark
+    return do_monochrome and (dark or color_share > COLOR_COVERAGE)
+
+def classify_pages(gs_executable, pages_to_process, do_invert, do_monochrome, dpi=CLASSIFY_DPI):
+    """
+    Returns the set of (path, page_num) in pages_to_process that need rendering and filtering, to
+    pass to iter_processed_pages as raster_pages. Pages Ghostscript cannot preview are included,
+    so they get the full treatment as before.
+    """
+    raster_pages = set()
+    for pdf_path, page_nums, run_dpi in group_page_runs(pages_to_process, [dpi] * len(pages_to_process)):
+        classified = set()
+        try:
+            with span('classify', pages=len(page_nums)):
+                for page_num, rgb in zip(page_nums, iter_page_rasters(gs_executable, pdf_path, page_nums, run_dpi)):
+                    classified.add(page_num)
+                    if needs_processing(page_statistics(rgb), do_invert, do_monochrome): raster_pages.add((pdf_path, page_num))
+        except (OSError, ValueError, subprocess.CalledProcessError): pass # Unpreviewable pages fall through to the full filter below.
+        raster_pages.update((pdf_path, page_num) for page_num in page_nums if page_num not in classified)
+    return raster_pages
@@ -0,0 +1,243 @@
+"""
+Performance benchmark for the PDF Processor Suite pipeline, run on a synthetic corpus of lecture slides.
+
+Generates dark-themed slide decks (colored boxes with white text, embedded photos) of 10 to 2000
+pages, then times every stage of the GUI pipeline on its own: page collection, Ghostscript
+rendering, process_image_intelligently, image encoding, merging and n_up_layout, plus one full
+parallel run through pdf_cli.process_pdf. Reports pages/sec and peak memory per stage and flags
+regressions against a stored baseline.
+
+    python pdf_benchmark.py --save-baseline bench_baseline.json      # record a baseline
+    python pdf_benchmark.py --baseline bench_baseline.json           # compare; exit status 1 on regressions
+    python pdf_benchmark.py --sizes 10,100 --layout 4 --workers 4 --json
+
+The corpus is deterministic (seeded), so numbers are comparable between runs on the same machine.
+Needs Ghostscript on PATH (or --gs); nothing else beyond the app's own dependencies.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+from pdf_engine import iter_page_rasters, process_image_intelligently, ImagePdfWriter, merge_pdf_pages, group_page_runs, plan_page_dpis, CLASSIC_MONOCHROME, DEFAULT_WORKERS
+from pdf_cli import find_ghostscript_executable, collect_pages, n_up_layout, process_pdf, FILTERS
+try: import resource # Unix only; peak RSS is simply not reported elsewhere.
+except ImportError: resource = None
+
+CORPUS_SIZES = (10, 100, 500, 2000)
+# Bump when the generated slides change, so old corpus files are not reused.
+CORPUS_VERSION = 1
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), 'PDFProcessorSuite', 'bench_corpus')
+STAGES = ('collect', 'render', 'filter', 'encode', 'merge', 'n_up')
+# A stage regresses when it is this much slower (or hungrier) than the baseline...
+DEFAULT_TOLERANCE = 0.15
+# ...and by more than these absolute amounts, so tiny stages do not flag on timer noise.
+MIN_SECONDS_DELTA = 0.05
+MIN_MEMORY_DELTA_MB = 8
+
+# --- Synthetic Corpus ---
+SLIDE_WIDTH, SLIDE_HEIGHT = 960, 540 # 16:9, in points
+DARK_BACKGROUNDS = ((0.08, 0.09, 0.14), (0.12, 0.12, 0.12), (0.05, 0.15, 0.25), (0.18, 0.05, 0.12))
+BOX_COLORS = ((0.16, 0.42, 0.80), (0.85, 0.33, 0.10), (0.20, 0.60, 0.30), (0.55, 0.25, 0.70), (0.90, 0.75, 0.10))
+WORDS = ('signal', 'matrix', 'kernel', 'theorem', 'sample', 'vector', 'gradient', 'network', 'entropy', 'filter', 'lemma', 'proof', 'model', 'layer', 'cache', 'query')
+
+def pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def photo_xobject(rng, width=320, height=240):
+    """Returns a Flate-compressed RGB image XObject that looks like a photo: smooth gradients plus noise."""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [127 + 100 * np.sin(x / rng.uniform(20, 80) + rng.uniform(0, 6)) * np.cos(y / rng.uniform(20, 80)) for _ in range(3)]
+    pixels = np.stack(channels, axis=2) + np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 12, (height, width, 3))
+    image = DecodedStreamObject()
+    image.update({NameObject('/Type'): NameObject('/XObject'), NameObject('/Subtype'): NameObject('/Image'), NameObject('/Width'): NumberObject(width),
+                  NameObject('/Height'): NumberObject(height), NameObject('/ColorSpace'): NameObject('/DeviceRGB'), NameObject('/BitsPerComponent'): NumberObject(8)})
+    image.set_data(np.clip(pixels, 0, 255).astype(np.uint8).tobytes())
+    return image.flate_encode()
+
+def slide_content(rng, page_num, photo_names):
+    """Returns the content stream of one slide: a title bar, two to four text boxes and sometimes a photo."""
+    light = page_num % 7 == 0 # The odd light slide, as real decks have, so the filter sees both kinds.
+    background = (0.97, 0.97, 0.95) if light else rng.choice(DARK_BACKGROUNDS)
+    ops = [f"{background[0]} {background[1]} {background[2]} rg 0 0 {SLIDE_WIDTH} {SLIDE_HEIGHT} re f"]
+    title_color = rng.choice(BOX_COLORS)
+    ops.append(f"{title_color[0]} {title_color[1]} {title_color[2]} rg 0 {SLIDE_HEIGHT - 90} {SLIDE_WIDTH} 90 re f")
+    ops.append(f"BT 1 1 1 rg /F1 36 Tf 40 {SLIDE_HEIGHT - 60} Td ({pdf_text(f'{page_num}. ' + ' '.join(rng.choices(WORDS, k=4)).title())}) Tj ET")
+    photo = photo_names and page_num % 3 == 0
+    box_width = (SLIDE_WIDTH - 80 - (360 if photo else 0))
+    boxes = rng.randint(2, 4); box_height = (SLIDE_HEIGHT - 140) / boxes - 10
+    for i in range(boxes):
+        color = rng.choice(BOX_COLORS); top = SLIDE_HEIGHT - 110 - i * (box_height + 10)
+        ops.append(f"{color[0]} {color[1]} {color[2]} rg 40 {top - box_height:.1f} {box_width} {box_height:.1f} re f")
+        ops.append(f"BT 1 1 1 rg /F1 20 Tf 56 {top - 32:.1f} Td 24 TL")
+        for _ in range(max(1, int(box_height // 24) - 1)): ops.append(f"({pdf_text('- ' + ' '.join(rng.choices(WORDS, k=rng.randint(4, 9))))}) '")
+        ops.append("ET")
+    if photo: ops.append(f"q 320 0 0 240 {SLIDE_WIDTH - 360} 120 cm /{rng.choice(photo_names)} Do Q")
+    return '\n'.join(ops).encode()
+
+def generate_slide_deck(output_path, page_count, seed=0, photo_count=8):
+    """Writes a deterministic page_count-page lecture deck to output_path. photo_count distinct photos are shared by the slides."""
+    rng = random.Random(f"{seed}-{page_count}")
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({NameObject('/Type'): NameObject('/Font'), NameObject('/Subtype'): NameObject('/Type1'), NameObject('/BaseFont'): NameObject('/Helvetica')}))
+    photos = {f"Im{i}": writer._add_object(photo_xobject(rng)) for i in range(photo_count)}
+    resources = writer._add_object(DictionaryObject({NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+                                                     NameObject('/XObject'): DictionaryObject({NameObject('/' + name): ref for name, ref in photos.items()})}))
+    for page_num in range(1, page_count + 1):
+        page = writer.add_blank_page(SLIDE_WIDTH, SLIDE_HEIGHT)
+        content = DecodedStreamObject(); content.set_data(slide_content(rng, page_num, sorted(photos)))
+        page[NameObject('/Resources')] = resources; page[NameObject('/Contents')] = writer._add_object(content.flate_encode())
+    with open(output_path, 'wb') as f: writer.write(f)
+
+def build_corpus(corpus_dir=DEFAULT_CORPUS_DIR, sizes=CORPUS_SIZES, seed=0):
+    """Returns {page_count: path} for one deck per size, generating only the decks not already in corpus_dir."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = {}
+    for size in sizes:
+        path = os.path.join(corpus_dir, f"slides_v{CORPUS_VERSION}_s{seed}_{size}.pdf")
+        if not os.path.exists(path):
+            generate_slide_deck(path + '.tmp', size, seed); os.replace(path + '.tmp', path)
+        corpus[size] = path
+    return corpus
+
+# --- Stage Timing ---
+class StageTimer:
+    """Accumulates wall time and peak traced memory (Python objects and NumPy buffers) per named stage."""
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0); self.peak_bytes = dict.fromkeys(STAGES, 0)
+
+    def run(self, stage, func, *args):
+        """Calls func(*args), charging its time and peak memory to stage, and returns its result."""
+        tracemalloc.reset_peak(); start = time.perf_counter()
+        try: return func(*args)
+        finally:
+            self.seconds[stage] += time.perf_counter() - start
+            self.peak_bytes[stage] = max(self.peak_bytes[stage], tracemalloc.get_traced_memory()[1])
+
+def time_stages(pdf_path, work_dir, gs_executable, layout=1, do_invert=True, do_monochrome=True, thresholds=CLASSIC_MONOCHROME):
+    """
+    Runs the pipeline of run_processing_in_thread one stage at a time, in a single process so every
+    second is charged to the right stage, and returns a StageTimer. Rendering is timed as the wait
+    for Ghostscript's next raster. merge copies the source pages as the pass-through path does, and
+    n_up lays out the processed pages with n_up_layout (at 2-up when layout is 1, so it always runs).
+    """
+    timer = StageTimer()
+    tracemalloc.start()
+    try:
+        pages = timer.run('collect', collect_pages, [pdf_path])
+        page_dpis = plan_page_dpis(pages, layout)
+        single_pages_path = os.path.join(work_dir, 'pages.pdf')
+        with ImagePdfWriter(single_pages_path) as writer:
+            for run_path, page_nums, dpi in group_page_runs(pages, page_dpis):
+                rasters = iter_page_rasters(gs_executable, run_path, page_nums, dpi)
+                for _ in page_nums:
+                    raster = timer.run('render', next, rasters)
+                    img = timer.run('filter', process_image_intelligently, raster, do_invert, do_monochrome, thresholds); img.info['dpi'] = (dpi, dpi)
+                    timer.run('encode', writer.add_page, img)
+                    del raster, img
+                next(rasters, None) # Lets Ghostscript exit and checks its status.
+        timer.run('merge', merge_pdf_pages, pages, os.path.join(work_dir, 'merged.pdf'))
+        timer.run('n_up', n_up_layout, single_pages_path, os.path.join(work_dir, 'nup.pdf'), layout if layout > 1 else 2)
+    finally: tracemalloc.stop()
+    return timer
+
+def benchmark_deck(pdf_path, page_count, gs_executable, layout, do_invert, do_monochrome, thresholds, workers):
+    """Returns the per-stage and end-to-end results for one deck."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        timer = time_stages(pdf_path, work_dir, gs_executable, layout, do_invert, do_monochrome, thresholds)
+        # Neither cached pages nor a journal left by an interrupted run may shorten the timed run.
+        stats = process_pdf([pdf_path], os.path.join(work_dir, 'out.pdf'), layout, do_invert, do_monochrome, workers, thresholds=thresholds, use_cache=False, resume=False, gs_executable=gs_executable)
+    stages = {stage: {'seconds': round(timer.seconds[stage], 4), 'pages_per_second': round(page_count / timer.seconds[stage], 2) if timer.seconds[stage] else None,
+                      'peak_mb': round(timer.peak_bytes[stage] / 1024 ** 2, 1)} for stage in STAGES}
+    return {'pages': page_count, 'stages': stages, 'end_to_end': {'seconds': stats['seconds'], 'pages_per_second': stats['pages_per_second']}}
+
+def peak_rss_mb():
+    """Returns the peak resident memory of this process and of its children (Ghostscript, pool workers), in MB."""
+    if resource is None: return None
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024 # ru_maxrss is bytes on macOS, KiB on Linux
+    return {'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1), 'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)}
+
+def machine_info(gs_executable):
+    try: gs_version = subprocess.run([gs_executable, '--version'], capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): gs_version = None
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count(), 'ghostscript': gs_version}
+
+# --- Baseline Comparison ---
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns a message for every stage or end-to-end run of results that is slower, or uses more memory, than in baseline."""
+    regressions = []
+    for size, deck in results['decks'].items():
+        base_deck = baseline.get('decks', {}).get(size)
+        if not base_deck: continue
+        timings = [(stage, deck['stages'][stage], base_deck['stages'].get(stage)) for stage in STAGES] + [('end_to_end', deck['end_to_end'], base_deck.get('end_to_end'))]
+        for name, current, base in timings:
+            if not base: continue
+            if current['seconds'] > base['seconds'] * (1 + tolerance) and current['seconds'] - base['seconds'] > MIN_SECONDS_DELTA:
+                regressions.append(f"{size} pages, {name}: {current['seconds']:.2f}s vs {base['seconds']:.2f}s baseline (+{current['seconds'] / base['seconds'] - 1:.0%})")
+            if 'peak_mb' in current and base.get('peak_mb') and current['peak_mb'] > base['peak_mb'] * (1 + tolerance) and current['peak_mb'] - base['peak_mb'] > MIN_MEMORY_DELTA_MB:
+                regressions.append(f"{size} pages, {name}: peak {current['peak_mb']:.0f} MB vs {base['peak_mb']:.0f} MB baseline")
+    return regressions
+
+def format_report(results):
+    lines = []
+    for size, deck in results['decks'].items():
+        lines.append(f"{size} pages: end to end {deck['end_to_end']['seconds']:.2f}s ({deck['end_to_end']['pages_per_second']} pages/s, {results['options']['workers']} workers)")
+        for stage in STAGES:
+            s = deck['stages'][stage]
+            lines.append(f"  {stage:<8} {s['seconds']:8.2f}s {s['pages_per_second'] or 0:10.1f} pages/s  peak {s['peak_mb']:7.1f} MB")
+    if results.get('peak_rss_mb'): lines.append(f"Peak RSS: {results['peak_rss_mb']['self']} MB (this process), {results['peak_rss_mb']['children']} MB (largest child)")
+    return '\n'.join(lines)
+
+# --- Entry Point ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the PDF processing pipeline on a synthetic slide corpus.")
+    parser.add_argument('--sizes', default=','.join(map(str, CORPUS_SIZES)), help=f"comma-separated deck sizes in pages (default: {','.join(map(str, CORPUS_SIZES))})")
+    parser.add_argument('--layout', type=int, choices=(1, 2, 3, 4), default=1, help='pages per sheet (default: 1)')
+    parser.add_argument('--no-invert', dest='invert', action='store_false', help='keep the original colors')
+    parser.add_argument('--no-monochrome', dest='monochrome', action='store_false', help='skip the smart monochrome filter')
+    parser.add_argument('--filter', choices=sorted(FILTERS), default='classic', help='monochrome thresholds')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'workers for the end-to-end run (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR, help=f'where generated decks are kept (default: {DEFAULT_CORPUS_DIR})')
+    parser.add_argument('--seed', type=int, default=0, help='corpus seed (default: 0)')
+    parser.add_argument('--gs', dest='gs_executable', help='path to the Ghostscript executable')
+    parser.add_argument('--baseline', help='results JSON to compare against; exit status 1 on regressions')
+    parser.add_argument('--save-baseline', help='write the results JSON here')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help=f'allowed slowdown before a stage is flagged (default: {DEFAULT_TOLERANCE})')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON instead of a table')
+    args = parser.parse_args(argv)
+
+    gs_executable = args.gs_executable or find_ghostscript_executable()
+    if not gs_executable: parser.error("Ghostscript was not found; install it or pass --gs.")
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    corpus = build_corpus(args.corpus_dir, sizes, args.seed)
+    options = {'layout': args.layout, 'invert': args.invert, 'monochrome': args.monochrome, 'filter': args.filter, 'workers': args.workers, 'seed': args.seed}
+    results = {'corpus_version': CORPUS_VERSION, 'options': options, 'machine': machine_info(gs_executable), 'decks': {}}
+    for size in sizes:
+        if not args.json: print(f"Benchmarking {size} pages...", file=sys.stderr, flush=True)
+        results['decks'][str(size)] = benchmark_deck(corpus[size], size, gs_executable, args.layout, args.invert, args.monochrome, FILTERS[args.filter], args.workers)
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    print(json.dumps(results, indent=2) if args.json else format_report(results))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f: json.dump(results, f, indent=2)
+    if not args.baseline: return 0
+    with open(args.baseline) as f: baseline = json.load(f)
+    if baseline.get('options') != options or baseline.get('corpus_version') != CORPUS_VERSION:
+        print("Warning: the baseline was recorded with different options or corpus; comparing anyway.", file=sys.stderr)
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for message in regressions: print(f"REGRESSION: {message}", file=sys.stderr)
+    if not regressions: print("No regressions against the baseline.", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""
+Headless entry point for the PDF Processor Suite: a small Python API plus a command line.
+
+Library use:
+    from pdf_cli import process_pdf
+    process_pdf([("deck.pdf", "1, 8-12"), "notes.pdf"], "out.pdf", layout=2, workers=4)
+
+Command line:
+    python pdf_cli.py -o out.pdf deck.pdf@1,8-12 notes.pdf --layout 2 --workers 4
+    python pdf_cli.py --job nightly.toml
+    python pdf_cli.py -o out.pdf deck.pdf --trace trace.json    # per-stage, per-page timings for Perfetto
+    python pdf_cli.py -o out.pdf deck.pdf --drop-builds          # print only the last frame of slide build-ups
+    python pdf_cli.py -o out.pdf slides.pdf handout.pdf --auto  # invert only the dark pages
+    python pdf_cli.py -o out.pdf big.pdf --gs-library           # render in-process with libgs (see gs_library)
+    python pdf_cli.py -o out.pdf deck.pdf --rasterizer auto     # render with the fastest of Ghostscript, pdftoppm, pdfium, MuPDF
+    python pdf_cli.py -o out.pdf deck.pdf --jpeg-quality 60     # smaller gray and color pages
+
+An interrupted job (a Ghostscript error, Ctrl+C, a full disk) keeps the pages it finished; running
+the same command again resumes after them (see job_journal). --no-resume starts over.
+
+A job file (JSON, or TOML on Python 3.11+) holds optional "defaults" and a list of "jobs"; each job
+takes the same keys as process_pdf plus "output" and "files". Relative paths are resolved against
+the job file's folder:
+    [defaults]
+    layout = 2
+    monochrome = false
+    [[jobs]]
+    output = "week1.pdf"
+    files = ["week1.pdf", {path = "extra.pdf", remove = "1-2"}]
+Options given on the command line together with --job override those keys in every job.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pypdf import PdfReader, PdfWriter, Transformation
+from rasterizers import RASTERIZERS
+from pdf_engine import iter_processed_pages, merge_pdf_pages, nup_geometry, plan_page_dpis, page_dpi_list, CLASSIC_MONOCHROME, BRIGHT_MONOCHROME, DEFAULT_WORKERS, MAX_PAGES_IN_MEMORY, PAGE_MEMORY_BUDGET, TARGET_PRINT_DPI, MAX_RENDER_DPI, JPEG_QUALITY
+from vector_invert import write_inverted_pdf
+from page_cache import open_page_cache
+from pdf_trace import span, start_tracing, stop_tracing, save_trace
+from pdf_index import open_pdf_index
+from build_frames import find_build_frames, dropped_page_specs
+from page_classifier import classify_pages
+from job_journal import open_job_journal
+from gs_library import find_gs_library, use_gs_library, gs_library_from_environment
+
+FILTERS = {'classic': CLASSIC_MONOCHROME, 'bright': BRIGHT_MONOCHROME}
+# "deck.pdf@5,8-12" removes pages 5 and 8-12 of deck.pdf.
+PAGE_SPEC_PATTERN = re.compile(r'^(.+)@([\d\s,-]*)$')
+
+def find_ghostscript_executable():
+    """Finds Ghostscript on PATH under its Windows console or Unix name."""
+    for gs_name in ("gswin64c", "gswin32c", "gs"):
+        if shutil.which(gs_name): return shutil.which(gs_name)
+    return None
+
+# --- Page Selection ---
+def parse_page_spec(range_spec, total_pages):
+    """Returns the page numbers named by a Page Editor spec such as "5, 8-12, 20-" (open ranges run to the end)."""
+    pages = set()
+    if not range_spec or range_spec == 'none': return pages
+    for part in range_spec.split(','):
+        part = part.strip()
+        if not part: continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            pages.update(range(int(start) if start.strip() else 1, (int(end) if end.strip() else total_pages) + 1))
+        else: pages.add(int(part))
+    return pages
+
+def collect_pages(files, index=None):
+    """
+    Returns the (path, page_num) list to process. files holds paths, (path, remove_spec) pairs or
+    {"path": ..., "remove": ...} dicts; remove_spec names the pages to leave out, as in the Page Editor.
+    index: optional pdf_index.PdfIndex to take page counts from instead of parsing the files.
+    """
+    pages_to_process = []
+    for entry in files:
+        if isinstance(entry, dict): path, remove_spec = entry['path'], entry.get('remove')
+        elif isinstance(entry, (tuple, list)): path, remove_spec = entry
+        else: path, remove_spec = entry, None
+        with span('read_page_count', file=os.path.basename(path)):
+            if index is not None: total_pages = index.page_count(path)
+            else:
+                with open(path, 'rb') as f: total_pages = len(PdfReader(f).pages)
+        removed = parse_page_spec(remove_spec, total_pages)
+        pages_to_process.extend((path, page_num) for page_num in range(1, total_pages + 1) if page_num not in removed)
+    return pages_to_process
+
+# --- Layout ---
+def n_up_layout(input_pdf_path, output_pdf_path, pages_per_sheet):
+    """Places pages_per_sheet pages on each A4 sheet: 2-up landscape side by side, 3- and 4-up stacked portrait."""
+    with span('n_up_layout', pages_per_sheet=pages_per_sheet):
+        reader = PdfReader(input_pdf_path)
+        writer = PdfWriter()
+        new_page_width, new_page_height, positions, slot_w, slot_h = nup_geometry(pages_per_sheet)
+
+        for i in range(0, len(reader.pages), pages_per_sheet):
+            new_page = writer.add_blank_page(width=new_page_width, height=new_page_height)
+            for j, page in enumerate(reader.pages[i : i + pages_per_sheet]):
+                p_w, p_h = page.mediabox.width, page.mediabox.height
+                if p_w == 0 or p_h == 0: continue
+                scale = min(slot_w / p_w, slot_h / p_h)
+                tx = positions[j][0] + (slot_w - p_w * scale) / 2
+                ty = positions[j][1] + (slot_h - p_h * scale) / 2
+                new_page.merge_transformed_page(page, Transformation().scale(scale).translate(tx, ty))
+        with open(output_pdf_path, "wb") as f: writer.write(f)
+
+# --- Processing ---
+def process_pdf(files, output_path, layout=1, invert=True, monochrome=True, workers=DEFAULT_WORKERS, invert_engine="raster",
+                thresholds=CLASSIC_MONOCHROME, dpi=None, target_dpi=TARGET_PRINT_DPI, max_dpi=MAX_RENDER_DPI, use_cache=True, gs_executable=None, progress=None, max_pages_in_memory=MAX_PAGES_IN_MEMORY,
+                page_memory_budget=PAGE_MEMORY_BUDGET, drop_builds=False, auto_detect=False, resume=True, cancel=None, rasterizer=None, jpeg_quality=JPEG_QUALITY):
+    """
+    Merges the selected pages of files into output_path, inverting and/or applying the smart
+    monochrome filter, then lays them out layout-up. Defaults match the GUI.
+
+    files: see collect_pages. invert_engine: "raster" or "vector" ("vector" is only used when
+    monochrome is off). thresholds: CLASSIC_MONOCHROME or BRIGHT_MONOCHROME. progress: optional
+    callback(done, total) called after each processed page. max_pages_in_memory: hard cap on
+    processed pages held at once; pages are streamed to disk, so the document length does not matter.
+    page_memory_budget: bytes the pages being processed may take together; the pool sizes and starts
+    its runs to fit it, and pages over a worker's share of it are processed in strips.
+    drop_builds: leave out slide build-up frames, keeping the last frame of each (see build_frames);
+    the stats then name the dropped pages per file under 'build_frames'.
+    auto_detect: invert and filter only the pages that need it (dark slides; with inversion off,
+    colored pages), copying the rest unchanged as vectors; the stats count those as 'vector_pages'.
+    dpi: fixed render resolution; when None, each page is rendered at the resolution it needs to
+    reach target_dpi on the final sheet (at most max_dpi), so n-up jobs render far fewer pixels.
+    resume: continue an interrupted run of the same job after its last checkpoint (see job_journal);
+    the stats then count the pages taken over as 'resumed_pages'. cancel: optional
+    multiprocessing.Event that stops the job within a page, raising pdf_engine.JobCancelled.
+    rasterizer: one of rasterizers.RASTERIZERS, or "auto" to time them on the first pages and use
+    the fastest whose output matches Ghostscript's; None uses PDF_PROCESSOR_RASTERIZER, else
+    Ghostscript. Ghostscript is needed either way (it renders what the others cannot).
+    jpeg_quality: JPEG quality of gray and color pages (see pdf_engine.plan_page_encoding, which also
+    stores effectively gray pages as gray and flat pages as Flate where that is smaller); the stats
+    then report the images under 'encoding', with the estimated bytes saved.
+    Returns a dict with the page count, elapsed seconds, pages per second and cache counters.
+    Raises ValueError for an empty selection or when pages could not be written (a rerun resumes), and
+    subprocess.CalledProcessError when Ghostscript fails. The stats count the pages actually written.
+    """
+    start_time = time.time()
+    page_cache = None
+    with span('job', output=os.path.basename(output_path), layout=int(layout)):
+        pdf_index = open_pdf_index()
+        with span('collect_pages', files=len(files)): pages_to_process = collect_pages(files, pdf_index)
+        pdf_index.save()
+        if drop_builds:
+            with span('find_build_frames', pages=len(pages_to_process)): build_frames = find_build_frames(pages_to_process, gs_executable or find_ghostscript_executable())
+            pages_to_process = [page for page in pages_to_process if page not in build_frames]
+        total_pages = len(pages_to_process)
+        if total_pages == 0: raise ValueError("No pages were selected or found.")
+        temp_dir = tempfile.mkdtemp()
+        try:
+            single_pages_path = os.path.join(temp_dir, "pages.pdf"); laid_out = False; raster_pages = None; journal = None
+            use_vector_invert = invert and not monochrome and invert_engine == "vector"
+            if (invert or monochrome) and (auto_detect or not use_vector_invert):
+                gs_executable = gs_executable or find_ghostscript_executable()
+                if not gs_executable: raise FileNotFoundError("Ghostscript was not found; install it or pass its path.")
+            if use_vector_invert:
+                if auto_detect:
+                    with span('classify_pages', pages=total_pages): raster_pages = classify_pages(gs_executable, pages_to_process, invert, monochrome)
+                write_inverted_pdf(pages_to_process, single_pages_path, raster_pages); classified_pages = total_pages
+            elif invert or monochrome:
+                if use_cache: page_cache = open_page_cache()
+                page_dpis = page_dpi_list(dpi or plan_page_dpis(pages_to_process, int(layout), target_dpi, max_dpi, index=pdf_index), total_pages)
+                # Pages are checkpointed as they are written; a rerun of the same job starts after the last checkpoint.
+                journal = open_job_journal({'layout': int(layout), 'invert': invert, 'monochrome': monochrome, 'thresholds': list(thresholds), 'dpi': page_dpis, 'auto_detect': auto_detect, 'rasterizer': rasterizer,
+                                            'jpeg_quality': jpeg_quality}, pages_to_process, layout, resume=resume, jpeg_quality=jpeg_quality)
+                done = journal.done_pages; remaining = pages_to_process[done:]; classified_pages = len(remaining)
+                if auto_detect:
+                    with span('classify_pages', pages=len(remaining)): raster_pages = classify_pages(gs_executable, remaining, invert, monochrome)
+                try:
+                    processed_pages = iter_processed_pages(gs_executable, remaining, invert, monochrome, thresholds, workers, page_dpis[done:], cache=page_cache,
+                                                           max_pages_in_memory=max_pages_in_memory, memory_budget=page_memory_budget, raster_pages=raster_pages, cancel=cancel, rasterizer=rasterizer)
+                    for i, (pdf_path, page_num, processed_img) in enumerate(processed_pages, done):
+                        journal.add_page(processed_img) # n-up sheets are composed in the raster domain
+                        if progress: progress(i + 1, total_pages)
+                except BaseException: journal.close(); raise # Checkpoints the pages written so far for a resume.
+                journal.finish(single_pages_path, total_pages); laid_out = True
+            else:
+                merge_pdf_pages(pages_to_process, single_pages_path)
+
+            if int(layout) == 1 or laid_out: shutil.copy(single_pages_path, output_path)
+            else: n_up_layout(single_pages_path, output_path, int(layout))
+            if journal: journal.discard()
+        finally: shutil.rmtree(temp_dir, ignore_errors=True)
+
+    elapsed = time.time() - start_time
+    pages_written = journal.done_pages if journal else total_pages
+    stats = {'output': output_path, 'pages': pages_written, 'seconds': round(elapsed, 3), 'pages_per_second': round(pages_written / elapsed, 2) if elapsed else None}
+    if page_cache: stats.update(cache_hits=page_cache.hits, cache_misses=page_cache.misses)
+    if drop_builds: stats['build_frames'] = dropped_page_specs(build_frames)
+    if raster_pages is not None: stats['vector_pages'] = classified_pages - len(raster_pages)
+    if journal and journal.resumed_pages: stats['resumed_pages'] = journal.resumed_pages
+    if journal and journal.report.pages: stats['encoding'] = journal.report.stats()
+    return stats
+
+# --- Job Files ---
+def load_job_file(job_path):
+    """Reads a JSON or TOML job file and returns its jobs with defaults applied and paths made absolute."""
+    if job_path.lower().endswith('.toml'):
+        import tomllib # Python 3.11+
+        with open(job_path, 'rb') as f: data = tomllib.load(f)
+    else:
+        with open(job_path, 'r', encoding='utf-8') as f: data = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(job_path))
+    resolve = lambda path: os.path.join(base_dir, os.path.expanduser(path))
+    jobs = []
+    for job in data.get('jobs', []):
+        job = {**data.get('defaults', {}), **job}
+        if 'output' not in job or not job.get('files'): raise ValueError(f"Every job needs 'output' and 'files': {job}")
+        job['output'] = resolve(job['output'])
+        job['files'] = [{**entry, 'path': resolve(entry['path'])} if isinstance(entry, dict) else resolve(entry) for entry in job['files']]
+        if isinstance(job.get('thresholds'), str): job['thresholds'] = FILTERS[job['thresholds']]
+        jobs.append(job)
+    return jobs
+
+def run_job(job, **overrides):
+    """Runs one job dict (as returned by load_job_file) through process_pdf."""
+    job = {**job, **overrides}
+    return process_pdf(job.pop('files'), job.pop('output'), **job)
+
+# --- Command Line ---
+def parse_file_argument(argument):
+    """Splits "deck.pdf@5,8-12" into ("deck.pdf", "5,8-12"); plain paths get no exclusions."""
+    match = PAGE_SPEC_PATTERN.match(argument)
+    if match and not os.path.exists(argument): return match.group(1), match.group(2)
+    return argument, None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge, invert, monochrome and n-up PDFs without the GUI.")
+    parser.add_argument('files', nargs='*', help='input PDFs; append @SPEC to leave pages out, e.g. deck.pdf@5,8-12')
+    parser.add_argument('-o', '--output', help='output PDF (required unless --job is given)')
+    parser.add_argument('--job', help='JSON or TOML job file with several jobs to run in turn')
+    parser.add_argument('--layout', type=int, choices=(1, 2, 3, 4), help='pages per sheet (default: 1)')
+    parser.add_argument('--no-invert', dest='invert', action='store_false', default=None, help='keep the original colors')
+    parser.add_argument('--no-monochrome', dest='monochrome', action='store_false', default=None, help='skip the smart monochrome filter')
+    parser.add_argument('--invert-engine', choices=('raster', 'vector'), help='vector keeps text selectable (only without monochrome; default: raster)')
+    parser.add_argument('--filter', choices=sorted(FILTERS), help='monochrome thresholds (bright whitens more, as in pdf_tool_v2; default: classic)')
+    parser.add_argument('--workers', type=int, help=f'parallel page processes (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--max-pages-in-memory', type=int, help=f'hard cap on processed pages held in memory (default: {MAX_PAGES_IN_MEMORY})')
+    parser.add_argument('--page-memory-mb', type=int, help=f'memory the pages being processed may take together; pages over a worker\'s share are processed in strips (default: {PAGE_MEMORY_BUDGET // 2**20})')
+    parser.add_argument('--auto', dest='auto_detect', action='store_true', default=None, help='invert/filter only the dark pages, leaving light pages untouched and vector')
+    parser.add_argument('--drop-builds', action='store_true', default=None, help='leave out slide build-up frames, keeping the last frame of each')
+    parser.add_argument('--target-dpi', type=int, help=f'resolution pages should have on the final sheet (default: {TARGET_PRINT_DPI})')
+    parser.add_argument('--max-dpi', type=int, help=f'upper limit on the render resolution (default: {MAX_RENDER_DPI})')
+    parser.add_argument('--dpi', type=int, help='render every page at this fixed resolution instead')
+    parser.add_argument('--jpeg-quality', type=int, choices=range(1, 101), metavar='1-100', help=f'JPEG quality of gray and color pages stored as JPEG (default: {JPEG_QUALITY})')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', default=None, help='always render, ignoring the page cache')
+    parser.add_argument('--no-resume', dest='resume', action='store_false', default=None, help='start over instead of resuming an interrupted run of the same job')
+    parser.add_argument('--gs', dest='gs_executable', help='path to the Ghostscript executable')
+    parser.add_argument('--rasterizer', choices=('auto',) + RASTERIZERS, help='renderer for the raster pipeline; auto times each available one on the first pages of a job (default: ghostscript)')
+    parser.add_argument('--gs-library', nargs='?', const='auto', help='render in-process with the Ghostscript library (found next to the executable, or at this path); saves a Ghostscript startup per page run')
+    parser.add_argument('--json', action='store_true', help='print one JSON stats line per job')
+    parser.add_argument('--trace', help='write a Chrome trace-event JSON of every stage and page here (open it in Perfetto)')
+    args = parser.parse_args(argv)
+
+    # Options given on the command line win over the job file; the rest keep the job's own values.
+    overrides = {key: value for key, value in (('layout', args.layout), ('invert', args.invert), ('monochrome', args.monochrome), ('invert_engine', args.invert_engine), ('thresholds', args.filter and FILTERS[args.filter]),
+                                               ('dpi', args.dpi), ('target_dpi', args.target_dpi), ('max_dpi', args.max_dpi), ('jpeg_quality', args.jpeg_quality), ('workers', args.workers), ('max_pages_in_memory', args.max_pages_in_memory),
+                                               ('page_memory_budget', args.page_memory_mb and args.page_memory_mb * 2**20), ('use_cache', args.use_cache), ('drop_builds', args.drop_builds), ('auto_detect', args.auto_detect),
+                                               ('resume', args.resume), ('rasterizer', args.rasterizer), ('gs_executable', args.gs_executable)) if value is not None}
+    if args.job:
+        jobs = load_job_file(args.job)
+    elif args.files and args.output:
+        jobs = [{'files': [parse_file_argument(a) for a in args.files], 'output': args.output}]
+    else: parser.error("give input files and --output, or --job")
+
+    if args.gs_library:
+        library_path = find_gs_library(args.gs_executable or find_ghostscript_executable()) if args.gs_library == 'auto' else args.gs_library
+        if not use_gs_library(library_path): print("Ghostscript library not found or too old (9.50+ needed); using the executable", file=sys.stderr)
+    else: gs_library_from_environment(args.gs_executable or find_ghostscript_executable())
+    show_progress = sys.stderr.isatty() and not args.json
+    progress = (lambda done, total: print(f"\r  page {done}/{total}", end='', file=sys.stderr, flush=True)) if show_progress else None
+    failures = 0
+    if args.trace: start_tracing()
+    for job in jobs:
+        try: stats = run_job(job, progress=progress, **overrides)
+        except KeyboardInterrupt:
+            print(f"\n{job.get('output')}: interrupted; run the same command again to resume", file=sys.stderr)
+            if args.trace: save_trace(args.trace, stop_tracing())
+            return 130
+        except Exception as e:
+            failures += 1
+            error = e.stderr.decode(errors='ignore') if getattr(e, 'stderr', None) else str(e)
+            print(json.dumps({'output': job.get('output'), 'error': error}) if args.json else f"{job.get('output')}: FAILED: {error}", file=sys.stdout if args.json else sys.stderr)
+            continue
+        if show_progress: print(file=sys.stderr)
+        if args.json: print(json.dumps(stats))
+        else: print(f"{stats['output']}: {stats['pages']} pages in {stats['seconds']:.1f}s ({stats['pages_per_second']} pages/s)"
+                    + (f", cache {stats['cache_hits']} hits / {stats['cache_misses']} misses" if 'cache_hits' in stats else "")
+                    + (f", {stats['vector_pages']} light pages left as they were" if 'vector_pages' in stats else "")
+                    + (f", resumed after page {stats['resumed_pages']}" if 'resumed_pages' in stats else "")
+                    + (f", images ~{stats['encoding']['est_bytes_saved'] / 1024 ** 2:.1f} MB smaller than plain JPEG (estimated)" if 'encoding' in stats else ""))
+        if not args.json:
+            for path, spec in stats.get('build_frames', {}).items(): print(f"  {os.path.basename(path)}: dropped build frames {spec}")
+    if args.trace: save_trace(args.trace, stop_tracing())
+    return 1 if failures else 0
+
+# --- Entry Point ---
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,1030 @@
+"""
+Shared rendering engine for the PDF Processor Suite scripts.
+"""
+import functools
+import io
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, features
+import numpy as np
+from pypdf import PdfReader, PageObject
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+from pdf_trace import span, tracing_enabled, call_traced, add_events
+from gs_library import start_library_render, use_gs_library, gs_library_path
+from rasterizers import start_rasterizer, available_rasterizers, rasterizer_available, DEFAULT_RASTERIZER
+from page_cache import encode_page
+
+# Keeps Ghostscript from flashing a console window on Windows builds.
+GS_CREATION_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+RENDER_DPI = 200
+# Resolution planning: pages are rendered so they reach TARGET_PRINT_DPI on the final (possibly
+# n-up) sheet, but never sharper than MAX_RENDER_DPI nor blurrier than MIN_RENDER_DPI.
+TARGET_PRINT_DPI = RENDER_DPI
+MAX_RENDER_DPI = 300
+MIN_RENDER_DPI = 72
+# Upper bound on pages rendered by one Ghostscript call, so progress keeps moving.
+MAX_RUN_LENGTH = 50
+# Leave one core free so the Tk window stays responsive while the pool is busy.
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# Ceiling on processed pages in flight in the pool or waiting to be written, however small they are;
+# the memory budget below normally decides first (see RunScheduler).
+MAX_PAGES_IN_MEMORY = 256
+# Memory the pages of a job may take together while they are rendered, filtered and waiting to be
+# written. Runs of pages are sized and started against it from each page's estimated footprint.
+# A page that would need more than its worker's share, such as a poster or an A0 drawing, goes to a
+# scratch file and is processed in strips of rows (see StripPage), however large it is.
+PAGE_MEMORY_BUDGET = 1024 * 1024 * 1024
+# Peak bytes per pixel of in-memory processing: the RGB raster, the filtered page and the encoder's copies.
+IN_MEMORY_BYTES_PER_PIXEL = 12
+# A strip's input and output rows together take at most this share of the budget.
+STRIP_BUDGET_FRACTION = 0.25
+# Bounds on the factor by which the memory workers report using corrects the footprint estimates.
+MIN_FOOTPRINT_CORRECTION, MAX_FOOTPRINT_CORRECTION = 0.5, 4.0
+# The "auto" rasterizer times every available rasterizer on the first CALIBRATION_PAGES pages of a
+# job; jobs shorter than CALIBRATION_MIN_PAGES are not worth the calibration and keep Ghostscript.
+CALIBRATION_PAGES = 3
+CALIBRATION_MIN_PAGES = 30
+# A rasterizer must be this much faster than the best one so far to be picked instead (timings are noisy).
+CALIBRATION_MIN_SPEEDUP = 1.1
+# A render is acceptable when its size is within MAX_SIZE_DIFFERENCE pixels of Ghostscript's (page
+# sizes are rounded differently) and its pixels differ by at most MAX_RASTER_DIFFERENCE levels on average.
+MAX_SIZE_DIFFERENCE = 2
+MAX_RASTER_DIFFERENCE = 6
+# Seconds between checks of a job's cancel event while Ghostscript is rendering.
+CANCEL_POLL_SECONDS = 0.1
+# Keys that point from a copied object back into its source document's structure (page tree, parent
+# fields, annotation owners); following them would drag unselected pages into the output.
+BACKLINK_KEYS = ('/Parent', '/P')
+
+# Smart monochrome thresholds as (white_above, colored_above, light_text_above):
+# gray above white_above turns white, saturation above colored_above marks a colored
+# box, and inside colored boxes gray above light_text_above is kept as white text.
+CLASSIC_MONOCHROME = (240, 50, 128)
+# pdf_tool_v2 blackens everything below 220 gray, i.e. whitens gray above 219.
+BRIGHT_MONOCHROME = (219, 40, 150)
+
+# --- Layout Geometry ---
+A4_WIDTH, A4_HEIGHT = 595.2, 841.8
+
+def nup_geometry(pages_per_sheet):
+    """
+    Returns (sheet_w, sheet_h, slot_positions, slot_w, slot_h) in points for an n-up A4 sheet:
+    2-up is landscape with pages side by side, 3- and 4-up are portrait with pages stacked.
+    """
+    a4_w, a4_h = A4_WIDTH, A4_HEIGHT
+    if pages_per_sheet == 2: return a4_h, a4_w, [(0, 0), (a4_h / 2, 0)], a4_h / 2, a4_w
+    if pages_per_sheet == 3: return a4_w, a4_h, [(0, a4_h * 2/3), (0, a4_h / 3), (0, 0)], a4_w, a4_h / 3
+    if pages_per_sheet == 4: return a4_w, a4_h, [(0, a4_h * 3/4), (0, a4_h * 2/4), (0, a4_h/4), (0,0)], a4_w, a4_h/4
+    raise ValueError(f"Unsupported layout: {pages_per_sheet}")
+
+def plan_page_dpis(pages_to_process, pages_per_sheet, target_dpi=TARGET_PRINT_DPI, max_dpi=MAX_RENDER_DPI, min_dpi=MIN_RENDER_DPI, index=None):
+    """
+    Returns the render DPI of every (path, page_num): the resolution at which the page reaches
+    target_dpi once n_up_layout has scaled it into its slot, clamped to [min_dpi, max_dpi].
+    A page shrunk to 35% of its size on a 4-up sheet only needs 35% of the 1-up resolution.
+    index: optional pdf_index.PdfIndex to take page sizes from instead of parsing the files.
+    """
+    slot = nup_geometry(pages_per_sheet)[3:] if int(pages_per_sheet) != 1 else None
+    clamp = lambda dpi: int(max(min_dpi, min(max_dpi, math.ceil(dpi))))
+    if slot is None: return [clamp(target_dpi)] * len(pages_to_process) # 1-up pages are never scaled
+    # Unreadable pages are rendered as full pages.
+    scales = [min(slot[0] / size[0], slot[1] / size[1]) if size and size[0] > 0 and size[1] > 0 else 1.0 for size in read_page_sizes(pages_to_process, index)]
+    return [clamp(target_dpi * scale) for scale in scales]
+
+def read_page_sizes(pages_to_process, index=None):
+    """
+    Returns the (width, height) in points of every (path, page_num) as Ghostscript renders it, i.e.
+    with /Rotate applied, or None for pages that cannot be read here.
+    index: optional pdf_index.PdfIndex to take page sizes from instead of parsing the files.
+    """
+    readers = {}; sizes = []
+    try:
+        for pdf_path, page_num in pages_to_process:
+            try:
+                if index is not None: width, height = index.page_size(pdf_path, page_num)
+                else:
+                    if pdf_path not in readers: readers[pdf_path] = PdfReader(pdf_path)
+                    page = readers[pdf_path].pages[page_num - 1]
+                    width, height = float(page.mediabox.width), float(page.mediabox.height)
+                    if page.rotation % 180: width, height = height, width
+                sizes.append((width, height))
+            except Exception: sizes.append(None)
+    finally:
+        for reader in readers.values(): reader.stream.close()
+    return sizes
+
+def page_dpi_list(dpi, count):
+    """Expands a single DPI into a per-page list; per-page lists are passed through."""
+    return [dpi] * count if isinstance(dpi, (int, float)) else list(dpi)
+
+# --- Page Grouping ---
+def group_page_runs(pages_to_process, page_dpis, max_run_length=MAX_RUN_LENGTH):
+    """
+    Groups consecutive (path, page_num) tuples from the same file and with the same render DPI
+    into (path, [page_nums], dpi) runs, each rendered by one Ghostscript call.
+    """
+    runs = []
+    for (path, page_num), dpi in zip(pages_to_process, page_dpis):
+        if runs and runs[-1][0] == path and runs[-1][2] == dpi and len(runs[-1][1]) < max_run_length and page_num > runs[-1][1][-1]:
+            runs[-1][1].append(page_num)
+        else:
+            runs.append((path, [page_num], dpi))
+    return runs
+
+def page_selection_args(page_nums):
+    """Returns the Ghostscript arguments selecting page_nums (ascending, 1-based)."""
+    if page_nums[-1] - page_nums[0] + 1 == len(page_nums):
+        return [f'-dFirstPage={page_nums[0]}', f'-dLastPage={page_nums[-1]}']
+    ranges = []
+    start = prev = page_nums[0]
+    for num in page_nums[1:] + [None]:
+        if num is not None and num == prev + 1:
+            prev = num; continue
+        ranges.append(str(start) if start == prev else f"{start}-{prev}")
+        start = prev = num
+    return [f"-sPageList={','.join(ranges)}"]
+
+def format_page_spec(page_nums):
+    """Returns the Page Editor spec for page_nums, e.g. {5, 8, 9, 10} -> "5, 8-10"."""
+    ranges = []
+    for page_num in sorted(page_nums):
+        if ranges and page_num == ranges[-1][1] + 1: ranges[-1][1] = page_num
+        else: ranges.append([page_num, page_num])
+    return ', '.join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
+
+# --- Rendering ---
+def read_pnm_header(stream):
+    """Reads one binary PNM header (P5/P6) from stream. Returns (channels, width, height), or None at end of stream."""
+    tokens = []
+    while len(tokens) < 4:
+        ch = stream.read(1)
+        if not ch:
+            if tokens: raise ValueError("Ghostscript raster output ended inside a page header.")
+            return None
+        if ch == b'#': stream.readline(); continue # Ghostscript writes a "# Image generated by ..." comment
+        if ch.isspace(): continue
+        token = ch
+        # Reading up to and including the next whitespace also consumes the single byte after maxval.
+        while (ch := stream.read(1)) and not ch.isspace(): token += ch
+        tokens.append(token)
+    magic, width, height, maxval = tokens
+    if magic not in (b'P5', b'P6') or maxval != b'255': raise ValueError(f"Unexpected raster format from Ghostscript: {magic!r}, maxval {maxval!r}")
+    return (3 if magic == b'P6' else 1), int(width), int(height)
+
+def read_pnm_raster(stream, memory_budget=None):
+    """
+    Reads one binary PNM page from stream as a uint8 NumPy array viewing the read bytes, or returns
+    None at end of stream. Pages that need_strips for memory_budget are read into a StripPage.
+    """
+    header = read_pnm_header(stream)
+    if header is None: return None
+    channels, width, height = header
+    if need_strips((width, height), memory_budget): return read_pnm_strips(stream, 'RGB' if channels == 3 else 'L', (width, height), memory_budget)
+    data = stream.read(width * height * channels)
+    if len(data) != width * height * channels: raise ValueError("Ghostscript raster output ended inside a page.")
+    return np.frombuffer(data, dtype=np.uint8).reshape((height, width, 3) if channels == 3 else (height, width))
+
+def read_pnm_strips(stream, mode, size, memory_budget):
+    """Reads the pixel data of one PNM page from stream into a StripPage, one strip at a time."""
+    page = StripPage(mode, size, strip_rows(size[0], memory_budget))
+    for top in range(0, page.height, page.strip_rows):
+        strip = memoryview(page.map_rows(top, page.strip_rows, writable=True)).cast('B'); filled = 0
+        while filled < len(strip):
+            if not (count := stream.readinto(strip[filled:])): raise ValueError("Ghostscript raster output ended inside a page.")
+            filled += count
+        strip.release()
+    return page
+
+def iter_page_rasters(gs_executable, pdf_path, page_nums, dpi=RENDER_DPI, gray=False, memory_budget=None, cancel=None, rasterizer=None):
+    """
+    Renders the selected pages of pdf_path straight from the source file with a single Ghostscript
+    call and yields each page, in page_nums order, as a uint8 NumPy array of shape (height, width, 3),
+    or (height, width) when gray is set. Raw PNM rasters are read from Ghostscript's stdout, so no
+    temp files are written and nothing is PNG-encoded; each array is a zero-copy view of the pipe bytes.
+    Pages too large to process within memory_budget bytes are yielded as StripPages instead. Setting
+    cancel (an Event) kills Ghostscript mid-page and raises JobCancelled. When the Ghostscript
+    library is in use (see gs_library), the pages are rendered in-process instead of by gs_executable.
+    rasterizer: one of rasterizers.RASTERIZERS to render with instead of Ghostscript (None: the
+    default, which is Ghostscript unless PDF_PROCESSOR_RASTERIZER names one); Ghostscript still
+    renders when it cannot run here.
+    """
+    if rasterizer is None: rasterizer = DEFAULT_RASTERIZER
+    device = 'pgmraw' if gray else 'ppmraw'
+    # -sstdout=%stderr keeps Ghostscript's own messages out of the raster stream.
+    gs_command = [gs_executable, '-dQUIET', '-dSAFER', '-dBATCH', '-dNOPAUSE', '-sstdout=%stderr', f'-sDEVICE={device}', f'-r{dpi}'] + page_selection_args(page_nums) + ['-sOutputFile=-', pdf_path]
+    with tempfile.TemporaryFile() as stderr_file:
+        max_pixels = memory_budget // IN_MEMORY_BYTES_PER_PIXEL if memory_budget is not None else None
+        proc = (start_rasterizer(rasterizer, pdf_path, page_nums, dpi, gray, stderr_file, max_pixels) or start_library_render(pdf_path, page_nums, dpi, device, stderr_file)
+                or subprocess.Popen(gs_command, stdout=subprocess.PIPE, stderr=stderr_file, creationflags=GS_CREATION_FLAGS))
+        if cancel is not None: kill_on_cancel(proc, cancel)
+        try:
+            rendered = 0; file_name = os.path.basename(pdf_path)
+            while True:
+                # The span is the wait for Ghostscript to deliver the page (the last one also covers it exiting).
+                with span('render', file=file_name, page=page_nums[min(rendered, len(page_nums) - 1)], dpi=dpi):
+                    try: raster = read_pnm_raster(proc.stdout, memory_budget)
+                    except ValueError: check_cancelled(cancel); raise # A killed Ghostscript leaves a truncated page.
+                if raster is None: break
+                yield raster
+                rendered += 1
+            if proc.wait() != 0 or rendered != len(page_nums):
+                check_cancelled(cancel)
+                stderr_file.seek(0)
+                raise subprocess.CalledProcessError(proc.returncode, getattr(proc, 'args', gs_command), stderr=stderr_file.read())
+        finally:
+            if proc.poll() is None: proc.kill()
+            proc.stdout.close(); proc.wait()
+
+# --- Image Filtering ---
+# PIL's RGB -> L conversion in fixed point: L = (R*19595 + G*38470 + B*7471 + 0x8000) >> 16.
+LUMA_WEIGHTS = (np.uint32(19595), np.uint32(38470), np.uint32(7471))
+# Rows filtered per pass; the scratch buffers stay small enough to live in CPU cache.
+MONOCHROME_BAND_ROWS = 128
+
+# Scratch buffers are reused from page to page; each worker process (and thread) keeps its own set.
+kernel_state = threading.local()
+
+@functools.lru_cache(maxsize=None)
+def saturation_spread_lut(colored_above):
+    """
+    For each max channel value, the smallest max-min spread that PIL's RGB -> HSV conversion reports
+    as saturation > colored_above (max + 1 when none does). Derived from PIL itself, so the fused
+    kernel reproduces its float rounding exactly.
+    """
+    max_c, spread = np.divmod(np.arange(256 * 256), 256)
+    probe = np.stack([max_c, np.clip(max_c - spread, 0, 255), np.clip(max_c - spread, 0, 255)], axis=-1).astype(np.uint8)
+    saturation = np.array(Image.fromarray(probe.reshape(1, -1, 3)).convert('HSV'))[0, :, 1]
+    colored = ((saturation > colored_above) & (spread <= max_c)).reshape(256, 256)
+    return np.where(colored.any(axis=1), colored.argmax(axis=1), np.arange(256) + 1).astype(np.uint16)
+
+def band_buffers(width):
+    """Returns this thread's scratch buffers for MONOCHROME_BAND_ROWS x width bands, allocating them only when the width changes."""
+    buffers = getattr(kernel_state, 'buffers', None)
+    if buffers is None or buffers['width'] != width:
+        shape = (MONOCHROME_BAND_ROWS, width)
+        buffers = {'width': width, 'hi': np.empty(shape, np.uint8), 'lo': np.empty(shape, np.uint8), 'spread': np.empty(shape, np.uint16),
+                   'min_spread': np.empty(shape, np.uint16), 'luma': np.empty(shape, np.uint32), 'term': np.empty(shape, np.uint32),
+                   'colored': np.empty(shape, bool), 'light_text': np.empty(shape, bool), 'white': np.empty(shape, bool)}
+        kernel_state.buffers = buffers
+    return buffers
+
+def smart_monochrome(rgb, do_invert, thresholds=CLASSIC_MONOCHROME):
+    """
+    Fused smart monochrome filter over an (height, width, 3) uint8 raster, returning a 1-bit PIL Image.
+    Saturation and luma are computed in one pass per band straight from RGB, with inversion folded
+    into the comparisons, so no inverted, HSV or L copy of the page is ever made. Pixel-identical to
+    inverting with ImageOps and thresholding PIL's HSV and L conversions.
+    """
+    height, width = rgb.shape[:2]
+    packed = np.empty((height, (width + 7) // 8), np.uint8)
+    smart_monochrome_into(rgb, packed, do_invert, thresholds)
+    return Image.frombytes('1', (width, height), packed.tobytes())
+
+def smart_monochrome_into(rgb, packed, do_invert, thresholds=CLASSIC_MONOCHROME):
+    """The smart_monochrome kernel: writes the 1-bit result into packed, (height, ceil(width / 8)) uint8 rows with white as 1."""
+    height, width = rgb.shape[:2]
+    white_above, colored_above, light_text_above = thresholds
+    spread_lut = saturation_spread_lut(colored_above)
+    # gray > t  <=>  weighted sum >= (t + 1) * 65536 - 0x8000. The weights add up to 65536, so
+    # the weighted sum of an inverted pixel is 255 * 65536 minus that of the original.
+    white_bound, text_bound = (((t + 1) << 16) - 0x8000 for t in (white_above, light_text_above))
+    if do_invert: white_bound, text_bound = (255 << 16) - white_bound, (255 << 16) - text_bound
+    compare = np.less_equal if do_invert else np.greater_equal
+
+    buffers = band_buffers(width)
+    for top in range(0, height, MONOCHROME_BAND_ROWS):
+        band = rgb[top:top + MONOCHROME_BAND_ROWS]; rows = band.shape[0]
+        r, g, b = band[..., 0], band[..., 1], band[..., 2]
+        hi, lo, spread, min_spread, luma, term, colored, light_text, white = (buffers[k][:rows] for k in ('hi', 'lo', 'spread', 'min_spread', 'luma', 'term', 'colored', 'light_text', 'white'))
+
+        # Saturation only depends on the brightest channel and the max-min spread.
+        np.maximum(r, g, out=hi); np.maximum(hi, b, out=hi)
+        np.minimum(r, g, out=lo); np.minimum(lo, b, out=lo)
+        np.subtract(hi, lo, out=spread, dtype=np.uint16)
+        if do_invert: np.subtract(255, lo, out=hi) # The brightest inverted channel is the darkest original one.
+        np.take(spread_lut, hi, out=min_spread)
+        np.greater_equal(spread, min_spread, out=colored)
+
+        np.multiply(r, LUMA_WEIGHTS[0], out=luma)
+        np.multiply(g, LUMA_WEIGHTS[1], out=term); np.add(luma, term, out=luma)
+        np.multiply(b, LUMA_WEIGHTS[2], out=term); np.add(luma, term, out=luma)
+        compare(luma, white_bound, out=white)
+        compare(luma, text_bound, out=light_text)
+
+        # Colored boxes go black except for their light text; everything else is a plain threshold.
+        np.copyto(white, light_text, where=colored)
+        packed[top:top + rows] = np.packbits(white, axis=1)
+
+def process_image_intelligently(img, do_invert, do_monochrome, thresholds=CLASSIC_MONOCHROME):
+    """Applies inversion and the smart monochrome filter to a PIL Image or an RGB NumPy raster."""
+    if isinstance(img, np.ndarray): rgb = img if img.ndim == 3 else np.asarray(Image.fromarray(img).convert('RGB'))
+    elif img.mode == 'RGBA' and do_invert: bg = Image.new('RGB', img.size, (255, 255, 255)); bg.paste(img, mask=img.getchannel('A')); rgb = np.asarray(bg)
+    else: rgb = np.asarray(img.convert('RGB'))
+    if do_monochrome: return smart_monochrome(rgb, do_invert, thresholds)
+    if do_invert: return Image.fromarray(np.subtract(255, rgb, dtype=np.uint8))
+    return img if isinstance(img, Image.Image) else Image.fromarray(rgb)
+
+# --- Oversized Pages ---
+def need_strips(size, memory_budget):
+    """Returns whether a (width, height) page would take more than memory_budget bytes to process in memory."""
+    return memory_budget is not None and size[0] * size[1] * IN_MEMORY_BYTES_PER_PIXEL > memory_budget
+
+def strip_rows(width, memory_budget):
+    """Returns the rows per strip that keep an RGB strip and its filtered copy within their share of memory_budget."""
+    return max(MONOCHROME_BAND_ROWS, int(memory_budget * STRIP_BUDGET_FRACTION) // (width * 6))
+
+class StripPage:
+    """
+    A page kept in a scratch file instead of memory and mapped with np.memmap one strip of rows at a
+    time: 8-bit 'RGB' or 'L' rows, or '1' rows packed 8 pixels to the byte (white is 1) as PDF
+    stores them. Has the size, width, height, mode and info the page writers use from a PIL Image.
+    Pickles as its file name, so pool workers hand pages back without copying pixels; the file
+    belongs to the last unpickled copy and is deleted with it, or by release().
+    """
+    def __init__(self, mode, size, strip_rows, scratch_dir=None):
+        self.mode = mode; self.size = tuple(size); self.strip_rows = strip_rows; self.info = {}
+        fd, self.path = tempfile.mkstemp(prefix='pdfstrip-', suffix='.raw', dir=scratch_dir)
+        with os.fdopen(fd, 'wb') as f: f.truncate(self.height * self.row_bytes)
+        self.owned = True
+
+    width = property(lambda self: self.size[0])
+    height = property(lambda self: self.size[1])
+    row_shape = property(lambda self: ((self.width + 7) // 8,) if self.mode == '1' else (self.width, 3) if self.mode == 'RGB' else (self.width,))
+    row_bytes = property(lambda self: math.prod(self.row_shape))
+
+    def map_rows(self, top, rows, writable=False):
+        """Returns rows [top, top + rows) as an np.memmap. Dropping it unmaps them, so only strips in use stay resident."""
+        rows = min(rows, self.height - top)
+        return np.memmap(self.path, np.uint8, 'r+' if writable else 'r', offset=top * self.row_bytes, shape=(rows,) + self.row_shape)
+
+    def iter_strips(self, rows=None):
+        """Yields (top, strip) for strips of rows rows (strip_rows by default) covering the page."""
+        rows = rows or self.strip_rows
+        for top in range(0, self.height, rows): yield top, self.map_rows(top, rows)
+
+    def iter_deflated(self):
+        """Yields the page's rows Flate-compressed, a strip at a time."""
+        compressor = zlib.compressobj()
+        for _, strip in self.iter_strips(): yield compressor.compress(strip)
+        yield compressor.flush()
+
+    def reduced(self, size):
+        """Returns the page box-reduced by a whole factor to no less than size, as a PIL Image (1-bit pages come back in L)."""
+        factor = max(1, min(self.width // size[0], self.height // size[1]))
+        to_image = (lambda strip: Image.frombytes('1', (self.width, strip.shape[0]), strip.tobytes()).convert('L')) if self.mode == '1' else Image.fromarray
+        # Strips of a whole multiple of factor rows reduce exactly as the full page would.
+        return Image.fromarray(np.concatenate([np.asarray(to_image(strip).reduce(factor)) for _, strip in self.iter_strips(max(1, self.strip_rows // factor) * factor)]))
+
+    def release(self):
+        """Deletes the scratch file now rather than when the page is garbage collected."""
+        if self.owned:
+            self.owned = False
+            try: os.remove(self.path)
+            except OSError: pass # Still mapped on Windows; the temp folder cleanup gets it.
+
+    def __getstate__(self):
+        state = dict(self.__dict__); self.owned = False # The receiving copy takes the file over.
+        return state
+
+    def __del__(self): self.release()
+
+def filter_strips(page, do_invert, do_monochrome, thresholds=CLASSIC_MONOCHROME):
+    """Applies inversion and the smart monochrome filter to a StripPage strip by strip, returning the filtered StripPage."""
+    if not (do_invert or do_monochrome): return page
+    result = StripPage('1' if do_monochrome else page.mode, page.size, page.strip_rows)
+    for top, strip in page.iter_strips():
+        out = result.map_rows(top, page.strip_rows, writable=True)
+        if do_monochrome: smart_monochrome_into(strip if strip.ndim == 3 else np.repeat(strip[..., None], 3, axis=2), out, do_invert, thresholds)
+        else: np.subtract(255, strip, out=out, dtype=np.uint8)
+        del strip, out
+    page.release()
+    return result
+
+def filter_page(raster, do_invert, do_monochrome, thresholds=CLASSIC_MONOCHROME):
+    """Filters one rendered page: rasters in memory with process_image_intelligently, StripPages with filter_strips."""
+    if isinstance(raster, StripPage): return filter_strips(raster, do_invert, do_monochrome, thresholds)
+    return process_image_intelligently(raster, do_invert, do_monochrome, thresholds)
+
+# --- Cancellation ---
+class JobCancelled(Exception):
+    """Raised by the page iterators once the job's cancel event is set."""
+
+def check_cancelled(cancel):
+    """Raises JobCancelled if cancel (an Event, or None) is set."""
+    if cancel is not None and cancel.is_set(): raise JobCancelled("Processing was cancelled.")
+
+def kill_on_cancel(proc, cancel):
+    """Watches cancel on a daemon thread while proc runs and kills proc as soon as it is set."""
+    def watch():
+        while proc.poll() is None:
+            if cancel.wait(CANCEL_POLL_SECONDS): proc.kill(); return
+    threading.Thread(target=watch, name='gs-cancel', daemon=True).start()
+
+# The job's cancel event inside pool workers, handed over by init_pool_worker when the pool starts
+# (multiprocessing Events cannot be passed along with each task), and the worker's memory use at
+# that point, from which the memory its runs take is measured. Workers also render with the parent's
+# Ghostscript library, if any, each keeping its own interpreter for the life of the pool.
+worker_cancel_event = None
+worker_base_rss = None
+
+def init_pool_worker(cancel, gs_library=None):
+    global worker_cancel_event, worker_base_rss
+    worker_cancel_event = cancel
+    if gs_library: use_gs_library(gs_library)
+    worker_base_rss = current_rss()
+
+# --- Memory Scheduling ---
+def current_rss():
+    """Returns the resident memory of this process in bytes, or None where it cannot be read."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [(name, ctypes.c_size_t) for name in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        counters = ProcessMemoryCounters(); counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32; kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb): return None
+        return counters.WorkingSetSize
+    try:
+        with open('/proc/self/statm') as f: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError): return None # Not Linux; runs are then scheduled on the estimates alone.
+
+def page_footprints(pages_to_process, page_dpis, do_monochrome, worker_budget, index=None):
+    """
+    Returns the estimated (working, held) bytes of every page: its peak while a worker renders and
+    filters it, and the processed image kept until it is written (1-bit with the monochrome filter,
+    RGB otherwise). Pages over worker_budget are processed in strips and held on disk. Pages whose
+    size cannot be read are taken to be A4.
+    """
+    footprints = []
+    for size, dpi in zip(read_page_sizes(pages_to_process, index), page_dpis):
+        width, height = size or (A4_WIDTH, A4_HEIGHT)
+        pixel_size = (width * dpi / 72.0, height * dpi / 72.0); pixels = pixel_size[0] * pixel_size[1]
+        if need_strips(pixel_size, worker_budget): footprints.append((worker_budget, 0))
+        else: footprints.append((pixels * IN_MEMORY_BYTES_PER_PIXEL, pixels / 8 if do_monochrome else pixels * 3))
+    return footprints
+
+class RunScheduler:
+    """
+    Cuts pages into runs for the pool and decides when the next run may start, so that the pages in
+    flight fit memory_budget bytes. A run is estimated at its largest page's working set plus twice
+    the images it returns (in the worker, then here until they are written). Each run is cut when
+    it starts, so that the worker's part fits its share of the budget: small pages make long runs
+    and large ones short runs. Workers report the memory each run took, and the ratio to its
+    estimate corrects the estimates, and so the length, of the runs started after it.
+    """
+    def __init__(self, pages_to_process, page_dpis, footprints, pool_size, memory_budget, max_pages_in_memory=MAX_PAGES_IN_MEMORY):
+        self.memory_budget = memory_budget; self.max_pages_in_memory = max(1, max_pages_in_memory)
+        self.run_budget = memory_budget / pool_size
+        self.correction = 1.0; self.bytes_in_flight = 0; self.pages_in_flight = 0
+        # Short runs keep every worker busy and progress flowing; long runs save Ghostscript startups.
+        run_length = max(1, min(MAX_RUN_LENGTH, math.ceil(len(pages_to_process) / (pool_size * 4)), self.max_pages_in_memory // (pool_size * 2)))
+        page_costs = iter(footprints) # group_page_runs keeps the pages in input order
+        self.runs = deque((pdf_path, page_nums, dpi, [next(page_costs) for _ in page_nums]) for pdf_path, page_nums, dpi in group_page_runs(pages_to_process, page_dpis, run_length))
+
+    @staticmethod
+    def estimate(costs, copies=2):
+        """Returns the estimated bytes of a run of pages with these (working, held) costs."""
+        return max(working for working, _ in costs) + copies * sum(held for _, held in costs)
+
+    def next_run(self):
+        """Returns the next run as (pdf_path, page_nums, dpi, costs, estimated bytes) if it may start now, else None. A run always may when none is in flight."""
+        if not self.runs: return None
+        pdf_path, page_nums, dpi, costs = self.runs[0]
+        length = 1
+        while length < len(page_nums) and self.estimate(costs[:length + 1], copies=1) * self.correction <= self.run_budget: length += 1
+        cost = self.estimate(costs[:length]) * self.correction
+        if self.pages_in_flight and (self.bytes_in_flight + cost > self.memory_budget or self.pages_in_flight + length > self.max_pages_in_memory): return None
+        if length == len(page_nums): self.runs.popleft()
+        else: self.runs[0] = (pdf_path, page_nums[length:], dpi, costs[length:]) # The rest of the run starts later.
+        self.bytes_in_flight += cost; self.pages_in_flight += length
+        return pdf_path, page_nums[:length], dpi, costs[:length], cost
+
+    def finished(self, run, measured_bytes):
+        """Releases a run handed over to the writer; measured_bytes is the memory its worker reported, or None."""
+        self.bytes_in_flight -= run[4]; self.pages_in_flight -= len(run[1])
+        # Strip pages are estimated at their worker's whole share and say nothing about the others.
+        if measured_bytes and all(held for _, held in run[3]):
+            ratio = measured_bytes / self.estimate(run[3], copies=1)
+            self.correction = max(MIN_FOOTPRINT_CORRECTION, min(MAX_FOOTPRINT_CORRECTION, (self.correction + ratio) / 2))
+
+# --- Rasterizer Selection ---
+def rasters_match(reference, raster):
+    """Returns whether raster renders the same page as reference, Ghostscript's render, closely enough (see MAX_RASTER_DIFFERENCE)."""
+    if reference.ndim != raster.ndim or any(abs(a - b) > MAX_SIZE_DIFFERENCE for a, b in zip(reference.shape, raster.shape)): return False
+    height, width = min(reference.shape[0], raster.shape[0]), min(reference.shape[1], raster.shape[1])
+    return float(np.abs(reference[:height, :width].astype(np.int16) - raster[:height, :width]).mean()) <= MAX_RASTER_DIFFERENCE
+
+def choose_rasterizer(gs_executable, pages_to_process, page_dpis, memory_budget=PAGE_MEMORY_BUDGET):
+    """
+    Renders the first CALIBRATION_PAGES pages with every rasterizer available here and returns the
+    name of the fastest whose renders match Ghostscript's (see rasters_match). Short jobs, and jobs
+    starting with pages too large to render in memory, keep Ghostscript.
+    """
+    candidates = [name for name in available_rasterizers(gs_executable) if name != 'ghostscript']
+    if not candidates or not gs_executable or len(pages_to_process) < CALIBRATION_MIN_PAGES: return 'ghostscript'
+    pdf_path, page_nums, dpi = group_page_runs(pages_to_process[:CALIBRATION_PAGES], page_dpis[:CALIBRATION_PAGES])[0]
+    sizes = read_page_sizes([(pdf_path, page_num) for page_num in page_nums])
+    if any(size is None or need_strips((size[0] * dpi / 72, size[1] * dpi / 72), memory_budget) for size in sizes): return 'ghostscript'
+    def timed_render(name):
+        start = time.perf_counter()
+        rasters = [raster.copy() for raster in iter_page_rasters(gs_executable, pdf_path, page_nums, dpi, rasterizer=name)]
+        return time.perf_counter() - start, rasters
+    with span('calibrate_rasterizer', file=os.path.basename(pdf_path), pages=len(page_nums), candidates=','.join(candidates)) as calibration:
+        try: best_seconds, reference = timed_render('ghostscript')
+        except (OSError, ValueError, subprocess.CalledProcessError): return 'ghostscript'
+        best = 'ghostscript'
+        for name in candidates:
+            try: seconds, rasters = timed_render(name)
+            except (OSError, ValueError, subprocess.CalledProcessError): continue # Fails on this file; never picked.
+            if seconds * CALIBRATION_MIN_SPEEDUP < best_seconds and len(rasters) == len(reference) and all(map(rasters_match, reference, rasters)): best, best_seconds = name, seconds
+        if calibration is not None: calibration.args['chosen'] = best
+    return best
+
+def resolve_rasterizer(rasterizer, gs_executable, pages_to_process, page_dpis, memory_budget=PAGE_MEMORY_BUDGET):
+    """
+    Returns the rasterizer a job renders with: rasterizer, or the default when None, with "auto"
+    resolved by choose_rasterizer and names that cannot run here by Ghostscript, which renders them.
+    """
+    rasterizer = rasterizer or DEFAULT_RASTERIZER
+    if rasterizer == 'auto': return choose_rasterizer(gs_executable, pages_to_process, page_dpis, memory_budget)
+    return rasterizer if rasterizer == 'ghostscript' or rasterizer_available(rasterizer) else 'ghostscript'
+
+
+# --- Parallel Processing ---
+def process_page_run(gs_executable, pdf_path, page_nums, do_invert, do_monochrome, thresholds, dpi=RENDER_DPI, memory_budget=PAGE_MEMORY_BUDGET, rasterizer=None, encode_for_cache=False):
+    """
+    Renders and filters one run of pages, returning (processed images in page order, peak bytes
+    the run added to the worker's memory, or None where that cannot be measured). Each image carries
+    its render resolution in info['dpi'], which sizes its page in the output. Pages over
+    memory_budget come back as StripPages. With encode_for_cache, every other page also carries its
+    page cache file in info['cache_png'] (see page_cache.encode_page). Runs in pool workers.
+    """
+    processed_images = []; peak_rss = None
+    for page_num, raster in zip(page_nums, iter_page_rasters(gs_executable, pdf_path, page_nums, dpi, memory_budget=memory_budget, cancel=worker_cancel_event, rasterizer=rasterizer)):
+        with span('filter', file=os.path.basename(pdf_path), page=page_num): img = filter_page(raster, do_invert, do_monochrome, thresholds)
+        img.info['dpi'] = (dpi, dpi)
+        if encode_for_cache and not isinstance(img, StripPage):
+            with span('cache_encode', file=os.path.basename(pdf_path), page=page_num): img.info['cache_png'] = encode_page(img)
+        processed_images.append(img)
+        # Sampled while the raster, the filtered page and the earlier pages of the run are all alive.
+        if worker_base_rss is not None and (rss := current_rss()) is not None: peak_rss = max(peak_rss or 0, rss - worker_base_rss)
+    return processed_images, peak_rss
+
+def iter_rendered_pages(gs_executable, pages_to_process, do_invert, do_monochrome, thresholds=CLASSIC_MONOCHROME, workers=DEFAULT_WORKERS, dpi=RENDER_DPI, max_pages_in_memory=MAX_PAGES_IN_MEMORY,
+                        memory_budget=PAGE_MEMORY_BUDGET, cancel=None, rasterizer=None, encode_for_cache=False):
+    """
+    Yields (pdf_path, page_num, processed_img) for every page in pages_to_process, in input order.
+    With more than one worker, page runs are rendered and filtered in a process pool. Runs are
+    sized and started by a RunScheduler, so the pages in flight fit memory_budget bytes and never
+    number more than max_pages_in_memory, however long the document. dpi is one resolution for all
+    pages or a per-page list (see plan_page_dpis). Pages that would take more than their worker's
+    share of memory_budget are processed in strips and yielded as StripPages, which both page
+    writers accept. cancel: optional multiprocessing.Event; once it is set, running Ghostscript calls are killed and JobCancelled is raised within a page.
+    rasterizer: see iter_page_rasters; "auto" picks one for these pages (see choose_rasterizer).
+    encode_for_cache: pool workers also encode the pages for the page cache (see process_page_run).
+    """
+    page_dpis = page_dpi_list(dpi, len(pages_to_process))
+    rasterizer = resolve_rasterizer(rasterizer, gs_executable, pages_to_process, page_dpis, memory_budget)
+    if workers <= 1:
+        for pdf_path, page_nums, run_dpi in group_page_runs(pages_to_process, page_dpis):
+            for page_num, raster in zip(page_nums, iter_page_rasters(gs_executable, pdf_path, page_nums, run_dpi, memory_budget=memory_budget, cancel=cancel, rasterizer=rasterizer)):
+                with span('filter', file=os.path.basename(pdf_path), page=page_num): img = filter_page(raster, do_invert, do_monochrome, thresholds)
+                img.info['dpi'] = (run_dpi, run_dpi)
+                check_cancelled(cancel)
+                yield pdf_path, page_num, img
+        return
+
+    if not pages_to_process: return
+    pool_size = max(1, min(workers, len(pages_to_process), max_pages_in_memory))
+    worker_budget = memory_budget // pool_size if memory_budget is not None else None
+    with span('plan_runs', pages=len(pages_to_process)):
+        footprints = page_footprints(pages_to_process, page_dpis, do_monochrome, worker_budget)
+        scheduler = RunScheduler(pages_to_process, page_dpis, footprints, pool_size, memory_budget if memory_budget is not None else float('inf'), max_pages_in_memory)
+    executor = ProcessPoolExecutor(max_workers=pool_size, initializer=init_pool_worker, initargs=(cancel, gs_library_path()))
+    # When tracing, workers record their own spans and send them back with the pages.
+    traced = tracing_enabled()
+    run_args = lambda run: (process_page_run, gs_executable, run[0], run[1], do_invert, do_monochrome, thresholds, run[2], worker_budget, rasterizer, encode_for_cache)
+    submit = lambda run: (run, executor.submit(call_traced, *run_args(run)) if traced else executor.submit(*run_args(run)))
+    try:
+        pending = deque()
+        while (run := scheduler.next_run()) is not None: pending.append(submit(run))
+        while pending:
+            run, future = pending.popleft(); pdf_path, page_nums = run[:2]
+            with span('wait_for_run', file=os.path.basename(pdf_path), pages=f"{page_nums[0]}-{page_nums[-1]}"): result = future.result()
+            if traced: result, worker_events = result; add_events(worker_events)
+            processed_images, measured_bytes = result
+            for page_num, img in zip(page_nums, processed_images): check_cancelled(cancel); yield pdf_path, page_num, img
+            # Only start more runs once this one has been handed over, so the budget also covers its pages.
+            del processed_images, result
+            scheduler.finished(run, measured_bytes)
+            while (run := scheduler.next_run()) is not None: pending.append(submit(run))
+    finally: executor.shutdown(wait=True, cancel_futures=True)
+
+def iter_processed_pages(gs_executable, pages_to_process, do_invert, do_monochrome, thresholds=CLASSIC_MONOCHROME, workers=DEFAULT_WORKERS, dpi=RENDER_DPI, cache=None, max_pages_in_memory=MAX_PAGES_IN_MEMORY,
+                         memory_budget=PAGE_MEMORY_BUDGET, raster_pages=None, cancel=None, rasterizer=None):
+    """
+    Like iter_rendered_pages, but pages found in cache (a page_cache.PageCache) are served from disk
+    and only the rest are sent to Ghostscript; newly processed pages are added to the cache, encoded
+    by the pool workers that made them. Cached pages are kept apart per rasterizer, so "auto" is
+    resolved for all the pages first.
+    raster_pages: optional set of the (path, page_num) that need rendering and filtering (see
+    page_classifier); the other pages are yielded as their pypdf pages, which both page writers
+    copy as vectors. cancel, rasterizer: see iter_rendered_pages.
+    """
+    if raster_pages is not None:
+        yield from iter_mixed_pages(gs_executable, pages_to_process, raster_pages, do_invert, do_monochrome, thresholds, workers, dpi, cache, max_pages_in_memory, memory_budget, cancel, rasterizer); return
+    if cache is None:
+        yield from iter_rendered_pages(gs_executable, pages_to_process, do_invert, do_monochrome, thresholds, workers, dpi, max_pages_in_memory, memory_budget, cancel, rasterizer); return
+    page_dpis = page_dpi_list(dpi, len(pages_to_process))
+    rasterizer = resolve_rasterizer(rasterizer, gs_executable, pages_to_process, page_dpis, memory_budget)
+    with span('cache_keys', pages=len(pages_to_process)): keys = cache.page_keys(pages_to_process, page_dpis, do_invert, do_monochrome, thresholds, rasterizer)
+    cached = [key is not None and key in cache for key in keys]
+    misses = [(page, page_dpi) for page, page_dpi, hit in zip(pages_to_process, page_dpis, cached) if not hit]
+    rendered = iter_rendered_pages(gs_executable, [page for page, _ in misses], do_invert, do_monochrome, thresholds, workers, [page_dpi for _, page_dpi in misses], max_pages_in_memory, memory_budget, cancel, rasterizer, encode_for_cache=True)
+    for (pdf_path, page_num), page_dpi, key, hit in zip(pages_to_process, page_dpis, keys, cached):
+        check_cancelled(cancel)
+        if hit:
+            with span('cache_get', file=os.path.basename(pdf_path), page=page_num): img = cache.get(key)
+        else: img = None
+        if img is None:
+            if hit: # Evicted since the lookup (get counted the miss); render just this page.
+                _, _, img = next(iter_rendered_pages(gs_executable, [(pdf_path, page_num)], do_invert, do_monochrome, thresholds, 1, page_dpi, memory_budget=memory_budget, cancel=cancel, rasterizer=rasterizer))
+            else:
+                _, _, img = next(rendered); cache.misses += 1
+            if not isinstance(img, StripPage): # Oversized pages would cost the cache more than a render saves.
+                with span('cache_put', file=os.path.basename(pdf_path), page=page_num): cache.put(key, img, img.info.pop('cache_png', None))
+        yield pdf_path, page_num, img
+
+def iter_mixed_pages(gs_executable, pages_to_process, raster_pages, do_invert, do_monochrome, thresholds, workers, dpi, cache, max_pages_in_memory, memory_budget, cancel=None, rasterizer=None):
+    """iter_processed_pages for the pages in raster_pages, interleaved in input order with the pypdf pages of the rest."""
+    page_dpis = page_dpi_list(dpi, len(pages_to_process))
+    selected = [(page, page_dpi) for page, page_dpi in zip(pages_to_process, page_dpis) if page in raster_pages]
+    processed = iter_processed_pages(gs_executable, [page for page, _ in selected], do_invert, do_monochrome, thresholds, workers, [page_dpi for _, page_dpi in selected], cache, max_pages_in_memory, memory_budget, raster_pages=None, cancel=cancel, rasterizer=rasterizer)
+    readers = {}
+    try:
+        for pdf_path, page_num in pages_to_process:
+            check_cancelled(cancel)
+            if (pdf_path, page_num) in raster_pages: yield next(processed); continue
+            if pdf_path not in readers: readers[pdf_path] = PdfReader(pdf_path)
+            yield pdf_path, page_num, readers[pdf_path].pages[page_num - 1]
+    finally:
+        processed.close() # Shuts the pool down before the readers go.
+        for reader in readers.values(): reader.stream.close()
+
+# --- Output Encoding ---
+# JPEG quality of gray and color pages stored as JPEG; 75 is PIL's default, which every such page used before the planner.
+JPEG_QUALITY = 75
+# An RGB page whose channels are never more than this many levels apart is stored as one gray channel.
+GRAY_TOLERANCE = 16
+# A gray page's JPEG grows by about this much when stored with three channels (1.05-1.33 on slide decks); used for the savings estimate.
+RGB_JPEG_FACTOR = 1.12
+# Flatness is judged on every PROBE_ROW_STEP-th row alone; the gray check scans those rows before the whole page, as most colored pages show it there.
+PROBE_ROW_STEP = 16
+# Flate is only tried on pages where at least this share of probed pixels repeat their left neighbour
+# (flat backgrounds and text); on busier pages it never came out smaller than JPEG.
+FLAT_SHARE = 0.995
+
+class EncodingReport:
+    """
+    Counts how a writer stored its gray and color page images, and an estimate of the bytes saved
+    against storing each as 3-channel JPEG at the same quality: measured for pages kept in color,
+    scaled by RGB_JPEG_FACTOR for pages stored as gray.
+    """
+    def __init__(self):
+        self.pages = self.gray_pages = self.flate_pages = self.bytes = self.est_bytes_saved = 0
+
+    def add(self, other):
+        for name in ('pages', 'gray_pages', 'flate_pages', 'bytes', 'est_bytes_saved'): setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def stats(self):
+        return {'pages': self.pages, 'gray_pages': self.gray_pages, 'flate_pages': self.flate_pages, 'bytes': self.bytes, 'est_bytes_saved': self.est_bytes_saved}
+
+    def summary(self):
+        """Returns a one-line encoding report for status messages."""
+        return (f"Images: {self.pages} gray/color pages ({self.gray_pages} stored as gray, {self.flate_pages} lossless), "
+                f"{self.bytes / 1024 ** 2:.1f} MB, ~{self.est_bytes_saved / 1024 ** 2:.1f} MB less than plain JPEG (estimated)")
+
+def is_effectively_gray(rgb, tolerance=GRAY_TOLERANCE):
+    """Returns whether no pixel of an (height, width, 3) uint8 raster has channels more than tolerance apart."""
+    for rows in (rgb[::PROBE_ROW_STEP], rgb):
+        for top in range(0, rows.shape[0], MONOCHROME_BAND_ROWS):
+            band = rows[top:top + MONOCHROME_BAND_ROWS]; r, g, b = band[..., 0], band[..., 1], band[..., 2]
+            if (np.maximum(np.maximum(r, g), b) - np.minimum(np.minimum(r, g), b) > tolerance).any(): return False
+    return True
+
+def flat_share(pixels):
+    """Returns the share of pixels in the probed rows of pixels (an L or RGB array) that equal their left neighbour; of RGB, only green (most of the luma) is compared."""
+    rows = pixels[::PROBE_ROW_STEP]
+    if rows.ndim == 3: rows = rows[..., 1]
+    return np.count_nonzero(rows[:, 1:] == rows[:, :-1]) / max(1, rows.size - rows.shape[0])
+
+def jpeg_data(img, quality=JPEG_QUALITY):
+    buffer = io.BytesIO(); img.save(buffer, 'JPEG', quality=quality, optimize=True) # Optimized Huffman tables; mostly-white n-up sheets shrink a lot
+    return buffer.getvalue()
+
+def flate_data(pixels, limit=None):
+    """Returns pixels (an L or RGB array) Flate-compressed, or None once the stream reaches limit bytes (photos give up early)."""
+    compressor = zlib.compressobj(); chunks = []; size = 0
+    for top in range(0, pixels.shape[0], MONOCHROME_BAND_ROWS):
+        chunks.append(compressor.compress(pixels[top:top + MONOCHROME_BAND_ROWS])); size += len(chunks[-1])
+        if limit is not None and size >= limit: return None
+    chunks.append(compressor.flush()); size += len(chunks[-1])
+    return b''.join(chunks) if limit is None or size < limit else None
+
+def plan_page_encoding(img, jpeg_quality=JPEG_QUALITY):
+    """
+    Encodes an L or RGB page the way its content favours: collapsed to L when it is effectively gray,
+    then as JPEG at jpeg_quality or, when a flat page comes out smaller that way, as lossless Flate.
+    Returns (img as encoded, PDF filter name, stream, size of the JPEG).
+    """
+    pixels = np.asarray(img)
+    if img.mode == 'RGB' and is_effectively_gray(pixels): img = img.convert('L'); pixels = np.asarray(img)
+    jpeg = jpeg_data(img, jpeg_quality)
+    flate = flate_data(pixels, limit=len(jpeg)) if flat_share(pixels) >= FLAT_SHARE else None
+    return (img, 'FlateDecode', flate, len(jpeg)) if flate is not None else (img, 'DCTDecode', jpeg, len(jpeg))
+
+def encode_page_image(img, jpeg_quality=JPEG_QUALITY, report=None):
+    """
+    Returns (image_dict_entries, stream) for embedding img as a PDF image XObject. 1-bit pages are
+    stored as CCITT Group 4 (Flate-compressed 1-bit data when PIL was built without libtiff), so
+    monochrome output never gets expanded to RGB. Gray and color pages are stored as
+    plan_page_encoding picks, and counted in report (an EncodingReport) when one is given.
+    """
+    width, height = img.size
+    if img.mode == '1':
+        if features.check('libtiff'):
+            buffer = io.BytesIO()
+            img.save(buffer, 'TIFF', compression='group4', strip_size=math.ceil(width / 8) * height) # single strip
+            with Image.open(buffer) as tiff: offset, length = tiff.tag_v2[273][0], tiff.tag_v2[279][0]
+            stream = buffer.getbuffer()[offset:offset + length].tobytes()
+            return f"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /CCITTFaxDecode /DecodeParms << /K -1 /Columns {width} /Rows {height} /BlackIs1 true >>", stream
+        return "/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode", zlib.compress(img.tobytes())
+    if img.mode not in ('L', 'RGB'): img = img.convert('RGB')
+    planned, pdf_filter, stream, jpeg_bytes = plan_page_encoding(img, jpeg_quality)
+    if report is not None:
+        report.pages += 1; report.gray_pages += planned.mode != img.mode; report.flate_pages += pdf_filter == 'FlateDecode'; report.bytes += len(stream)
+        # The planner's JPEG is of the page as stored; for pages collapsed to gray the 3-channel size is estimated rather than encoded again.
+        report.est_bytes_saved += round(jpeg_bytes * (RGB_JPEG_FACTOR if planned.mode != img.mode else 1)) - len(stream)
+    return f"/ColorSpace /{'DeviceGray' if planned.mode == 'L' else 'DeviceRGB'} /BitsPerComponent 8 /Filter /{pdf_filter}", stream
+
+class ImagePdfWriter:
+    """
+    Writes PDF pages straight to disk as they are added, so only the page being written is held in
+    memory: processed images with add_page, or pages of other PDFs with copy_page. Use as a context
+    manager, or call close() to finish the file. Gray and color images are stored as
+    plan_page_encoding picks, JPEG at jpeg_quality or Flate; report counts how.
+    """
+    def __init__(self, output_path, resolution=RENDER_DPI, jpeg_quality=JPEG_QUALITY):
+        self.file = open(output_path, 'wb')
+        self.resolution = resolution; self.jpeg_quality = jpeg_quality
+        self.report = EncodingReport()
+        self.offsets = {}; self.page_refs = []
+        self.copied = {} # (source document, object number, generation) -> object number in this file
+        self.next_obj = 3 # 1 is the catalog and 2 the page tree, both written by close()
+        self.file.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def write_obj(self, body, stream=None, num=None):
+        if num is None: num = self.next_obj; self.next_obj += 1
+        self.offsets[num] = self.file.tell()
+        self.file.write(f"{num} 0 obj\n".encode() + body)
+        if stream is not None: self.file.write(b'\nstream\n' + stream + b'\nendstream')
+        self.file.write(b'\nendobj\n')
+        return num
+
+    def write_streamed_obj(self, entries, chunks):
+        """Writes a stream object whose data arrives in chunks, so it is never held whole; its /Length follows as an object of its own."""
+        num, length_num = self.next_obj, self.next_obj + 1; self.next_obj += 2
+        self.offsets[num] = self.file.tell()
+        self.file.write(f"{num} 0 obj\n<< {entries} /Length {length_num} 0 R >>\nstream\n".encode())
+        start = self.file.tell()
+        for chunk in chunks: self.file.write(chunk)
+        length = self.file.tell() - start
+        self.file.write(b'\nendstream\nendobj\n')
+        self.write_obj(str(length).encode(), num=length_num)
+        return num
+
+    def write_image(self, img):
+        """Writes img (a PIL Image or a StripPage) as an image XObject and returns its object number."""
+        page_index = len(self.page_refs) + 1
+        width, height = img.size
+        if isinstance(img, StripPage):
+            # Too large to encode in memory: Flate-compressed strip by strip straight into the file.
+            entries = f"/ColorSpace /{'DeviceRGB' if img.mode == 'RGB' else 'DeviceGray'} /BitsPerComponent {1 if img.mode == '1' else 8} /Filter /FlateDecode"
+            with span('write_strips', page=page_index, mode=img.mode): return self.write_streamed_obj(f"/Type /XObject /Subtype /Image /Width {width} /Height {height} {entries}", img.iter_deflated())
+        with span('encode', page=page_index, mode=img.mode): entries, stream = encode_page_image(img, self.jpeg_quality, self.report)
+        with span('write_page', page=page_index, bytes=len(stream)): return self.write_obj(f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} {entries} /Length {len(stream)} >>".encode(), stream)
+
+    def add_page(self, img, page_size=None):
+        """
+        Adds img (a PIL Image or a StripPage) as a full page; page_size (points) defaults to the image
+        size at its resolution. A pypdf page is copied as is, staying vector (see copy_page).
+        """
+        if isinstance(img, PageObject): return self.copy_page(img)
+        width, height = img.size
+        # Pages rendered at a planned per-page DPI carry it in info['dpi'] (rounded: PNG stores it per metre).
+        resolution = round(img.info.get('dpi', (self.resolution,))[0], 2)
+        page_w, page_h = page_size or (width * 72.0 / resolution, height * 72.0 / resolution)
+        self.add_sheet((page_w, page_h), [(self.write_image(img), (page_w, 0, 0, page_h, 0, 0))])
+
+    def add_sheet(self, page_size, placements):
+        """Adds a page of page_size (points) showing XObjects; placements holds (object number, cm matrix) pairs, drawn in order."""
+        number = lambda value: f"{value:.4f}" if value else "0"
+        content = ' '.join(f"q {' '.join(number(v) for v in matrix)} cm /Im{i} Do Q" for i, (_, matrix) in enumerate(placements)).encode()
+        xobjects = ' '.join(f"/Im{i} {ref} 0 R" for i, (ref, _) in enumerate(placements))
+        content_ref = self.write_obj(f"<< /Length {len(content)} >>".encode(), content)
+        page_w, page_h = page_size
+        self.page_refs.append(self.write_obj(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w:.4f} {page_h:.4f}] /Resources << /XObject << {xobjects} >> >> /Contents {content_ref} 0 R >>".encode()))
+
+    def copy_page(self, page):
+        """
+        Copies a pypdf page and every object it uses at the object level: objects are renumbered and
+        streams keep their compressed bytes, so nothing is decoded or re-encoded. Objects shared by
+        several copied pages (fonts, images) are written once.
+        """
+        page_num = self.next_obj; self.next_obj += 1
+        self.copied[(id(page.indirect_reference.pdf), page.indirect_reference.idnum, page.indirect_reference.generation)] = page_num
+        self.write_obj(self.copy_object(page, page.indirect_reference.idnum)[:-2] + b'/Parent 2 0 R>>', num=page_num)
+        self.page_refs.append(page_num)
+
+    def copy_page_as_form(self, page):
+        """
+        Writes a pypdf page as a Form XObject, its content recompressed and its resources copied, for
+        placing on an n-up sheet. Returns (object number, (width, height)): the form is shown upright
+        (per /Rotate) with its lower-left corner at the origin, and is width x height points.
+        """
+        x0, y0, x1, y1 = (float(v) for v in (page.mediabox.left, page.mediabox.bottom, page.mediabox.right, page.mediabox.top))
+        contents = page.get_contents()
+        stream = zlib.compress(contents.get_data() if contents is not None else b'')
+        resources = self.copy_object(page.raw_get('/Resources')) if '/Resources' in page else b'<<>>'
+        rotation = page.rotation % 360
+        matrix = {90: (0, -1, 1, 0, -y0, x1), 180: (-1, 0, 0, -1, x1, y1), 270: (0, 1, -1, 0, y1, -x0)}.get(rotation, (1, 0, 0, 1, -x0, -y0))
+        num = self.write_obj(f"<< /Type /XObject /Subtype /Form /BBox [{x0:.4f} {y0:.4f} {x1:.4f} {y1:.4f}] /Matrix [{' '.join(f'{v:.4f}' for v in matrix)}] /Resources ".encode()
+                             + resources + f" /Filter /FlateDecode /Length {len(stream)} >>".encode(), stream)
+        return num, ((y1 - y0, x1 - x0) if rotation % 180 else (x1 - x0, y1 - y0))
+
+    def copy_object(self, obj, page_idnum=None):
+        """
+        Returns the serialization of obj, a direct object of a source document, after writing every
+        object it refers to. Links to pages other than page_idnum (not yet copied) become null rather
+        than pulling those pages in.
+        """
+        pending = []
+        def object_ref(indirect):
+            key = (id(indirect.pdf), indirect.idnum, indirect.generation)
+            if key not in self.copied:
+                target = indirect.get_object()
+                if isinstance(target, DictionaryObject) and target.get('/Type') == '/Page' and indirect.idnum != page_idnum: return b'null'
+                self.copied[key] = self.next_obj; self.next_obj += 1; pending.append((self.copied[key], target))
+            return f"{self.copied[key]} 0 R".encode()
+        def serialize(obj):
+            if isinstance(obj, IndirectObject): return object_ref(obj)
+            if isinstance(obj, DictionaryObject):
+                skipped = BACKLINK_KEYS + (('/Length',) if isinstance(obj, StreamObject) else ())
+                return b'<<' + b''.join(serialize(key) + b' ' + serialize(obj.raw_get(key)) + b'\n' for key in obj if key not in skipped) + b'>>'
+            if isinstance(obj, ArrayObject): return b'[' + b' '.join(serialize(item) for item in obj) + b']'
+            buffer = io.BytesIO(); obj.write_to_stream(buffer); return buffer.getvalue()
+
+        serialized = serialize(obj)
+        while pending:
+            num, target = pending.pop()
+            if isinstance(target, StreamObject): self.write_obj(serialize(target)[:-2] + f"/Length {len(target._data)}>>".encode(), target._data, num=num)
+            else: self.write_obj(serialize(target), num=num)
+        return serialized
+
+    def close(self):
+        kids = ' '.join(f"{ref} 0 R" for ref in self.page_refs)
+        self.write_obj(f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_refs)} >>".encode(), num=2)
+        self.write_obj(b"<< /Type /Catalog /Pages 2 0 R >>", num=1)
+        xref_offset, size = self.file.tell(), self.next_obj
+        xref = [f"xref\n0 {size}\n0000000000 65535 f \n"] + [f"{self.offsets[num]:010d} 00000 n \n" if num in self.offsets else "0000000000 65535 f \n" for num in range(1, size)]
+        self.file.write((''.join(xref) + f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n").encode())
+        self.file.close()
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None: self.close()
+        else: self.file.close()
+
+class NupImageWriter:
+    """
+    Lays processed page images out pages_per_sheet to an A4 sheet in the raster domain and writes
+    each sheet as a single image, with the same slot geometry as n_up_layout. Only the pages of the
+    sheet being filled are held in memory. Same interface as ImagePdfWriter: pypdf pages added to
+    it are written as Form XObjects at once and drawn over the sheet image in their slots, so they
+    stay vector.
+    """
+    def __init__(self, output_path, pages_per_sheet, sheet_dpi=TARGET_PRINT_DPI, jpeg_quality=JPEG_QUALITY):
+        self.writer = ImagePdfWriter(output_path, sheet_dpi, jpeg_quality); self.report = self.writer.report
+        self.sheet_dpi = sheet_dpi; self.pages_per_sheet = pages_per_sheet
+        self.geometry = nup_geometry(pages_per_sheet)
+        self.sheet_pages = [] # Images, or (form object number, (width, height)) for vector pages
+
+    def add_page(self, img):
+        self.sheet_pages.append(self.writer.copy_page_as_form(img) if isinstance(img, PageObject) else img)
+        if len(self.sheet_pages) == self.pages_per_sheet: self.flush_sheet()
+
+    def flush_sheet(self):
+        """Composites the pending page images onto a white sheet canvas and writes it out, with any vector pages placed on top."""
+        if not self.sheet_pages: return
+        sheet_w, sheet_h, positions, slot_w, slot_h = self.geometry
+        px = lambda points: int(round(points * self.sheet_dpi / 72.0))
+        images = [(img, position) for img, position in zip(self.sheet_pages, positions) if not isinstance(img, tuple)]
+        placements = []
+        if images:
+            # Stay 1-bit when every page is, so monochrome sheets are still stored as CCITT G4.
+            modes = {img.mode for img, _ in images}
+            mode = '1' if modes == {'1'} else 'L' if modes <= {'1', 'L'} else 'RGB'
+            with span('compose_sheet', sheet=len(self.writer.page_refs) + 1, pages=len(images)):
+                canvas = np.ones((px(sheet_h), px(sheet_w)), dtype=bool) if mode == '1' else np.full((px(sheet_h), px(sheet_w)) + ((3,) if mode == 'RGB' else ()), 255, dtype=np.uint8)
+                for img, (slot_x, slot_y) in images:
+                    page_dpi = img.info.get('dpi', (self.sheet_dpi,))[0]
+                    page_w, page_h = img.width * 72.0 / page_dpi, img.height * 72.0 / page_dpi
+                    scale = min(slot_w / page_w, slot_h / page_h)
+                    width, height = max(1, px(page_w * scale)), max(1, px(page_h * scale))
+                    # PDF slots are placed from the bottom-left; canvas rows run from the top.
+                    left = px(slot_x + (slot_w - page_w * scale) / 2); top = px(sheet_h - slot_y - slot_h + (slot_h - page_h * scale) / 2)
+                    page = np.asarray(self.fit_page(img, mode, (width, height)))
+                    # Pages kept at their rendered size may be a pixel or two off the slot: centre them, trimming any excess.
+                    top, height, rows = self.centre(top, height, page.shape[0], canvas.shape[0])
+                    left, width, cols = self.centre(left, width, page.shape[1], canvas.shape[1])
+                    canvas[top:top + height, left:left + width] = page[rows, cols]
+            placements.append((self.writer.write_image(Image.fromarray(canvas)), (sheet_w, 0, 0, sheet_h, 0, 0))) # bool canvases come back as mode '1'
+        for (form_ref, (page_w, page_h)), (slot_x, slot_y) in ((item, position) for item, position in zip(self.sheet_pages, positions) if isinstance(item, tuple)):
+            scale = min(slot_w / page_w, slot_h / page_h)
+            placements.append((form_ref, (scale, 0, 0, scale, slot_x + (slot_w - page_w * scale) / 2, slot_y + (slot_h - page_h * scale) / 2)))
+        self.sheet_pages = []
+        self.writer.add_sheet((sheet_w, sheet_h), placements)
+
+    @staticmethod
+    def centre(start, extent, size, limit):
+        """Centres size pixels in the slot span [start, start + extent) and clips to the canvas; returns (start, extent, source slice)."""
+        offset = (extent - size) // 2
+        start, skip = (start + offset, 0) if offset >= 0 else (start, -offset)
+        extent = max(0, min(size - skip, extent, limit - start))
+        return start, extent, slice(skip, skip + extent)
+
+    def fit_page(self, img, mode, size):
+        """Returns the page in the sheet's mode at its slot size, or unscaled when it is already within about 1% of it."""
+        if isinstance(img, StripPage):
+            # Oversized pages are box-reduced strip by strip first; 1-bit ones come back in gray and are re-thresholded.
+            one_bit = img.mode == '1'; img = img.reduced(size)
+            if one_bit: img = img.resize(size, Image.BOX); return img.point(lambda v: 255 if v >= 128 else 0).convert(mode) if mode == '1' else img.convert(mode)
+        if all(abs(actual - wanted) <= max(2, wanted // 100) for actual, wanted in zip(img.size, size)): return img.convert(mode) if img.mode != mode else img
+        if img.mode == '1':
+            # Reductions average through gray and re-threshold; nearest neighbour would drop thin strokes.
+            if img.width > size[0]:
+                img = img.convert('L').resize(size, Image.BOX)
+                return img.point(lambda v: 255 if v >= 128 else 0).convert(mode) if mode == '1' else img
+            return img.resize(size, Image.NEAREST).convert(mode)
+        return img.convert(mode).resize(size, Image.LANCZOS)
+
+    def drop_partial_sheet(self):
+        """Forgets the pages of a sheet that is not full yet and returns how many there were."""
+        dropped = len(self.sheet_pages); self.sheet_pages = []
+        return dropped
+
+    def close(self):
+        self.flush_sheet(); self.writer.close()
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None: self.close()
+        else: self.writer.file.close()
+
+def open_page_writer(output_path, pages_per_sheet=1, jpeg_quality=JPEG_QUALITY):
+    """Returns an ImagePdfWriter for 1-up output, or a NupImageWriter that composes n-up sheets directly."""
+    return ImagePdfWriter(output_path, jpeg_quality=jpeg_quality) if int(pages_per_sheet) == 1 else NupImageWriter(output_path, int(pages_per_sheet), jpeg_quality=jpeg_quality)
+
+def save_images_as_pdf(images, output_path, resolution=RENDER_DPI):
+    """Saves images as a PDF with one full-page image per page."""
+    with ImagePdfWriter(output_path, resolution) as writer:
+        for img in images: writer.add_page(img)
+
+def merge_pdf_pages(pages_to_process, output_path):
+    """Writes the selected (path, page_num) pages to output_path by copying their objects, without re-encoding anything."""
+    readers = {}
+    try:
+        with span('merge', pages=len(pages_to_process)), ImagePdfWriter(output_path) as writer:
+            for pdf_path, page_num in pages_to_process:
+                if pdf_path not in readers: readers[pdf_path] = PdfReader(pdf_path)
+                with span('copy_page', file=os.path.basename(pdf_path), page=page_num): writer.copy_page(readers[pdf_path].pages[page_num - 1])
+    finally:
+        for reader in readers.values(): reader.stream.close()
+
+def merge_pdfs(part_paths, output_path):
+    """Concatenates whole PDF files at the object level; cost grows with object count, not with pixels."""
+    pages_to_process = []
+    for path in part_paths:
+        with open(path, 'rb') as f: pages_to_process.extend((path, page_num) for page_num in range(1, len(PdfReader(f).pages) + 1))
+    merge_pdf_pages(pages_to_process, output_path)
@@ -0,0 +1,114 @@
+"""
+Persistent index of input PDF metadata for the PDF Processor Suite.
+
+Page counts, page sizes and encryption status are read once per file and kept in a small JSON
+file, so pressing Process again, or re-adding a file, does not re-parse large inputs. An entry is
+reused while the file's size and modification time are unchanged; when only the time changed (a
+copy, a touch) or the file was moved, a fingerprint of its first and last 64 KiB decides.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pypdf import PdfReader
+from pdf_engine import RENDER_DPI
+
+# Bump when the stored fields change, so old entries are re-read.
+INDEX_VERSION = 1
+DEFAULT_INDEX_PATH = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'), 'PDFProcessorSuite', 'pdf_index.json')
+MAX_INDEX_ENTRIES = 5000
+# PDFs keep their xref and trailer at the end, so head and tail change whenever the document does.
+FINGERPRINT_BYTES = 64 * 1024
+
+def file_fingerprint(path, size):
+    """Returns a hex digest of the file size and its first and last FINGERPRINT_BYTES."""
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES: f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES)); digest.update(f.read())
+    return digest.hexdigest()
+
+def read_pdf_info(path):
+    """
+    Parses path and returns its metadata: page_count, page_sizes ([width, height] in points as the
+    page is shown, i.e. with /Rotate applied), encrypted, and render_megapixels, the pixels one
+    full-page render at RENDER_DPI produces, as an estimate of its render cost.
+    """
+    with open(path, 'rb') as f:
+        reader = PdfReader(f)
+        encrypted = reader.is_encrypted
+        if encrypted: reader.decrypt('') # Most "encrypted" lecture PDFs only restrict printing or copying.
+        page_sizes = []
+        for page in reader.pages:
+            width, height = float(page.mediabox.width), float(page.mediabox.height)
+            page_sizes.append([height, width] if page.rotation % 180 else [width, height])
+    render_megapixels = sum(w * h for w, h in page_sizes) * (RENDER_DPI / 72.0) ** 2 / 1e6
+    return {'page_count': len(page_sizes), 'page_sizes': page_sizes, 'encrypted': encrypted, 'render_megapixels': round(render_megapixels, 1)}
+
+class PdfIndex:
+    """
+    Metadata of input PDFs by absolute path, persisted to index_path by save(). Lookups that miss
+    parse the file; files pypdf cannot read raise as PdfReader would and are not indexed.
+    """
+    def __init__(self, index_path=DEFAULT_INDEX_PATH, max_entries=MAX_INDEX_ENTRIES):
+        self.index_path = index_path; self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # Least recently used first.
+        try:
+            with open(index_path) as f: stored = json.load(f)
+            if stored.get('version') == INDEX_VERSION: self.entries.update(stored['entries'])
+        except (OSError, ValueError, KeyError, AttributeError): pass # Missing or damaged; start empty.
+        self.by_fingerprint = {entry['fingerprint']: key for key, entry in self.entries.items()}
+
+    def info(self, path):
+        """Returns the metadata dict of path (see read_pdf_info), from the index when the file is unchanged. Thread-safe."""
+        key = os.path.abspath(path); stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                self.entries.move_to_end(key); self.hits += 1
+                return entry
+        # Hashing and parsing happen outside the lock, so several files can be scanned at once.
+        fingerprint = file_fingerprint(path, stat.st_size)
+        with self.lock:
+            known = entry if entry is not None and entry['fingerprint'] == fingerprint else self.entries.get(self.by_fingerprint.get(fingerprint))
+            if known is not None and known['fingerprint'] != fingerprint: known = None
+        parsed = known is None
+        if parsed: known = dict(read_pdf_info(path), fingerprint=fingerprint)
+        entry = dict(known, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        with self.lock:
+            if parsed: self.misses += 1
+            else: self.hits += 1
+            self.entries[key] = entry; self.entries.move_to_end(key)
+            self.by_fingerprint[fingerprint] = key; self.dirty = True
+        return entry
+
+    def page_count(self, path): return self.info(path)['page_count']
+
+    def page_size(self, path, page_num):
+        """Returns the shown (width, height) of page page_num of path, in points."""
+        return tuple(self.info(path)['page_sizes'][page_num - 1])
+
+    def save(self):
+        """Writes the index to disk if it changed, dropping the least recently used entries beyond max_entries."""
+        with self.lock:
+            if not self.dirty: return
+            while len(self.entries) > self.max_entries:
+                key, entry = self.entries.popitem(last=False)
+                if self.by_fingerprint.get(entry['fingerprint']) == key: del self.by_fingerprint[entry['fingerprint']]
+            stored = json.dumps({'version': INDEX_VERSION, 'entries': self.entries})
+            self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(self.index_path))
+            with os.fdopen(fd, 'w') as f: f.write(stored)
+            os.replace(temp_path, self.index_path) # Atomic, so a crash never leaves a half-written index.
+        except OSError: pass # Read-only profile: the index still works for this session.
+
+def open_pdf_index(index_path=DEFAULT_INDEX_PATH):
+    """Returns the PdfIndex stored at index_path (empty when there is none yet)."""
+    return PdfIndex(index_path)
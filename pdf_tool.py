@@ -6,12 +6,23 @@ import sys
 import tempfile
 import threading
 import queue
+import multiprocessing
 import re
 import shutil
 import time
 from pypdf import PdfReader, PdfWriter, Transformation
-from PIL import Image, ImageOps
-import numpy as np
+from pdf_engine import iter_processed_pages, merge_pdf_pages, nup_geometry, plan_page_dpis, CLASSIC_MONOCHROME, DEFAULT_WORKERS, JobCancelled, format_page_spec
+from vector_invert import write_inverted_pdf
+from page_cache import open_page_cache
+from pdf_trace import span, trace_from_environment, finish_trace
+from pdf_index import open_pdf_index
+from preflight import PreflightScanner, preflight_note, preflight_summary
+from thumbnail_grid import ThumbnailGrid
+from build_frames import find_build_frames, build_report
+from page_classifier import classify_pages
+from job_journal import open_job_journal
+from gs_library import gs_library_from_environment
+from pdf_cli import parse_page_spec
 
 # This function is correct and will work with the bundled GS directory
 def find_ghostscript_executable():
@@ -49,6 +60,8 @@ class PdfToolApp:
 
         self.task_queue = queue.Queue()
         self.file_list_data = []
+        self.pdf_index = open_pdf_index() # Page counts and sizes of files seen before come from disk instead of being re-parsed
+        self.preflight = PreflightScanner(self.pdf_index) # Added files are opened and checked in the background
 
         main_frame = tk.Frame(root)
         main_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
@@ -78,13 +91,21 @@ class PdfToolApp:
         self.page_range_var=StringVar(); self.page_range_entry=Entry(range_frame, textvariable=self.page_range_var); self.page_range_entry.grid(row=0, column=1, sticky="ew", padx=5)
         self.apply_range_button=tk.Button(range_frame,text="Apply",command=self.apply_page_range); self.apply_range_button.grid(row=0, column=2, padx=(0,5))
         self.reset_range_button=tk.Button(range_frame,text="Reset",command=self.reset_page_range); self.reset_range_button.grid(row=0, column=3)
+        self.thumbnails_button=tk.Button(range_frame,text="Thumbnails...",command=self.open_thumbnails); self.thumbnails_button.grid(row=0, column=4, padx=(5,0))
+        self.builds_button=tk.Button(range_frame,text="Find Builds",command=self.find_builds); self.builds_button.grid(row=0, column=5, padx=(5,0))
         self.toggle_editor_widgets('disabled')
         tk.Label(options_frame, text="Global Processing Options", font=("Helvetica", 10, "bold")).pack(anchor="w", padx=5, pady=2)
         layout_frame = tk.Frame(options_frame); layout_frame.pack(fill="x", padx=5, pady=3)
         tk.Label(layout_frame,text="Layout:").pack(side="left"); self.layout_var=StringVar(value="1"); ttk.Combobox(layout_frame,textvariable=self.layout_var,values=["1","2","3","4"],state="readonly",width=10).pack(side="left",padx=5); tk.Label(layout_frame,text="(pages per sheet)").pack(side="left")
         self.invert_var=BooleanVar(value=True); Checkbutton(options_frame, text="Invert Colors (for dark background PDFs)", variable=self.invert_var).pack(anchor="w",padx=5)
         self.monochrome_var=BooleanVar(value=True); Checkbutton(options_frame, text="Apply Smart Monochrome Filter (Pure B&W)", variable=self.monochrome_var).pack(anchor="w",padx=5)
+        self.auto_var=BooleanVar(value=False); Checkbutton(options_frame, text="Auto-Detect Dark Pages (leave light pages untouched)", variable=self.auto_var).pack(anchor="w",padx=5)
+        workers_frame = tk.Frame(options_frame); workers_frame.pack(fill="x", padx=5, pady=3)
+        tk.Label(workers_frame,text="Workers:").pack(side="left"); self.workers_var=StringVar(value=str(DEFAULT_WORKERS)); tk.Spinbox(workers_frame,textvariable=self.workers_var,from_=1,to=os.cpu_count() or 1,state="readonly",width=5).pack(side="left",padx=5); tk.Label(workers_frame,text="(parallel page processes)").pack(side="left")
+        invert_engine_frame = tk.Frame(options_frame); invert_engine_frame.pack(fill="x", padx=5, pady=3)
+        tk.Label(invert_engine_frame,text="Invert engine:").pack(side="left"); self.invert_engine_var=StringVar(value="Raster"); ttk.Combobox(invert_engine_frame,textvariable=self.invert_engine_var,values=["Raster","Vector"],state="readonly",width=8).pack(side="left",padx=5); tk.Label(invert_engine_frame,text="(Vector keeps text selectable; used when monochrome is off)").pack(side="left")
         self.process_button=tk.Button(process_button_frame,text="2. Process & Save PDF",bg="#4CAF50",fg="white",font=("Helvetica",12,"bold"),command=self.start_processing_thread); self.process_button.grid(row=0, column=0, sticky="ew", ipady=8)
+        self.cancel_button=tk.Button(process_button_frame,text="Cancel",state="disabled",command=self.cancel_processing); self.cancel_button.grid(row=0, column=1, sticky="ns", padx=(5,0))
         self.status_label = tk.Label(progress_frame, text="Select files to begin.", font=("Helvetica", 9), fg="gray"); self.status_label.grid(row=0, column=0, sticky="ew")
         self.time_label = tk.Label(progress_frame, text="", font=("Helvetica", 9), fg="gray"); self.time_label.grid(row=1, column=0, sticky="ew")
         self.progress_bar=ttk.Progressbar(progress_frame,mode='determinate'); self.progress_bar.grid(row=2, column=0, sticky="ew", pady=(5,0))
@@ -94,8 +115,7 @@ class PdfToolApp:
         for file_data in self.file_list_data:
             path = file_data['path']
             try:
-                reader = PdfReader(path)
-                total_pages_in_file = len(reader.pages)
+                total_pages_in_file = self.preflight.page_count(path) # Usually known already from the preflight scan
                 pages_to_keep = set(range(1, total_pages_in_file + 1))
                 range_spec = file_data.get('pages_to_remove', 'none')
 
@@ -118,11 +138,14 @@ class PdfToolApp:
             except Exception as e:
                 self.task_queue.put(('error', f"Could not read {os.path.basename(path)}: {e}"))
                 return []
+        self.preflight.save()
         return pages_to_process
 
     def start_processing_thread(self):
         if not self.file_list_data: return messagebox.showwarning("No Files", "Please add one or more PDF files.")
-        pages_to_process = self.get_pages_to_process()
+        self.trace_path = trace_from_environment() # PDF_PROCESSOR_TRACE=trace.json records a Perfetto trace of the job
+        gs_library_from_environment(GS_EXECUTABLE) # PDF_PROCESSOR_GS_LIBRARY=auto renders in-process with the Ghostscript library
+        with span('collect_pages'): pages_to_process = self.get_pages_to_process()
         if not pages_to_process:
              self.check_queue()
              return
@@ -132,69 +155,72 @@ class PdfToolApp:
 
         self.process_button.config(state="disabled", text="Processing...")
         self.toggle_editor_widgets('disabled')
-        threading.Thread(target=self.run_processing_in_thread, kwargs={"output_path": output_path, "layout": self.layout_var.get(), "do_invert": self.invert_var.get(), "do_monochrome": self.monochrome_var.get(), "pages_to_process": pages_to_process, "queue": self.task_queue}, daemon=True).start()
+        self.cancel_event = multiprocessing.Event(); self.cancel_button.config(state="normal", text="Cancel") # Shared with the pool's workers
+        threading.Thread(target=self.run_processing_in_thread, kwargs={"output_path": output_path, "layout": self.layout_var.get(), "do_invert": self.invert_var.get(), "do_monochrome": self.monochrome_var.get(), "pages_to_process": pages_to_process, "workers": int(self.workers_var.get()), "invert_engine": self.invert_engine_var.get().lower(), "auto_detect": self.auto_var.get(), "cancel": self.cancel_event, "queue": self.task_queue}, daemon=True).start()
         self.check_queue()
 
-    def process_image_intelligently(self, img, do_invert, do_monochrome):
-        if do_invert:
-            if img.mode == 'RGBA': bg = Image.new('RGB', img.size, (255, 255, 255)); bg.paste(img, mask=img.getchannel('A')); img = bg
-            else: img = img.convert('RGB')
-            img = ImageOps.invert(img)
-        if do_monochrome:
-            if img.mode != 'RGB': img = img.convert('RGB')
-            hsv_data = np.array(img.convert('HSV')); saturation = hsv_data[:, :, 1]
-            gray_data = np.array(img.convert('L')); colored_mask = (saturation > 50)
-            bw_data = (gray_data > 240) * 255; bw_data[colored_mask] = 0
-            light_text_mask = (gray_data > 128); bw_data[colored_mask & light_text_mask] = 255
-            img = Image.fromarray(bw_data.astype(np.uint8))
-        return img
+    def cancel_processing(self):
+        self.cancel_event.set(); self.cancel_button.config(state="disabled", text="Cancelling...") # Ghostscript is stopped mid-page
 
-    def run_processing_in_thread(self, output_path, layout, do_invert, do_monochrome, pages_to_process, queue):
-        temp_dir = tempfile.mkdtemp()
+    def run_processing_in_thread(self, output_path, layout, do_invert, do_monochrome, pages_to_process, workers, invert_engine, queue, auto_detect=False, cancel=None):
+        temp_dir = tempfile.mkdtemp(); journal = None
         try:
+            page_cache = open_page_cache() # Pages processed before with the same options are reused from disk.
             total_pages = len(pages_to_process)
             if total_pages == 0: raise ValueError("No pages were selected or found.")
             queue.put(('progress', (0, total_pages, time.time()))) 
             
-            queue.put(('status', "Step 1/3: Preparing pages..."))
-            merged_input_path = os.path.join(temp_dir, "input.pdf")
-            writer = PdfWriter(); readers = {}
-            for pdf_path, page_num in pages_to_process:
-                if pdf_path not in readers: readers[pdf_path] = PdfReader(pdf_path)
-                writer.add_page(readers[pdf_path].pages[page_num - 1])
-            with open(merged_input_path, 'wb') as f: writer.write(f)
-            for reader in readers.values(): reader.stream.close()
+            if auto_detect and (do_invert or do_monochrome):
+                queue.put(('status', "Checking which pages are dark..."))
+                raster_pages = classify_pages(GS_EXECUTABLE, pages_to_process, do_invert, do_monochrome) # Light pages are left as they are.
+            else: raster_pages = None
+            # Plain inversion can rewrite the page colors directly and keep the pages vector.
+            use_vector_invert = do_invert and not do_monochrome and invert_engine == "vector"
+            is_processing_needed = (do_invert or do_monochrome) and not use_vector_invert
+            if use_vector_invert:
+                queue.put(('status', "Step 1/3: Inverting page colors..."))
+                merged_input_path = os.path.join(temp_dir, "input.pdf"); write_inverted_pdf(pages_to_process, merged_input_path, raster_pages)
+            elif is_processing_needed:
+                # Page runs are rendered and filtered across the worker pool; each page is written out as soon as it arrives,
+                # already composed onto its n-up sheet, so the layout step has nothing left to do for processed pages.
+                # Pages are written in checkpointed parts, so a failed or cancelled job resumes where it stopped.
+                page_dpis = plan_page_dpis(pages_to_process, int(layout), index=self.pdf_index)
+                journal = open_job_journal({"layout": int(layout), "invert": do_invert, "monochrome": do_monochrome, "thresholds": list(CLASSIC_MONOCHROME), "dpi": page_dpis, "auto_detect": auto_detect}, pages_to_process, layout)
+                done = journal.done_pages
+                if done: queue.put(('status', f"Resuming after page {done} of {total_pages}..."))
+                try:
+                    for i, (pdf_path, page_num, processed_img) in enumerate(iter_processed_pages(GS_EXECUTABLE, pages_to_process[done:], do_invert, do_monochrome, CLASSIC_MONOCHROME, workers, dpi=page_dpis[done:], cache=page_cache, raster_pages=raster_pages, cancel=cancel), done):
+                        queue.put(('progress', (i, total_pages, time.time())))
+                        journal.add_page(processed_img) # Monochrome pages stay 1-bit
+                except BaseException: journal.close(); raise # Checkpoints the pages written so far for a resume.
+                assembled_pdf_path = os.path.join(temp_dir, 'assembled.pdf')
+                journal.finish(assembled_pdf_path, total_pages); pages_written = journal.done_pages
+            else:
+                queue.put(('status', "Step 1/3: Preparing pages..."))
+                merged_input_path = os.path.join(temp_dir, "input.pdf")
+                merge_pdf_pages(pages_to_process, merged_input_path) # Object-level copy; page streams are not re-encoded.
 
-            is_processing_needed = do_invert or do_monochrome
-            if is_processing_needed:
-                input_reader = PdfReader(merged_input_path); processed_images = []
-                for i, page in enumerate(input_reader.pages):
-                    queue.put(('progress', (i, total_pages, time.time())))
-                    single_page_pdf_path = os.path.join(temp_dir, 'single_page.pdf')
-                    writer_single = PdfWriter(); writer_single.add_page(page)
-                    with open(single_page_pdf_path, 'wb') as out_f: writer_single.write(out_f)
-                    output_png_path = os.path.join(temp_dir, 'page.png')
-                    subprocess.run([GS_EXECUTABLE, '-dQUIET', '-dSAFER', '-sDEVICE=png16m', '-r200', f'-o{output_png_path}', single_page_pdf_path], check=True, creationflags=subprocess.CREATE_NO_WINDOW)
-                    with Image.open(output_png_path) as img: processed_images.append(self.process_image_intelligently(img, do_invert, do_monochrome).convert('RGB'))
-            
             if not is_processing_needed:
                 queue.put(('status', "Step 2/3: Applying layout...")); pdf_to_layout = merged_input_path
-            elif processed_images:
-                queue.put(('status', "Step 2/3: Assembling processed pages...")); assembled_pdf_path = os.path.join(temp_dir, 'assembled.pdf')
-                processed_images[0].save(assembled_pdf_path, "PDF", resolution=200.0, save_all=True, append_images=processed_images[1:]); pdf_to_layout = assembled_pdf_path
+            elif pages_written:
+                queue.put(('status', "Step 2/3: Applying layout...")); pdf_to_layout = assembled_pdf_path
             else: raise ValueError("Processing failed to produce any pages.")
 
             queue.put(('status', f"Step 3/3: Saving final '{layout}-up' layout..."))
-            if layout == "1": shutil.copy(pdf_to_layout, output_path)
+            if layout == "1" or is_processing_needed: shutil.copy(pdf_to_layout, output_path)
             else: n_up_layout(pdf_to_layout, output_path, int(layout))
+            if journal: journal.discard()
             
-            queue.put(('success', f"PDF successfully processed!\nSaved to: {output_path}"))
+            queue.put(('success', f"PDF successfully processed!\nSaved to: {output_path}" + (f"\n\n{page_cache.summary()}" if page_cache and page_cache.hits + page_cache.misses else "")
+                + (f"\n\n{journal.report.summary()}" if journal and journal.report.pages else "")))
             
+        except JobCancelled:
+            queue.put(('cancelled', f"Processing was cancelled. {journal.done_pages if journal else 0} of {total_pages} pages are saved; process the same files with the same options again to continue from there."))
         except Exception as e:
             error_msg = f"An error occurred: {str(e)}"
             if isinstance(e, subprocess.CalledProcessError): error_output = e.stderr.decode(errors='ignore') if e.stderr else (e.stdout.decode(errors='ignore') if e.stdout else 'No error output.'); error_msg = f"Ghostscript failed:\n\n{error_output}"
             queue.put(('error', error_msg))
-        finally: shutil.rmtree(temp_dir, ignore_errors=True)
+        finally: shutil.rmtree(temp_dir, ignore_errors=True); finish_trace(self.trace_path)
 
     def check_queue(self):
         try: msg_type, data = self.task_queue.get_nowait()
@@ -212,8 +238,9 @@ class PdfToolApp:
         else:
             self.progress_bar['value'] = 0; self.time_label.config(text="")
             if msg_type == 'success': messagebox.showinfo("Success!", data); self.status_label.config(text="Done!", fg="darkgreen")
+            elif msg_type == 'cancelled': messagebox.showinfo("Cancelled", data); self.status_label.config(text="Cancelled.", fg="gray")
             else: messagebox.showerror("Error", data); self.status_label.config(text="An error occurred.", fg="red")
-            self.process_button.config(state="normal", text="2. Process & Save PDF")
+            self.process_button.config(state="normal", text="2. Process & Save PDF"); self.cancel_button.config(state="disabled", text="Cancel")
             if self.listbox.curselection(): self.toggle_editor_widgets('normal')
 
     # UI Helper Functions
@@ -223,14 +250,26 @@ class PdfToolApp:
         self.editor_info_label.config(text=f"Editing: {os.path.basename(file_data['path'])}");
         page_range_text = file_data.get('pages_to_remove', 'none')
         self.page_range_var.set("" if page_range_text == 'none' else page_range_text)
-    def toggle_editor_widgets(self,state): [w.config(state=state)for w in[self.page_range_entry,self.apply_range_button,self.reset_range_button]]
+    def toggle_editor_widgets(self,state): [w.config(state=state)for w in[self.page_range_entry,self.apply_range_button,self.reset_range_button,self.thumbnails_button,self.builds_button]]
     def add_files(self):
         files=filedialog.askopenfilenames(title="Add PDF Files",filetypes=(("PDF Files","*.pdf"),));
         if files:
             for f in files:
-                if not any(d['path']==f for d in self.file_list_data):self.file_list_data.append({'path':f,'pages_to_remove':'none','display_name':f"{os.path.basename(f)} [All Pages]"})
-            self.update_listbox(); self.status_label.config(text=f"{len(self.file_list_data)} file(s) in list.",fg="darkgreen")
+                if not any(d['path']==f for d in self.file_list_data):self.file_list_data.append({'path':f,'pages_to_remove':'none','display_name':f"{os.path.basename(f)} [All Pages]",'preflight':None}); self.preflight.submit(f)
+            self.update_listbox(); self.status_label.config(text=preflight_summary(self.file_list_data,int(self.workers_var.get())),fg="darkgreen"); self.check_preflight()
             if not self.listbox.curselection(): self.listbox.selection_set(0); self.on_file_select()
+    def check_preflight(self):
+        """Shows background preflight results in the file list as they arrive; polls until every scan is done."""
+        if (results := self.preflight.poll()):
+            for path, result in results:
+                for item in self.file_list_data:
+                    if item['path'] == path: item['preflight'] = result
+            sel = self.listbox.curselection(); self.update_listbox(selection_idx=sel[0] if sel else None)
+            if str(self.process_button['state']) == 'normal': # Progress messages own the status line while a job runs
+                broken = any(isinstance(item.get('preflight'), Exception) for item in self.file_list_data)
+                self.status_label.config(text=preflight_summary(self.file_list_data, int(self.workers_var.get())), fg="red" if broken else "darkgreen")
+        if self.preflight.pending() or not self.preflight.results.empty(): self.root.after(200, self.check_preflight)
+        else: self.preflight.save()
     def apply_page_range(self):
         if not(sel_idx:=self.listbox.curselection()):return
         idx=sel_idx[0];range_spec=self.page_range_var.get().strip()
@@ -240,8 +279,43 @@ class PdfToolApp:
     def reset_page_range(self):
         if not(sel_idx:=self.listbox.curselection()):return
         idx=sel_idx[0];self.file_list_data[idx]['pages_to_remove']='none';self.file_list_data[idx]['display_name']=f"{os.path.basename(self.file_list_data[idx]['path'])} [All Pages]";self.page_range_var.set('');self.update_listbox(selection_idx=idx)
+    def open_thumbnails(self):
+        """Opens the thumbnail grid of the selected file; clicking pages there edits its page range."""
+        if not (sel := self.listbox.curselection()): return
+        if GS_EXECUTABLE is None: return messagebox.showerror("Preview Error", "Ghostscript is needed to render page thumbnails.")
+        file_data = self.file_list_data[sel[0]]
+        try: page_sizes = self.pdf_index.info(file_data['path'])['page_sizes']
+        except Exception as e: return messagebox.showerror("Preview Error", f"Could not read {os.path.basename(file_data['path'])}: {e}")
+        def apply_spec(range_spec):
+            if file_data not in self.file_list_data: return # Removed from the list while the grid was open
+            idx = self.file_list_data.index(file_data)
+            self.listbox.selection_clear(0, tk.END); self.listbox.selection_set(idx); self.page_range_var.set(range_spec); self.apply_page_range()
+        removed = parse_page_spec(file_data.get('pages_to_remove', 'none'), len(page_sizes))
+        ThumbnailGrid(self.root, GS_EXECUTABLE, file_data['path'], page_sizes, removed, lambda: (self.invert_var.get(), self.monochrome_var.get(), CLASSIC_MONOCHROME), apply_spec)
+    def find_builds(self):
+        """Looks for slide build-up frames in the selected file in the background; check_builds then removes all but the last frame of each."""
+        if not (sel := self.listbox.curselection()): return
+        file_data = self.file_list_data[sel[0]]
+        try: total_pages = self.preflight.page_count(file_data['path'])
+        except Exception as e: return messagebox.showerror("Build Frames", f"Could not read {os.path.basename(file_data['path'])}: {e}")
+        removed = parse_page_spec(file_data.get('pages_to_remove', 'none'), total_pages)
+        pages = [(file_data['path'], page_num) for page_num in range(1, total_pages + 1) if page_num not in removed]
+        self.builds_button.config(state='disabled'); self.status_label.config(text=f"Looking for build frames in {os.path.basename(file_data['path'])}...", fg="blue")
+        self.check_builds(file_data, removed, self.preflight.executor.submit(find_build_frames, pages, GS_EXECUTABLE))
+    def check_builds(self, file_data, removed, future):
+        """Adds the build frames found by find_builds to the file's removed pages and reports them; the user can restore any in the Page Editor."""
+        if not future.done(): return self.root.after(200, self.check_builds, file_data, removed, future)
+        self.builds_button.config(state=self.apply_range_button['state']); self.status_label.config(text=preflight_summary(self.file_list_data, int(self.workers_var.get())), fg="darkgreen")
+        try: build_frames = future.result()
+        except Exception as e: return messagebox.showerror("Build Frames", f"Could not check {os.path.basename(file_data['path'])}: {e}")
+        if not build_frames: return messagebox.showinfo("Build Frames", "No build-up frames found.")
+        if file_data not in self.file_list_data: return # Removed from the list in the meantime
+        idx = self.file_list_data.index(file_data)
+        self.listbox.selection_clear(0, tk.END); self.listbox.selection_set(idx); self.on_file_select()
+        self.page_range_var.set(format_page_spec(removed | {page_num for _, page_num in build_frames})); self.apply_page_range()
+        messagebox.showinfo("Build Frames", "\n".join(build_report(build_frames)) + "\n\nThese pages are now in the removed pages. Edit the range, or click them in Thumbnails..., to keep any of them.")
     def update_listbox(self,selection_idx=None):
-        self.listbox.delete(0,tk.END);[self.listbox.insert(tk.END,item['display_name'])for item in self.file_list_data];
+        self.listbox.delete(0,tk.END);[self.listbox.insert(tk.END,item['display_name']+preflight_note(item.get('preflight')))for item in self.file_list_data];
         if selection_idx is not None: self.listbox.selection_set(selection_idx); self.listbox.see(selection_idx)
     def clear_list(self):
         self.file_list_data=[]; self.update_listbox(); self.status_label.config(text="Select files to begin.",fg="gray");
@@ -253,33 +327,30 @@ class PdfToolApp:
         elif direction=='down' and pos < len(self.file_list_data)-1: self.file_list_data.insert(pos+1,self.file_list_data.pop(pos)); self.update_listbox(pos+1)
 
 def n_up_layout(input_pdf_path, output_pdf_path, pages_per_sheet):
-    reader = PdfReader(input_pdf_path)
-    writer = PdfWriter()
+    with span('n_up_layout', pages_per_sheet=pages_per_sheet):
+        reader = PdfReader(input_pdf_path)
+        writer = PdfWriter()
     
-    a4_w, a4_h = 595.2, 841.8
-
-    if pages_per_sheet == 2: new_page_width, new_page_height = a4_h, a4_w; positions = [(0, 0), (a4_h / 2, 0)]; slot_w, slot_h = a4_h / 2, a4_w
-    elif pages_per_sheet == 3: new_page_width, new_page_height = a4_w, a4_h; positions = [(0, a4_h * 2/3), (0, a4_h / 3), (0, 0)]; slot_w, slot_h = a4_w, a4_h / 3
-    elif pages_per_sheet == 4: new_page_width, new_page_height = a4_w, a4_h; positions = [(0, a4_h * 3/4), (0, a4_h * 2/4), (0, a4_h/4), (0,0)]; slot_w, slot_h = a4_w, a4_h/4
-    else: raise ValueError(f"Unsupported layout: {pages_per_sheet}")
+        new_page_width, new_page_height, positions, slot_w, slot_h = nup_geometry(pages_per_sheet)
 
-    for i in range(0, len(reader.pages), pages_per_sheet):
-        new_page = writer.add_blank_page(width=new_page_width, height=new_page_height)
-        for j, page in enumerate(reader.pages[i : i + pages_per_sheet]):
-            p_w, p_h = page.mediabox.width, page.mediabox.height
-            if p_w == 0 or p_h == 0: continue
-            scale = min(slot_w / p_w, slot_h / p_h)
-            tx = positions[j][0] + (slot_w - p_w * scale) / 2
-            ty = positions[j][1] + (slot_h - p_h * scale) / 2
+        for i in range(0, len(reader.pages), pages_per_sheet):
+            new_page = writer.add_blank_page(width=new_page_width, height=new_page_height)
+            for j, page in enumerate(reader.pages[i : i + pages_per_sheet]):
+                p_w, p_h = page.mediabox.width, page.mediabox.height
+                if p_w == 0 or p_h == 0: continue
+                scale = min(slot_w / p_w, slot_h / p_h)
+                tx = positions[j][0] + (slot_w - p_w * scale) / 2
+                ty = positions[j][1] + (slot_h - p_h * scale) / 2
             
-            # [DEFINITIVE FIX] This is the correct method: Apply the transformation
-            # to the source page *before* merging it onto the new blank page.
-            page.add_transformation(Transformation().scale(scale).translate(tx, ty))
-            new_page.merge_page(page)
+                # [DEFINITIVE FIX] This is the correct method: Apply the transformation
+                # to the source page *before* merging it onto the new blank page.
+                page.add_transformation(Transformation().scale(scale).translate(tx, ty))
+                new_page.merge_page(page)
             
-    with open(output_pdf_path, "wb") as f: writer.write(f)
+        with open(output_pdf_path, "wb") as f: writer.write(f)
 
 # --- Entry Point ---
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     if GS_EXECUTABLE is None: messagebox.showerror("Critical Error", "Ghostscript not found! Please ensure the executable was built correctly with the Ghostscript directory.")
     else: root = tk.Tk(); app = PdfToolApp(root); root.mainloop()
\ No newline at end of file
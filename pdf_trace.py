@@ -0,0 +1,81 @@
+"""
+Timing spans for the PDF Processor Suite, exported as Chrome trace-event JSON for Perfetto
+(ui.perfetto.dev) or chrome://tracing.
+
+Tracing is off unless started: pdf_cli --trace out.json, or the PDF_PROCESSOR_TRACE environment
+variable (a file path) for the GUIs. While it is off, span() hands back one shared no-op context
+manager, so instrumented code pays a function call and nothing else.
+
+    with span('render', file='deck.pdf', page=12): ...
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+TRACE_ENV = 'PDF_PROCESSOR_TRACE'
+NULL_SPAN = contextlib.nullcontext()
+# Trace events recorded so far, or None while tracing is off.
+events = None
+
+class Span:
+    """Records one complete ("X") trace event covering the with block, nested by time on its thread."""
+    __slots__ = ('name', 'args', 'start')
+    def __init__(self, name, args): self.name = name; self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns(); return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None: self.args['error'] = exc_type.__name__
+        # perf_counter is a system-wide monotonic clock, so spans from pool workers line up with the main process.
+        if events is not None: events.append({'name': self.name, 'cat': 'pipeline', 'ph': 'X', 'ts': self.start / 1000, 'dur': (end - self.start) / 1000,
+                                              'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': self.args})
+
+def span(name, **args):
+    """Returns a context manager that times its block as a span called name; args (page, file, ...) are attached to it."""
+    if events is None: return NULL_SPAN
+    return Span(name, args)
+
+def tracing_enabled(): return events is not None
+
+def start_tracing():
+    """Starts recording spans, dropping any left from an earlier trace."""
+    global events
+    events = []
+
+def stop_tracing():
+    """Stops recording and returns the events recorded since start_tracing()."""
+    global events
+    recorded, events = events or [], None
+    return recorded
+
+def add_events(new_events):
+    """Adds events recorded in another process (see call_traced)."""
+    if events is not None: events.extend(new_events)
+
+def call_traced(func, *args):
+    """Runs func(*args) with tracing on and returns (result, events). Used for pool work when the caller is tracing."""
+    start_tracing()
+    try: result = func(*args)
+    finally: recorded = stop_tracing()
+    return result, recorded
+
+def save_trace(output_path, trace_events):
+    """Writes trace_events as a Chrome trace-event JSON file, naming the main process and the pool workers."""
+    main_pid = os.getpid()
+    names = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'PDF Processor' if pid == main_pid else f'Pool worker {pid}'}}
+             for pid in sorted({event['pid'] for event in trace_events})]
+    with open(output_path, 'w') as f: json.dump({'traceEvents': names + trace_events, 'displayTimeUnit': 'ms'}, f)
+
+def trace_from_environment():
+    """Starts tracing when PDF_PROCESSOR_TRACE names an output file, and returns that path (or None)."""
+    output_path = os.environ.get(TRACE_ENV)
+    if output_path: start_tracing()
+    return output_path or None
+
+def finish_trace(output_path):
+    """Stops tracing and saves the trace to output_path; a no-op when output_path is None."""
+    if output_path: save_trace(output_path, stop_tracing())
@@ -0,0 +1,69 @@
+"""
+Background preflight of input PDFs for the PDF Processor Suite GUIs.
+
+Files are validated as soon as they are added: a small thread pool opens each one, counts its
+pages and gathers page sizes through the PdfIndex, so broken or password-protected files show up
+in the list before a long job starts, and pressing Process finds every page count already known.
+"""
+import concurrent.futures
+import os
+import queue
+import time
+from pdf_index import open_pdf_index
+
+PREFLIGHT_WORKERS = min(4, os.cpu_count() or 1)
+# Rough cost of rendering and filtering one megapixel on one worker, for time estimates only.
+SECONDS_PER_MEGAPIXEL = 0.05
+
+class PreflightScanner:
+    """
+    Scans files on a thread pool. Results arrive on a queue drained by poll() from the Tk main
+    thread; each is (path, info) with info a pdf_index metadata dict, or (path, exception).
+    """
+    def __init__(self, index=None, workers=PREFLIGHT_WORKERS):
+        self.index = index or open_pdf_index()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preflight')
+        self.futures = {}; self.results = queue.Queue()
+
+    def submit(self, path):
+        """Starts scanning path unless it is already being scanned."""
+        if path in self.futures and not self.futures[path].done(): return
+        future = self.executor.submit(self.index.info, path)
+        future.add_done_callback(lambda f: self.results.put((path, f.exception() or f.result())))
+        self.futures[path] = future
+
+    def poll(self):
+        """Returns the (path, info or exception) results that arrived since the last call, without blocking."""
+        ready = []
+        while True:
+            try: ready.append(self.results.get_nowait())
+            except queue.Empty: return ready
+
+    def pending(self): return any(not future.done() for future in self.futures.values())
+
+    def page_count(self, path):
+        """Returns the page count of path, waiting for its scan if one is running; raises as PdfReader would."""
+        if path in self.futures: concurrent.futures.wait([self.futures[path]])
+        return self.index.page_count(path) # Served from the index; re-checks that the file did not change since.
+
+    def save(self): self.index.save()
+
+def estimate_seconds(infos, workers):
+    """Estimates how long processing the documents described by infos takes on workers workers."""
+    return sum(info['render_megapixels'] for info in infos) * SECONDS_PER_MEGAPIXEL / max(1, workers)
+
+def preflight_note(result):
+    """Returns the listbox suffix for a preflight result: pending, page count (and encryption), or the error."""
+    if result is None: return "  (checking...)"
+    if isinstance(result, Exception): return f"  (UNREADABLE: {result})"
+    return f"  ({result['page_count']} pages{', encrypted' if result['encrypted'] else ''})"
+
+def preflight_summary(file_list_data, workers):
+    """Returns the status line for the file list: files, known pages, estimated processing time, problems."""
+    results = [item.get('preflight') for item in file_list_data]
+    infos = [result for result in results if isinstance(result, dict)]
+    text = f"{len(file_list_data)} file(s) in list"
+    if infos: text += f", {sum(info['page_count'] for info in infos)} pages, about {time.strftime('%M:%S', time.gmtime(estimate_seconds(infos, workers)))} to process"
+    if (broken := sum(isinstance(result, Exception) for result in results)): text += f", {broken} unreadable"
+    if None in results: text += ", checking..."
+    return text
@@ -0,0 +1,159 @@
+"""
+Rasterizers besides Ghostscript for the PDF Processor Suite.
+
+Ghostscript (the executable, or its library; see gs_library) stays the reference renderer, but
+poppler's pdftoppm, pdfium (pypdfium2) and MuPDF (PyMuPDF) are much faster on some decks. Every
+rasterizer here starts a render that behaves like the Ghostscript process iter_page_rasters reads:
+binary PNM pages on .stdout in page order, plus poll(), wait() and kill(). pdftoppm runs as a
+process; pdfium and MuPDF render in-process on a thread that writes their pages into a pipe.
+"auto" picks the fastest acceptable one for each job (see pdf_engine.choose_rasterizer).
+"""
+import importlib
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+RASTERIZER_ENV = 'PDF_PROCESSOR_RASTERIZER'
+RASTERIZERS = ('ghostscript', 'pdftoppm', 'pdfium', 'mupdf')
+# Rasterizer used when a job names none: one of RASTERIZERS, or "auto". Names that cannot run here render with Ghostscript.
+DEFAULT_RASTERIZER = os.environ.get(RASTERIZER_ENV, 'ghostscript').lower()
+# Python modules of the in-process rasterizers, tried in order (PyMuPDF was imported as fitz before 1.24).
+RASTERIZER_MODULES = {'pdfium': ('pypdfium2',), 'mupdf': ('pymupdf', 'fitz')}
+CREATION_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+# Bytes copied at a time when several pdftoppm calls are chained into one stream.
+COPY_CHUNK_BYTES = 1024 * 1024
+
+# Neither pdfium nor MuPDF may be entered from two threads at once (the thumbnail grid renders in the background).
+library_lock = threading.Lock()
+
+def reset_after_fork():
+    """A forked pool worker starts with a free lock: the parent's may have been held by the thumbnail thread, which the child does not have."""
+    global library_lock
+    library_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'): os.register_at_fork(after_in_child=reset_after_fork)
+
+def rasterizer_module(name):
+    """Returns the imported Python module of an in-process rasterizer, or None when it is not installed."""
+    for module_name in RASTERIZER_MODULES.get(name, ()):
+        try: return importlib.import_module(module_name)
+        except ImportError: continue
+    return None
+
+def rasterizer_available(name, gs_executable=None):
+    """Returns whether rasterizer name can run here."""
+    if name == 'ghostscript': return bool(gs_executable)
+    if name == 'pdftoppm': return shutil.which('pdftoppm') is not None
+    return rasterizer_module(name) is not None
+
+def available_rasterizers(gs_executable=None):
+    """Returns the names of the rasterizers that can run here, Ghostscript first."""
+    return [name for name in RASTERIZERS if rasterizer_available(name, gs_executable)]
+
+def page_ranges(page_nums):
+    """Splits ascending page_nums into (first, last) runs of consecutive pages."""
+    ranges = []
+    for page_num in page_nums:
+        if ranges and page_num == ranges[-1][1] + 1: ranges[-1][1] = page_num
+        else: ranges.append([page_num, page_num])
+    return [tuple(page_range) for page_range in ranges]
+
+def pnm_header(width, height, gray):
+    return f"{'P5' if gray else 'P6'}\n{width} {height}\n255\n".encode()
+
+class RenderKilled(Exception):
+    """Raised in a render thread once its render is killed."""
+
+class ThreadRender:
+    """
+    A render that produce(render) writes on a thread, page by page, with render.write. The pages are
+    read from .stdout like a process's output. kill() makes the next write fail and kills the child
+    process that produce runs, if any.
+    """
+    def __init__(self, args, produce, stderr_file):
+        self.args = args; self.stderr_file = stderr_file; self.killed = False; self.returncode = None; self.child = None
+        read_fd, self.write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd, 'rb')
+        self.thread = threading.Thread(target=self.run, args=(produce,), name=f'{args[0]}-render', daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        view = memoryview(data).cast('B'); written = 0
+        while written < len(view):
+            if self.killed: raise RenderKilled()
+            written += os.write(self.write_fd, view[written:])
+
+    def run(self, produce):
+        try: produce(self); self.returncode = 0
+        except Exception as e:
+            # A killed render, or a reader that went away, needs no message.
+            if not self.killed and not isinstance(e, (RenderKilled, BrokenPipeError)): self.stderr_file.write(f"{self.args[0]}: {e}\n".encode(errors='replace'))
+            self.returncode = 1
+        finally: os.close(self.write_fd)
+
+    def poll(self): return self.returncode
+    def wait(self): self.thread.join(); return self.returncode
+    def kill(self):
+        self.killed = True
+        if self.child is not None and self.child.poll() is None: self.child.kill()
+
+def run_commands(render, commands):
+    """Runs commands one after another, passing each one's stdout on to render."""
+    for command in commands:
+        render.child = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=render.stderr_file, creationflags=CREATION_FLAGS)
+        with render.child.stdout as output:
+            while (chunk := output.read(COPY_CHUNK_BYTES)): render.write(chunk)
+        if render.child.wait() != 0: raise subprocess.CalledProcessError(render.child.returncode, command)
+
+def start_pdftoppm(pdf_path, page_nums, dpi, gray, stderr_file):
+    """pdftoppm writes PPM (PGM with -gray) to stdout when given no output name; it takes one page range per call."""
+    commands = [[shutil.which('pdftoppm'), '-r', str(dpi), '-f', str(first), '-l', str(last)] + (['-gray'] if gray else []) + [pdf_path] for first, last in page_ranges(page_nums)]
+    if len(commands) == 1: return subprocess.Popen(commands[0], stdout=subprocess.PIPE, stderr=stderr_file, creationflags=CREATION_FLAGS)
+    return ThreadRender(commands[0], lambda render: run_commands(render, commands), stderr_file)
+
+def render_pdfium(render, pdfium, document, page_nums, dpi, gray):
+    try:
+        for page_num in page_nums:
+            with library_lock:
+                page = document[page_num - 1]
+                bitmap = page.render(scale=dpi / 72, grayscale=gray, rev_byteorder=True); page.close()
+            pixels = bitmap.to_numpy() # a view of the bitmap, which stays open until the page is written
+            render.write(pnm_header(pixels.shape[1], pixels.shape[0], gray)); render.write(pixels if pixels.flags.c_contiguous else pixels.tobytes()) # rows may be padded
+            bitmap.close()
+    finally:
+        with library_lock: document.close()
+
+def render_mupdf(render, pymupdf, document, page_nums, dpi, gray):
+    try:
+        for page_num in page_nums:
+            with library_lock: data = document[page_num - 1].get_pixmap(dpi=dpi, colorspace=pymupdf.csGRAY if gray else pymupdf.csRGB, alpha=False).tobytes('pnm')
+            render.write(data)
+    finally:
+        with library_lock: document.close()
+
+def open_document(name, module, pdf_path, page_nums, dpi, max_pixels):
+    """Opens pdf_path with an in-process rasterizer; returns None when a page would have more than max_pixels pixels."""
+    with library_lock:
+        document = module.PdfDocument(pdf_path) if name == 'pdfium' else module.open(pdf_path)
+        try:
+            sizes = [document[page_num - 1].get_size() if name == 'pdfium' else (document[page_num - 1].rect.width, document[page_num - 1].rect.height) for page_num in page_nums]
+        except Exception: sizes = [] # A missing page is reported by the render itself.
+        if max_pixels is not None and any(width * height * (dpi / 72) ** 2 > max_pixels for width, height in sizes): document.close(); return None
+    return document
+
+def start_rasterizer(name, pdf_path, page_nums, dpi, gray=False, stderr_file=None, max_pixels=None):
+    """
+    Starts rendering page_nums of pdf_path at dpi with rasterizer name and returns the running
+    render, or None when name is Ghostscript or cannot run here, so the caller uses Ghostscript.
+    The in-process rasterizers hold a whole page in memory; renders with a page over max_pixels
+    are left to Ghostscript as well, which can be read in strips.
+    """
+    if name == 'pdftoppm' and rasterizer_available(name): return start_pdftoppm(pdf_path, page_nums, dpi, gray, stderr_file)
+    if name not in RASTERIZER_MODULES or (module := rasterizer_module(name)) is None: return None
+    try: document = open_document(name, module, pdf_path, page_nums, dpi, max_pixels)
+    except Exception: return None # Unreadable here; Ghostscript gets to try (and report) it.
+    if document is None: return None
+    produce = render_pdfium if name == 'pdfium' else render_mupdf
+    return ThreadRender([name, pdf_path], lambda render: produce(render, module, document, page_nums, dpi, gray), stderr_file)
@@ -0,0 +1,52 @@
+"""
+Regression tests for job_journal: n-up jobs whose page count is not a multiple of the layout.
+Run with: python -m unittest test_job_journal
+"""
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+from pypdf import PdfReader
+from job_journal import JobJournal
+
+def page_image():
+    """A small gray page, as the raster pipeline hands them to the journal."""
+    img = Image.new('L', (170, 220), 200); img.info['dpi'] = (20, 20)
+    return img
+
+class PartialSheetTest(unittest.TestCase):
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp(prefix='journal-test-')
+        self.addCleanup(shutil.rmtree, self.job_dir, True)
+
+    def run_job(self, pages, pages_per_sheet, checkpoint_pages=25):
+        journal = JobJournal(self.job_dir, 'key', pages_per_sheet, checkpoint_pages)
+        for _ in range(pages): journal.add_page(page_image())
+        output_path = f"{self.job_dir}/out.pdf"
+        journal.finish(output_path, pages)
+        with open(output_path, 'rb') as f: return journal, len(PdfReader(f).pages)
+
+    def test_finish_keeps_last_partial_sheet(self):
+        for pages, pages_per_sheet, sheets in ((5, 2, 3), (6, 4, 2), (1, 3, 1), (7, 1, 7)):
+            with self.subTest(pages=pages, pages_per_sheet=pages_per_sheet):
+                shutil.rmtree(self.job_dir); journal, written = self.run_job(pages, pages_per_sheet)
+                self.assertEqual(written, sheets)
+                self.assertEqual(journal.done_pages, pages)
+
+    def test_finish_across_checkpoint_parts(self):
+        journal, written = self.run_job(9, 2, checkpoint_pages=4)
+        self.assertEqual((written, journal.done_pages, len(journal.parts)), (5, 9, 3))
+
+    def test_checkpoint_drops_partial_sheet(self):
+        journal = JobJournal(self.job_dir, 'key', 2)
+        for _ in range(5): journal.add_page(page_image())
+        journal.close() # An interrupted job: the half-filled sheet is redone on resume.
+        self.assertEqual(journal.done_pages, 4)
+        self.assertEqual(JobJournal(self.job_dir, 'key', 2).done_pages, 4)
+
+    def test_finish_without_pages_raises(self):
+        journal = JobJournal(self.job_dir, 'key', 2)
+        with self.assertRaises(ValueError): journal.finish(f"{self.job_dir}/out.pdf", 3)
+
+if __name__ == '__main__':
+    unittest.main()
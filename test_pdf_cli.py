@@ -0,0 +1,41 @@
+"""
+Tests for pdf_cli's command line: options given next to --job win over the job file.
+Run with: python -m unittest test_pdf_cli
+"""
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import pdf_cli
+
+class JobOverrideTest(unittest.TestCase):
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp(prefix='cli-test-')
+        self.addCleanup(shutil.rmtree, self.job_dir, True)
+        self.job_path = f"{self.job_dir}/job.json"
+        with open(self.job_path, 'w', encoding='utf-8') as f:
+            json.dump({'defaults': {'layout': 2, 'jpeg_quality': 90}, 'jobs': [{'output': 'out.pdf', 'files': ['deck.pdf'], 'dpi': 150}]}, f)
+
+    def run_jobs(self, *argv):
+        """Runs main with argv and returns the keyword arguments each job was run with."""
+        stats = {'output': 'out.pdf', 'pages': 1, 'seconds': 1.0, 'pages_per_second': 1.0}
+        with mock.patch.object(pdf_cli, 'run_job', return_value=stats) as run_job, mock.patch.object(pdf_cli, 'gs_library_from_environment'), \
+             mock.patch.object(pdf_cli, 'find_ghostscript_executable', return_value='gs'), mock.patch('builtins.print'):
+            self.assertEqual(pdf_cli.main(list(argv)), 0)
+        return [{**job, **overrides} for (job,), overrides in run_job.call_args_list]
+
+    def test_command_line_options_win_over_job_file(self):
+        job, = self.run_jobs('--job', self.job_path, '--layout', '4', '--no-invert', '--no-monochrome', '--filter', 'bright', '--invert-engine', 'vector',
+                             '--dpi', '200', '--target-dpi', '250', '--max-dpi', '300', '--jpeg-quality', '60')
+        self.assertEqual({key: job[key] for key in ('layout', 'invert', 'monochrome', 'invert_engine', 'dpi', 'target_dpi', 'max_dpi', 'jpeg_quality')},
+                         {'layout': 4, 'invert': False, 'monochrome': False, 'invert_engine': 'vector', 'dpi': 200, 'target_dpi': 250, 'max_dpi': 300, 'jpeg_quality': 60})
+        self.assertEqual(job['thresholds'], pdf_cli.BRIGHT_MONOCHROME)
+
+    def test_job_file_keeps_options_not_given(self):
+        job, = self.run_jobs('--job', self.job_path)
+        self.assertEqual((job['layout'], job['jpeg_quality'], job['dpi']), (2, 90, 150))
+        for key in ('invert', 'monochrome', 'thresholds', 'target_dpi', 'max_dpi', 'invert_engine'): self.assertNotIn(key, job)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Regression tests for vector_invert: XObjects shared between inverted and untouched pages.
+Run with: python -m unittest test_vector_invert
+"""
+import shutil
+import tempfile
+import unittest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+from vector_invert import write_inverted_pdf
+
+def gray_image():
+    """A small 8-bit gray image XObject."""
+    image = DecodedStreamObject()
+    image.update({NameObject('/Type'): NameObject('/XObject'), NameObject('/Subtype'): NameObject('/Image'), NameObject('/Width'): NumberObject(4),
+                  NameObject('/Height'): NumberObject(4), NameObject('/ColorSpace'): NameObject('/DeviceGray'), NameObject('/BitsPerComponent'): NumberObject(8)})
+    image.set_data(bytes(range(0, 256, 16)))
+    return image.flate_encode()
+
+class SharedXObjectTest(unittest.TestCase):
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp(prefix='vector-invert-test-')
+        self.addCleanup(shutil.rmtree, self.job_dir, True)
+        writer = PdfWriter()
+        image = writer._add_object(gray_image())
+        resources = writer._add_object(DictionaryObject({NameObject('/XObject'): DictionaryObject({NameObject('/Im0'): image})}))
+        for _ in range(2):
+            page = writer.add_blank_page(100, 100)
+            content = DecodedStreamObject(); content.set_data(b"q 100 0 0 100 0 0 cm /Im0 Do Q")
+            page[NameObject('/Resources')] = resources; page[NameObject('/Contents')] = writer._add_object(content)
+        self.source_path = f"{self.job_dir}/source.pdf"
+        with open(self.source_path, 'wb') as f: writer.write(f)
+
+    def images(self, pages_to_invert):
+        output_path = f"{self.job_dir}/out.pdf"
+        write_inverted_pdf([(self.source_path, 1), (self.source_path, 2)], output_path, pages_to_invert)
+        reader = PdfReader(output_path)
+        return [page['/Resources']['/XObject']['/Im0'].get_object() for page in reader.pages]
+
+    def test_unselected_page_keeps_shared_image(self):
+        light, dark = self.images({(self.source_path, 2)})
+        self.assertNotIn('/Decode', light)
+        self.assertEqual(dark['/Decode'], [1, 0])
+        self.assertEqual(light.get_data(), dark.get_data())
+
+    def test_inverted_pages_share_one_copy(self):
+        first, second = self.images(None)
+        self.assertEqual(first['/Decode'], [1, 0])
+        self.assertEqual(first.indirect_reference.idnum, second.indirect_reference.idnum)
+
+if __name__ == '__main__':
+    unittest.main()
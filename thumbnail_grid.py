@@ -0,0 +1,219 @@
+"""
+Lazy thumbnail view of one PDF for the Page Editor of the PDF Processor Suite.
+
+Only the thumbnails scrolled into view are rendered, at a few DPI, by one background thread that
+always works on the latest visible set; rasters are cached per file and page, and the
+invert/monochrome preview is made from them with process_image_intelligently, so it shows what
+the output will look like. Clicking a page removes it (or keeps it again); the Page Editor's
+range spec is updated to match.
+"""
+import math
+import os
+import queue
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import BooleanVar, Checkbutton
+from PIL import Image, ImageTk
+from pdf_engine import iter_page_rasters, group_page_runs, process_image_intelligently, format_page_spec
+
+THUMB_BOX = 150 # Thumbnails are fitted into a square of this many pixels
+THUMB_GAP = 12
+LABEL_HEIGHT = 16
+MIN_THUMB_DPI, MAX_THUMB_DPI = 4, 48
+# Pages per Ghostscript call; short runs let a scroll interrupt rendering quickly.
+THUMB_RUN_LENGTH = 8
+THUMB_CACHE_BYTES = 64 * 1024 ** 2
+
+def thumbnail_dpi(page_size):
+    """Returns the render DPI that fits a page of page_size (points) into THUMB_BOX pixels."""
+    width, height = page_size
+    if width <= 0 or height <= 0: return MIN_THUMB_DPI
+    return int(max(MIN_THUMB_DPI, min(MAX_THUMB_DPI, THUMB_BOX * 72.0 / max(width, height))))
+
+# --- Render Cache ---
+class ThumbnailCache:
+    """In-memory LRU of thumbnail rasters keyed by (file key, page_num, dpi), capped at max_bytes. Thread-safe."""
+    def __init__(self, max_bytes=THUMB_CACHE_BYTES):
+        self.max_bytes = max_bytes; self.total_bytes = 0
+        self.rasters = OrderedDict(); self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            raster = self.rasters.get(key)
+            if raster is not None: self.rasters.move_to_end(key)
+            return raster
+
+    def put(self, key, raster):
+        with self.lock:
+            if key in self.rasters: return
+            self.rasters[key] = raster; self.total_bytes += raster.nbytes
+            while self.total_bytes > self.max_bytes and len(self.rasters) > 1:
+                self.total_bytes -= self.rasters.popitem(last=False)[1].nbytes
+
+# Shared by every thumbnail window of the process, so reopening a file's pages is instant.
+THUMBNAIL_CACHE = ThumbnailCache()
+
+class ThumbnailRenderer:
+    """
+    Renders requested thumbnails on a daemon thread. request() replaces whatever was asked before,
+    so after a scroll only the pages now in view are rendered. Finished pages, or an exception if
+    Ghostscript fails, are put on results.
+    """
+    def __init__(self, gs_executable, cache=THUMBNAIL_CACHE):
+        self.gs_executable = gs_executable; self.cache = cache
+        self.results = queue.Queue()
+        self.condition = threading.Condition(); self.wanted = None; self.generation = 0; self.closed = False
+        threading.Thread(target=self.run, name='thumbnails', daemon=True).start()
+
+    def request(self, file_key, pdf_path, page_dpis):
+        """Asks for the (page_num, dpi) thumbnails of pdf_path; file_key identifies the file version in the cache."""
+        with self.condition:
+            self.wanted = (file_key, pdf_path, page_dpis); self.generation += 1; self.condition.notify()
+
+    def close(self):
+        with self.condition: self.closed = True; self.generation += 1; self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.wanted is None and not self.closed: self.condition.wait()
+                if self.closed: return
+                (file_key, pdf_path, page_dpis), generation, self.wanted = self.wanted, self.generation, None
+            missing = sorted((page_num, dpi) for page_num, dpi in page_dpis if self.cache.get((file_key, page_num, dpi)) is None)
+            runs = group_page_runs([(pdf_path, page_num) for page_num, _ in missing], [dpi for _, dpi in missing], THUMB_RUN_LENGTH)
+            try:
+                for path, page_nums, dpi in runs:
+                    if self.generation != generation: break # A newer request supersedes this one.
+                    rasters = iter_page_rasters(self.gs_executable, path, page_nums, dpi)
+                    try:
+                        for page_num, raster in zip(page_nums, rasters):
+                            self.cache.put((file_key, page_num, dpi), raster); self.results.put(page_num)
+                    finally: rasters.close() # Stops Ghostscript if the run was cut short.
+            except Exception as e: self.results.put(e)
+
+# --- Thumbnail Window ---
+class ThumbnailGrid(tk.Toplevel):
+    """
+    Scrollable grid of page thumbnails for one PDF. Only the rows in view (plus one on each side)
+    have canvas items and images, so a 500-page deck costs no more than a screenful.
+
+    page_sizes: shown (width, height) in points of every page, e.g. from PdfIndex.info().
+    removed_pages: page numbers currently removed. preview_options: callable returning
+    (do_invert, do_monochrome, thresholds). on_change: called with the new range spec after a click.
+    """
+    def __init__(self, master, gs_executable, pdf_path, page_sizes, removed_pages, preview_options, on_change, cache=THUMBNAIL_CACHE):
+        super().__init__(master)
+        self.title(f"Pages of {os.path.basename(pdf_path)}"); self.geometry("720x640")
+        self.pdf_path = pdf_path; self.page_dpis = [thumbnail_dpi(size) for size in page_sizes]
+        self.file_key = (os.path.abspath(pdf_path), os.stat(pdf_path).st_mtime_ns)
+        self.removed = set(removed_pages); self.preview_options = preview_options; self.on_change = on_change
+        self.cache = cache; self.renderer = ThumbnailRenderer(gs_executable, cache)
+        self.items = {}; self.photos = {}; self.columns = 0; self.refresh_job = None; self.closed = False
+
+        top_frame = tk.Frame(self); top_frame.pack(fill="x", padx=5, pady=5)
+        self.preview_var = BooleanVar(value=True); Checkbutton(top_frame, text="Preview invert/monochrome", variable=self.preview_var, command=self.redraw).pack(side="left")
+        self.info_label = tk.Label(top_frame, text="Click a page to remove it, again to keep it.", fg="gray"); self.info_label.pack(side="left", padx=10)
+        grid_frame = tk.Frame(self); grid_frame.pack(fill="both", expand=True)
+        self.canvas = tk.Canvas(grid_frame, bg="#d9d9d9", highlightthickness=0, yscrollincrement=self.cell_height() // 4)
+        scrollbar = tk.Scrollbar(grid_frame, orient="vertical", command=self.canvas.yview); scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.configure(yscrollcommand=lambda first, last: (scrollbar.set(first, last), self.schedule_refresh()))
+        self.canvas.bind("<Configure>", lambda event: self.layout())
+        self.bind("<MouseWheel>", lambda event: self.canvas.yview_scroll(-1 if event.delta > 0 else 1, "units"))
+        self.bind("<Button-4>", lambda event: self.canvas.yview_scroll(-1, "units")) # X11 wheel
+        self.bind("<Button-5>", lambda event: self.canvas.yview_scroll(1, "units"))
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.after(50, self.poll)
+
+    @staticmethod
+    def cell_height(): return THUMB_BOX + LABEL_HEIGHT + THUMB_GAP
+
+    def layout(self):
+        """Recomputes the columns for the window width; a change re-flows the grid."""
+        columns = max(1, (self.canvas.winfo_width() - THUMB_GAP) // (THUMB_BOX + THUMB_GAP))
+        if columns != self.columns:
+            self.columns = columns
+            rows = math.ceil(len(self.page_dpis) / columns)
+            self.canvas.configure(scrollregion=(0, 0, THUMB_GAP + columns * (THUMB_BOX + THUMB_GAP), THUMB_GAP + rows * self.cell_height()))
+            self.clear()
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        if self.refresh_job is None and not self.closed: self.refresh_job = self.after_idle(self.refresh)
+
+    def visible_pages(self):
+        top = self.canvas.canvasy(0); bottom = top + self.canvas.winfo_height()
+        first_row = max(0, int(top // self.cell_height()) - 1); last_row = int(bottom // self.cell_height()) + 1
+        return range(first_row * self.columns + 1, min(len(self.page_dpis), (last_row + 1) * self.columns) + 1)
+
+    def refresh(self):
+        """Drops the canvas items of pages scrolled out of view, draws the ones scrolled in and requests their renders."""
+        self.refresh_job = None
+        if not self.columns: return
+        visible = self.visible_pages()
+        for page_num in [page_num for page_num in self.items if page_num not in visible]:
+            self.canvas.delete(f"page{page_num}"); del self.items[page_num]; self.photos.pop(page_num, None)
+        wanted = []
+        for page_num in visible:
+            if page_num not in self.items: self.draw_cell(page_num)
+            if page_num not in self.photos: wanted.append((page_num, self.page_dpis[page_num - 1]))
+        if wanted: self.renderer.request(self.file_key, self.pdf_path, wanted)
+
+    def cell_origin(self, page_num):
+        row, column = divmod(page_num - 1, self.columns)
+        return THUMB_GAP + column * (THUMB_BOX + THUMB_GAP), THUMB_GAP + row * self.cell_height()
+
+    def draw_cell(self, page_num):
+        x, y = self.cell_origin(page_num); tag = f"page{page_num}"
+        self.items[page_num] = True
+        self.canvas.create_rectangle(x, y, x + THUMB_BOX, y + THUMB_BOX, fill="#f4f4f4", outline="#b0b0b0", tags=(tag,))
+        self.canvas.create_text(x + THUMB_BOX // 2, y + THUMB_BOX + LABEL_HEIGHT // 2 + 1, text=f"Page {page_num}", tags=(tag,))
+        self.canvas.tag_bind(tag, "<Button-1>", lambda event, page_num=page_num: self.toggle_page(page_num))
+        self.draw_thumbnail(page_num)
+        self.draw_removed_mark(page_num)
+
+    def draw_thumbnail(self, page_num):
+        """Draws the cached thumbnail of page_num, filtered when the preview is on; does nothing if it is not rendered yet."""
+        raster = self.cache.get((self.file_key, page_num, self.page_dpis[page_num - 1]))
+        if raster is None or page_num not in self.items: return
+        do_invert, do_monochrome, thresholds = self.preview_options()
+        if self.preview_var.get() and (do_invert or do_monochrome): img = process_image_intelligently(raster, do_invert, do_monochrome, thresholds)
+        else: img = Image.fromarray(raster)
+        self.photos[page_num] = ImageTk.PhotoImage(img.convert('L') if img.mode == '1' else img)
+        x, y = self.cell_origin(page_num)
+        image_item = self.canvas.create_image(x + THUMB_BOX // 2, y + THUMB_BOX // 2, image=self.photos[page_num], tags=(f"page{page_num}",))
+        self.canvas.tag_raise(f"removed{page_num}", image_item)
+
+    def draw_removed_mark(self, page_num):
+        x, y = self.cell_origin(page_num); tags = (f"page{page_num}", f"removed{page_num}")
+        self.canvas.delete(f"removed{page_num}")
+        if page_num not in self.removed: return
+        self.canvas.create_rectangle(x, y, x + THUMB_BOX, y + THUMB_BOX, fill="white", stipple="gray50", outline="red", width=2, tags=tags)
+        self.canvas.create_line(x + 8, y + 8, x + THUMB_BOX - 8, y + THUMB_BOX - 8, fill="red", width=3, tags=tags)
+        self.canvas.create_line(x + THUMB_BOX - 8, y + 8, x + 8, y + THUMB_BOX - 8, fill="red", width=3, tags=tags)
+
+    def toggle_page(self, page_num):
+        self.removed ^= {page_num}
+        self.draw_removed_mark(page_num)
+        self.info_label.config(text=f"{len(self.removed)} of {len(self.page_dpis)} pages removed.", fg="black")
+        self.on_change(format_page_spec(self.removed))
+
+    def poll(self):
+        """Draws thumbnails as the renderer finishes them."""
+        if self.closed: return
+        while True:
+            try: result = self.renderer.results.get_nowait()
+            except queue.Empty: break
+            if isinstance(result, Exception): self.info_label.config(text=f"Preview failed: {result}", fg="red")
+            elif result not in self.photos: self.draw_thumbnail(result)
+        self.after(50, self.poll)
+
+    def clear(self):
+        self.canvas.delete("all"); self.items.clear(); self.photos.clear()
+
+    def redraw(self):
+        self.clear(); self.schedule_refresh()
+
+    def close(self):
+        self.closed = True; self.renderer.close(); self.destroy()
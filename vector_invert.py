@@ -0,0 +1,195 @@
+"""
+Vector-preserving color inversion for the PDF Processor Suite.
+
+Instead of rasterizing pages, the color operators in every content stream are rewritten and
+embedded images are flipped, so inverted pages keep their vector text and graphics. XObjects are
+inverted as copies, so pages that are not inverted keep drawing the originals.
+"""
+import os
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, ContentStream, DictionaryObject, FloatObject, IndirectObject, NameObject, NumberObject, StreamObject
+from PIL import ImageOps
+from pdf_trace import span
+
+# Number of color components of every color space kind the inverter knows how to flip.
+COMPONENTS = {'gray': 1, 'rgb': 3, 'cmyk': 4}
+DEVICE_KINDS = {'/DeviceGray': 'gray', '/CalGray': 'gray', '/G': 'gray', '/DeviceRGB': 'rgb', '/CalRGB': 'rgb', '/RGB': 'rgb', '/DeviceCMYK': 'cmyk', '/CMYK': 'cmyk'}
+# Selecting a color space resets the color to black; the inverted page starts from white instead.
+WHITE = {'gray': [1], 'rgb': [1, 1, 1], 'cmyk': [0, 0, 0, 0]}
+
+def resource_dict(resources, key):
+    """Returns the resolved sub-dictionary key of a resources dictionary, or an empty dict."""
+    entry = resources.get(key) if resources is not None else None
+    return entry.get_object() if entry is not None else {}
+
+def duplicate(obj, writer):
+    """Adds a shallow copy of a dictionary or stream to writer and returns its reference; the copy shares the original's children."""
+    copy = obj.__class__(); copy.update(obj)
+    if isinstance(obj, StreamObject): copy._data = obj._data
+    return writer._add_object(copy)
+
+def drop_unreachable(writer):
+    """Drops the objects of writer that the document no longer reaches, such as originals only inverted pages used."""
+    reached = set(); pending = [obj.indirect_reference for obj in (writer.root_object, writer._info) if obj is not None]
+    while pending:
+        obj = pending.pop()
+        if isinstance(obj, IndirectObject):
+            if obj.idnum in reached: continue
+            reached.add(obj.idnum); obj = obj.get_object()
+        if isinstance(obj, dict): pending.extend(obj.values())
+        elif isinstance(obj, list): pending.extend(obj)
+    for idnum in range(1, len(writer._objects) + 1):
+        if idnum not in reached: writer._objects[idnum - 1] = None
+
+# --- Color Math ---
+def invert_cmyk(c, m, y, k):
+    """Inverts a CMYK color through RGB and returns it as CMYK again."""
+    r, g, b = (1 - (1 - v) * (1 - k) for v in (c, m, y))
+    new_k = 1 - max(r, g, b)
+    if new_k >= 1: return [0, 0, 0, 1]
+    return [(1 - v - new_k) / (1 - new_k) for v in (r, g, b)] + [new_k]
+
+def invert_color_operands(kind, operands):
+    """Returns the inverted operands of a color operator, or the originals when they are not plain components."""
+    if kind is None or len(operands) != COMPONENTS[kind] or not all(isinstance(v, (FloatObject, NumberObject)) for v in operands): return operands
+    values = [float(v) for v in operands]
+    inverted = invert_cmyk(*values) if kind == 'cmyk' else [1 - v for v in values]
+    return [FloatObject(round(v, 4)) for v in inverted]
+
+def color_space_kind(color_space, resources):
+    """Returns 'gray', 'rgb' or 'cmyk' for a color space name or array, or None for spaces that are left alone."""
+    color_space = color_space.get_object() if color_space is not None else None
+    if isinstance(color_space, NameObject):
+        if color_space in DEVICE_KINDS: return DEVICE_KINDS[color_space]
+        named = resource_dict(resources, '/ColorSpace').get(color_space)
+        return color_space_kind(named, None) if named is not None else None
+    if isinstance(color_space, ArrayObject) and color_space:
+        family = color_space[0]
+        if family == '/ICCBased': return {1: 'gray', 3: 'rgb', 4: 'cmyk'}.get(color_space[1].get_object().get('/N'))
+        if family in DEVICE_KINDS: return DEVICE_KINDS[family]
+    return None
+
+# --- Images ---
+def invert_image_xobject(image, resources, writer):
+    """Inverts a copied image XObject in place, by flipping its Decode array where possible and re-encoding it otherwise."""
+    if image.get('/ImageMask'): return # Stencil masks are painted with the (already inverted) fill color.
+    color_space = image.get('/ColorSpace')
+    if isinstance(color_space.get_object() if color_space is not None else None, ArrayObject) and color_space.get_object()[0] == '/Indexed':
+        invert_indexed_palette(image, resources, writer); return
+    kind = color_space_kind(color_space, resources)
+    if kind in ('gray', 'rgb') and image.get('/Filter') not in ('/JPXDecode', ['/JPXDecode']):
+        # Decode [1 0] maps every sample to its complement, so the stream is kept byte for byte.
+        decode = image.get('/Decode') or ArrayObject([NumberObject(0), NumberObject(1)] * COMPONENTS[kind])
+        image[NameObject('/Decode')] = ArrayObject([decode[i + 1 - 2 * (i % 2)] for i in range(len(decode))])
+        return
+    try: pil_image = image.decode_as_image()
+    except Exception: return # Leave images pypdf cannot decode untouched rather than fail the page.
+    inverted = ImageOps.invert(pil_image.convert('RGB'))
+    image.get_data() # Decode once so pypdf can re-encode the stream with Flate below.
+    for key in ('/DecodeParms', '/Decode'): image.pop(key, None)
+    image[NameObject('/Filter')] = NameObject('/FlateDecode'); image[NameObject('/ColorSpace')] = NameObject('/DeviceRGB'); image[NameObject('/BitsPerComponent')] = NumberObject(8)
+    image.set_data(inverted.tobytes())
+
+def invert_indexed_palette(image, resources, writer):
+    """Gives an image with an Indexed color space over a gray or RGB base its own inverted lookup table."""
+    color_space = ArrayObject(image['/ColorSpace'].get_object())
+    if color_space_kind(color_space[1], resources) not in ('gray', 'rgb'): return
+    if hasattr(color_space[3].get_object(), 'get_data'): color_space[3] = duplicate(color_space[3].get_object(), writer)
+    image[NameObject('/ColorSpace')] = color_space
+    lookup = color_space[3].get_object()
+    table = lookup.get_data() if hasattr(lookup, 'get_data') else bytes(lookup)
+    inverted = bytes(255 - b for b in table)
+    if hasattr(lookup, 'get_data'): lookup.set_data(inverted)
+    else: color_space[3] = type(lookup)(inverted)
+
+def invert_inline_image(settings, resources):
+    """Flips the Decode array of an inline image with a gray or RGB color space."""
+    if settings.get('/IM', settings.get('/ImageMask')): return
+    kind = color_space_kind(settings.get('/CS', settings.get('/ColorSpace')), resources)
+    if kind not in ('gray', 'rgb'): return
+    decode = settings.pop('/D', None) or settings.pop('/Decode', None) or ArrayObject([NumberObject(0), NumberObject(1)] * COMPONENTS[kind])
+    settings[NameObject('/D')] = ArrayObject([decode[i + 1 - 2 * (i % 2)] for i in range(len(decode))])
+
+# --- Content Streams ---
+def invert_content_stream(content, resources):
+    """Rewrites the color operators of a parsed ContentStream in place; the XObjects it draws are inverted with its resources."""
+    resources = resources.get_object() if resources is not None else None
+    fill, stroke = 'gray', 'gray'; saved = []
+    operations = []
+    for operands, operator in content.operations:
+        if operator == b'q': saved.append((fill, stroke))
+        elif operator == b'Q' and saved: fill, stroke = saved.pop()
+        elif operator in (b'g', b'rg', b'k', b'G', b'RG', b'K'):
+            kind = {b'g': 'gray', b'rg': 'rgb', b'k': 'cmyk'}[operator.lower()]
+            if operator.islower(): fill = kind
+            else: stroke = kind
+            operands = invert_color_operands(kind, operands)
+        elif operator in (b'cs', b'CS'):
+            kind = color_space_kind(operands[0], resources)
+            if operator == b'cs': fill = kind
+            else: stroke = kind
+            operations.append((operands, operator))
+            if kind: operations.append(([FloatObject(v) for v in WHITE[kind]], b'sc' if operator == b'cs' else b'SC'))
+            continue
+        elif operator in (b'sc', b'scn', b'SC', b'SCN'):
+            operands = invert_color_operands(fill if operator.islower() else stroke, operands)
+        elif operator == b'INLINE IMAGE':
+            invert_inline_image(operands['settings'], resources)
+        operations.append((operands, operator))
+    content.operations = operations
+
+def inverted_resources(resources, writer, clones):
+    """Returns a direct copy of a resources dictionary whose XObjects are inverted copies, leaving the original to pages that share it."""
+    resources = resources.get_object() if resources is not None else None
+    if resources is None: return None
+    copy = DictionaryObject(resources); xobjects = resource_dict(resources, '/XObject')
+    if xobjects: copy[NameObject('/XObject')] = DictionaryObject({name: inverted_xobject(xobjects.raw_get(name), resources, writer, clones) for name in xobjects})
+    return copy
+
+def inverted_xobject(xobject, parent_resources, writer, clones):
+    """
+    Returns a reference to an inverted copy of a form or image XObject, made once however many inverted
+    pages use it. clones maps the originals to their copies; the originals stay as they are.
+    """
+    original = xobject.get_object()
+    if id(original) in clones: return clones[id(original)]
+    if original.get('/Subtype') not in ('/Image', '/Form'): return xobject
+    clones[id(original)] = reference = duplicate(original, writer); copy = reference.get_object()
+    if copy.get('/Subtype') == '/Image':
+        invert_image_xobject(copy, parent_resources, writer)
+    else:
+        if '/Resources' in copy: copy[NameObject('/Resources')] = inverted_resources(copy['/Resources'], writer, clones)
+        content = ContentStream(copy, writer)
+        invert_content_stream(content, copy.get('/Resources', parent_resources))
+        copy.get_data()
+        copy.pop('/DecodeParms', None); copy[NameObject('/Filter')] = NameObject('/FlateDecode')
+        copy.set_data(content.get_data())
+    return reference
+
+def invert_page(page, writer, clones):
+    """Inverts a page that belongs to writer: paints the paper black and flips every color drawn on it."""
+    content = page.get_contents()
+    if content is None: content = ContentStream(None, writer)
+    if '/Resources' in page: page[NameObject('/Resources')] = inverted_resources(page['/Resources'], writer, clones)
+    invert_content_stream(content, page.get('/Resources'))
+    x0, y0, x1, y1 = (float(v) for v in page.mediabox)
+    # Black paper first, then white as the default fill and stroke color for everything drawn on it.
+    background = [([], b'q'), ([FloatObject(0)], b'g'), ([FloatObject(x0), FloatObject(y0), FloatObject(x1 - x0), FloatObject(y1 - y0)], b're'), ([], b'f'), ([], b'Q'),
+                  ([FloatObject(1)], b'g'), ([FloatObject(1)], b'G')]
+    content.operations = background + content.operations
+    page.replace_contents(content)
+
+def write_inverted_pdf(pages_to_process, output_path, pages_to_invert=None):
+    """
+    Writes the selected (path, page_num) pages to output_path with their colors inverted, keeping
+    them vector. pages_to_invert: optional set of the pages to invert; the others are copied as they are.
+    """
+    writer = PdfWriter(); readers = {}; clones = {}
+    for pdf_path, page_num in pages_to_process:
+        if pdf_path not in readers: readers[pdf_path] = PdfReader(pdf_path)
+        page = writer.add_page(readers[pdf_path].pages[page_num - 1])
+        if pages_to_invert is None or (pdf_path, page_num) in pages_to_invert:
+            with span('vector_invert', file=os.path.basename(pdf_path), page=page_num): invert_page(page, writer, clones)
+    if clones: drop_unreachable(writer)
+    with span('write_pdf', pages=len(pages_to_process)), open(output_path, 'wb') as f: writer.write(f)
+    for reader in readers.values(): reader.stream.close()